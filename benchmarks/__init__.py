@@ -0,0 +1 @@
+""" Load tests of the views against a stand-in Swift proxy. """
@@ -0,0 +1,446 @@
+""" Stand-in Swift proxy and Keystone v3 server for benchmarks.
+
+Serves synthetic accounts whose container listings are computed on the fly,
+so a container can hold millions of objects without using memory. Object
+names are 'dNNNNN/oNNNNNNNNN', grouped into pseudofolders of a configurable
+size. Containers created with PUT hold real, mutable object lists; a
+'X-Fake-Object-Count' header on the PUT fills one with synthetic names,
+which is how the benchmarks prepare containers for delete_container.
+Containers with a '.r:*,.rlistings' read ACL can be read without a token.
+
+Run standalone with
+
+    python -m benchmarks.fakeswift --port 8080 --containers 10 \\
+        --objects 1000000 --latency 0.005
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+TOP = chr(0x10FFFF)
+TEMP_URL_KEY = 'benchmark-temp-url-key'
+LAST_MODIFIED = '2024-01-01T00:00:00.000000'
+
+
+class SyntheticNames(object):
+    """ Sorted sequence of generated object names, never materialized. """
+
+    def __init__(self, count, folder_size):
+        self.count = count
+        self.folder_size = max(1, folder_size)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return 'd%05d/o%09d' % (index // self.folder_size, index)
+
+
+class Container(object):
+
+    def __init__(self, names, object_size):
+        self.names = names
+        self.deleted = set()
+        self.object_size = object_size
+        self.meta = {}
+        self.lock = threading.Lock()
+
+    def object_count(self):
+        return len(self.names) - len(self.deleted)
+
+    def contains(self, name):
+        index = bisect.bisect_left(self.names, name)
+        return (index < len(self.names) and self.names[index] == name and
+                name not in self.deleted)
+
+    def delete(self, name):
+        with self.lock:
+            if not self.contains(name):
+                return False
+            if isinstance(self.names, list):
+                self.names.remove(name)
+            else:
+                self.deleted.add(name)
+            return True
+
+    def put(self, name):
+        with self.lock:
+            if isinstance(self.names, SyntheticNames):
+                self.names = list(self.names)
+            if not self.contains(name):
+                bisect.insort(self.names, name)
+
+    def listing(self, prefix='', delimiter='', marker='', end_marker='',
+                limit=10000, reverse=False):
+        names = self.names
+        lo = bisect.bisect_left(names, prefix) if prefix else 0
+        hi = bisect.bisect_left(names, prefix + TOP) if prefix else len(names)
+        if reverse:
+            if marker:
+                hi = min(hi, bisect.bisect_left(names, marker))
+            if end_marker:
+                lo = max(lo, bisect.bisect_right(names, end_marker))
+        else:
+            if marker:
+                lo = max(lo, bisect.bisect_right(names, marker))
+            if end_marker:
+                hi = min(hi, bisect.bisect_left(names, end_marker))
+
+        out = []
+        index = hi - 1 if reverse else lo
+        while len(out) < limit and lo <= index < hi:
+            name = names[index]
+            step = -1 if reverse else 1
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                subdir = prefix + rest[:rest.index(delimiter) + 1]
+                out.append({'subdir': subdir})
+                if reverse:
+                    index = bisect.bisect_left(names, subdir) - 1
+                else:
+                    index = bisect.bisect_left(names, subdir + TOP)
+                continue
+            if name not in self.deleted:
+                out.append({'name': name, 'bytes': self.object_size,
+                            'hash': 'd41d8cd98f00b204e9800998ecf8427e',
+                            'last_modified': LAST_MODIFIED,
+                            'content_type': 'application/octet-stream'})
+            index += step
+        return out
+
+
+class FakeSwift(object):
+    """ State of the stand-in cluster: tokens and accounts. """
+
+    def __init__(self, accounts=1, containers=10, objects=1000,
+                 folder_size=1000, object_size=1024, latency=0.0,
+                 jitter=0.0, token_lifetime=3600):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_lifetime = token_lifetime
+        self.object_size = object_size
+        self.tokens = {}
+        self.accounts = {}
+        for a in range(accounts):
+            self.accounts['AUTH_bench%d' % a] = {
+                'c%04d' % c: Container(SyntheticNames(objects, folder_size),
+                                       object_size)
+                for c in range(containers)}
+        self.lock = threading.Lock()
+
+    def issue_token(self, account):
+        token = uuid.uuid4().hex
+        expires = datetime.now(timezone.utc) + timedelta(
+            seconds=self.token_lifetime)
+        with self.lock:
+            self.tokens[token] = (account, expires)
+        return token, expires
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeSwift'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def swift(self):
+        return self.server.swift
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, status, data, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        self._send(status, json.dumps(data).encode('utf-8'), headers)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _parse(self):
+        """ Returns (account, container, object, query) of the path """
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query,
+                                             keep_blank_values=True).items()}
+        parts = url.path.split('/', 4)
+        if len(parts) < 3 or parts[1] != 'v1':
+            return (None, None, None, query)
+        container = unquote(parts[3]) if len(parts) > 3 and parts[3] else None
+        obj = unquote(parts[4]) if len(parts) > 4 and parts[4] else None
+        return (parts[2], container, obj, query)
+
+    def _authorized(self, account, container, query):
+        if 'temp_url_sig' in query:
+            return True
+        if self._public(account, container):
+            return True
+        token = self.headers.get('X-Auth-Token')
+        entry = self.swift.tokens.get(token)
+        return (entry is not None and entry[0] == account and
+                entry[1] > datetime.now(timezone.utc))
+
+    def _public(self, account, container):
+        """ Returns whether anyone may read the container, as with a
+        '.r:*,.rlistings' read ACL """
+        c = self.swift.accounts[account].get(container)
+        if c is None or self.command not in ('GET', 'HEAD'):
+            return False
+        acl = ''.join(value for key, value in c.meta.items()
+                      if key.lower() == 'x-container-read')
+        return '.r:*' in acl and '.rlistings' in acl
+
+    def _account_headers(self, account):
+        containers = self.swift.accounts[account]
+        objects = sum(c.object_count() for c in containers.values())
+        return {
+            'X-Account-Container-Count': str(len(containers)),
+            'X-Account-Object-Count': str(objects),
+            'X-Account-Bytes-Used': str(objects * self.swift.object_size),
+            'X-Account-Meta-Temp-Url-Key': TEMP_URL_KEY,
+            'X-Timestamp': '1704067200.00000',
+        }
+
+    def _container_headers(self, container):
+        headers = {
+            'X-Container-Object-Count': str(container.object_count()),
+            'X-Container-Bytes-Used': str(
+                container.object_count() * container.object_size),
+            'X-Timestamp': '1704067200.00000',
+        }
+        headers.update(container.meta)
+        return headers
+
+    def _resolve(self):
+        """ Returns the request target or None once an error was sent """
+        self.swift.delay()
+        account, container, obj, query = self._parse()
+        if account not in self.swift.accounts:
+            self._send(404)
+            return None
+        if not self._authorized(account, container, query):
+            self._send(401)
+            return None
+        containers = self.swift.accounts[account]
+        if container is not None and container not in containers and \
+                self.command != 'PUT':
+            self._send(404)
+            return None
+        return (account, containers, container, obj, query)
+
+    # Keystone
+
+    def _keystone_token(self):
+        body = json.loads(self._body() or b'{}')
+        scope = body.get('auth', {}).get('scope', {}).get('project', {})
+        project = scope.get('name') or 'bench0'
+        account = 'AUTH_%s' % project
+        if account not in self.swift.accounts:
+            self._send(401)
+            return
+        token, expires = self.swift.issue_token(account)
+        host = '%s:%d' % self.server.server_address[:2]
+        self._json(201, {'token': {
+            'expires_at': expires.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'project': {'name': project, 'id': project},
+            'catalog': [{'type': 'object-store', 'name': 'swift',
+                         'endpoints': [{
+                             'interface': 'public', 'region': 'RegionOne',
+                             'url': 'http://%s/v1/%s' % (host, account)}]}],
+        }}, {'X-Subject-Token': token})
+
+    def _keystone_validate(self):
+        entry = self.swift.tokens.get(self.headers.get('X-Subject-Token'))
+        if entry is None:
+            self._send(404)
+            return
+        self._json(200, {'token': {
+            'expires_at': entry[1].strftime('%Y-%m-%dT%H:%M:%S.%fZ')}})
+
+    # Swift
+
+    def do_GET(self):
+        if self.path.startswith('/v3/auth/tokens'):
+            self._keystone_validate()
+            return
+        if self.path.startswith('/info'):
+            self._json(200, {'swift': {'version': 'fake'},
+                             'bulk_delete': {'max_deletes_per_request': 10000,
+                                             'max_failed_deletes': 1000},
+                             'tempurl': {'methods': ['GET', 'HEAD', 'PUT'],
+                                         'allowed_digests': [
+                                             'sha1', 'sha256', 'sha512']}})
+            return
+        target = self._resolve()
+        if target is None:
+            return
+        account, containers, container, obj, query = target
+        if container is None:
+            listing = [{'name': name, 'count': c.object_count(),
+                        'bytes': c.object_count() * c.object_size}
+                       for name, c in sorted(containers.items())]
+            listing = [c for c in listing
+                       if c['name'] > query.get('marker', '')]
+            self._json(200, listing[:int(query.get('limit') or 10000)],
+                       self._account_headers(account))
+        elif obj is None:
+            c = containers[container]
+            listing = c.listing(
+                prefix=query.get('prefix', ''),
+                delimiter=query.get('delimiter', ''),
+                marker=query.get('marker', ''),
+                end_marker=query.get('end_marker', ''),
+                limit=int(query.get('limit') or 10000),
+                reverse=query.get('reverse') in ('on', 'true', '1'))
+            self._json(200, listing, self._container_headers(c))
+        elif containers[container].contains(obj):
+            self._send(200, b'x' * containers[container].object_size,
+                       {'Content-Type': 'application/octet-stream'})
+        else:
+            self._send(404)
+
+    def do_HEAD(self):
+        target = self._resolve()
+        if target is None:
+            return
+        account, containers, container, obj, query = target
+        if container is None:
+            self._send(204, headers=self._account_headers(account))
+        elif obj is None:
+            self._send(204, headers=self._container_headers(
+                containers[container]))
+        elif containers[container].contains(obj):
+            self._send(200, headers={
+                'Content-Length': str(containers[container].object_size)})
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        if self.path.startswith('/v3/auth/tokens'):
+            self._keystone_token()
+            return
+        target = self._resolve()
+        if target is None:
+            return
+        account, containers, container, obj, query = target
+        body = self._body()
+        if 'bulk-delete' in query:
+            deleted = not_found = 0
+            for line in body.decode('utf-8').splitlines():
+                name, _sep, path = unquote(line).lstrip('/').partition('/')
+                c = containers.get(name)
+                if c is not None and c.delete(path):
+                    deleted += 1
+                else:
+                    not_found += 1
+            self._json(200, {'Number Deleted': deleted,
+                             'Number Not Found': not_found,
+                             'Response Status': '200 OK',
+                             'Response Body': '', 'Errors': []})
+            return
+        if container is not None:
+            for key, value in self.headers.items():
+                if key.lower().startswith('x-container-'):
+                    containers[container].meta[key] = value
+        self._send(204)
+
+    def do_PUT(self):
+        target = self._resolve()
+        if target is None:
+            return
+        account, containers, container, obj, query = target
+        self._body()
+        if obj is None:
+            if container not in containers:
+                count = int(self.headers.get('X-Fake-Object-Count') or 0)
+                containers[container] = Container(
+                    list(SyntheticNames(count, 1000)),
+                    self.swift.object_size)
+            self._send(201)
+        else:
+            containers[container].put(obj)
+            self._send(201, headers={'Etag': quote(obj)})
+
+    def do_DELETE(self):
+        target = self._resolve()
+        if target is None:
+            return
+        account, containers, container, obj, query = target
+        if obj is None:
+            if containers[container].object_count():
+                self._send(409)
+            else:
+                del containers[container]
+                self._send(204)
+        elif containers[container].delete(obj):
+            self._send(204)
+        else:
+            self._send(404)
+
+
+def serve(swift, host='127.0.0.1', port=0):
+    """ Starts the server in a daemon thread and returns it. """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.swift = swift
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--containers', type=int, default=10)
+    parser.add_argument('--objects', type=int, default=1000,
+                        help='objects per container')
+    parser.add_argument('--folder-size', type=int, default=1000,
+                        help='objects per pseudofolder')
+    parser.add_argument('--object-size', type=int, default=1024)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random extra latency of up to this many seconds')
+    args = parser.parse_args()
+    swift = FakeSwift(accounts=args.accounts, containers=args.containers,
+                      objects=args.objects, folder_size=args.folder_size,
+                      object_size=args.object_size, latency=args.latency,
+                      jitter=args.jitter)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.swift = swift
+    print('Fake Swift listening on http://%s:%d (Keystone at /v3)' % (
+        args.host, server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+""" Micro-benchmark of decoding and classifying a container listing.
+
+Compares the dicts decoded by swiftclient and the former list based
+pseudofolder dedup with swiftapp.listing and the current
+pseudofolder_object_list, on one synthetic JSON listing body:
+
+    python -m benchmarks.listing --entries 1000000 --folders 0.02
+
+Times are measured without tracing; memory is the peak traced by
+tracemalloc while decoding plus what the decoded listing retains.
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+CONTENT_TYPES = ('application/octet-stream', 'image/jpeg', 'text/plain',
+                 'application/pdf', 'video/mp4')
+
+
+def make_body(entries, folders):
+    """ Returns a JSON listing body with `folders` of the entries subdirs """
+    step = int(1 / folders) if folders else 0
+    rows = []
+    for i in range(entries):
+        if step and i % step == 0:
+            rows.append({'subdir': 'prefix/d%07d/' % i})
+        else:
+            rows.append({'name': 'prefix/o%09d.dat' % i,
+                         'bytes': i * 37 % 1000003,
+                         'hash': '%032x' % (i * 2654435761),
+                         'last_modified': '2024-05-%02dT12:%02d:%02d.%06d' % (
+                             i % 28 + 1, i % 60, i % 59, i),
+                         'content_type': CONTENT_TYPES[i % 5]})
+    return json.dumps(rows).encode('utf-8')
+
+
+def baseline_parse(body):
+    return json.loads(body.decode('utf-8'))
+
+
+def baseline_classify(objects, prefix):
+    pseudofolders = []
+    objs = []
+    duplist = []
+    for obj in objects:
+        if obj.get('content_type', None) in ('application/directory',
+                                             'application/x-directory'):
+            obj['subdir'] = obj['name']
+        if 'subdir' in obj:
+            entry = obj['subdir'].strip('/') + '/'
+            if entry != prefix and entry not in duplist:
+                duplist.append(entry)
+                pseudofolders.append((entry, obj['subdir']))
+        else:
+            objs.append(obj)
+    return (pseudofolders, objs)
+
+
+def measure(parse, classify, body):
+    gc.collect()
+    start = time.perf_counter()
+    objects = parse(body)
+    parsed = time.perf_counter()
+    folders, objs = classify(objects, 'prefix/')
+    done = time.perf_counter()
+    result = (len(folders), len(objs))
+    del objects, folders, objs
+
+    gc.collect()
+    tracemalloc.start()
+    objects = parse(body)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return {'parse_s': parsed - start, 'classify_s': done - parsed,
+            'retained_mib': retained / 2.0 ** 20,
+            'peak_mib': peak / 2.0 ** 20, 'result': result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--folders', type=float, default=0.02,
+                        help='share of subdir entries (default: 0.02); the '
+                        'baseline dedup is quadratic in their number')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    from swiftapp import listing
+    from swiftapp.utils import pseudofolder_object_list
+
+    body = make_body(args.entries, args.folders)
+    results = {
+        'dicts': measure(baseline_parse, baseline_classify, body),
+        'entries': measure(listing.parse, pseudofolder_object_list, body),
+    }
+    if results['dicts']['result'] != results['entries']['result']:
+        print('Results differ: %r' % results, file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print('%d entries, %.1f MiB of JSON, %s, orjson %s' % (
+        args.entries, len(body) / 2.0 ** 20,
+        '%d folders / %d objects' % results['entries']['result'],
+        'used' if listing.orjson is not None else 'not installed'))
+    header = '%-8s %9s %11s %12s %9s' % ('', 'parse s', 'classify s',
+                                         'retained MiB', 'peak MiB')
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print('%-8s %9.2f %11.2f %12.1f %9.1f' % (
+            name, r['parse_s'], r['classify_s'], r['retained_mib'],
+            r['peak_mib']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
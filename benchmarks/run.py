@@ -0,0 +1,267 @@
+""" Drives the views concurrently against the stand-in Swift server.
+
+Starts benchmarks.fakeswift in a subprocess, logs in through its Keystone
+and sends requests to the views in-process through Django's test client,
+from a pool of threads. Reports throughput, latency percentiles, Swift
+calls per request and the peak RSS of the Django process per scenario.
+
+    python -m benchmarks.run --objects 1000000 --latency 0.002 \\
+        --concurrency 16 --requests 500
+
+Use --json to get machine-readable results, e.g. for comparing runs in CI.
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import quote, urlparse
+
+SCENARIOS = ('containerview', 'objectview', 'download', 'tempurl',
+             'delete_container')
+
+
+def start_server(args):
+    """ Starts the stand-in server and returns (process, base_url) """
+    cmd = [sys.executable, '-m', 'benchmarks.fakeswift', '--port', '0',
+           '--containers', str(args.containers),
+           '--objects', str(args.objects),
+           '--folder-size', str(args.folder_size),
+           '--latency', str(args.latency), '--jitter', str(args.jitter)]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = re.search(r'http://[^ ]+', line)
+    if not match:
+        process.kill()
+        raise RuntimeError('Fake Swift did not start: %r' % line)
+    return process, match.group(0)
+
+
+def get_token(base_url):
+    """ Returns (storage_url, token, expires) from the stand-in Keystone """
+    parsed = urlparse(base_url)
+    conn = HTTPConnection(parsed.hostname, parsed.port)
+    body = json.dumps({'auth': {
+        'identity': {'methods': ['password']},
+        'scope': {'project': {'name': 'bench0'}}}})
+    conn.request('POST', '/v3/auth/tokens', body,
+                 {'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    data = json.loads(resp.read())
+    token = resp.getheader('X-Subject-Token')
+    url = data['token']['catalog'][0]['endpoints'][0]['url']
+    conn.close()
+    return url, token
+
+
+def swift_request(storage_url, token, method, path, headers=None):
+    parsed = urlparse(storage_url)
+    conn = HTTPConnection(parsed.hostname, parsed.port)
+    req_headers = {'X-Auth-Token': token}
+    req_headers.update(headers or {})
+    conn.request(method, '%s/%s' % (parsed.path, path), headers=req_headers)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp.status
+
+
+def make_client(storage_url, token):
+    from django.conf import settings
+    from django.test import Client
+    from importlib import import_module
+
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store['storage_url'] = storage_url
+    store['auth_token'] = token
+    store['username'] = 'bench'
+    store.save()
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = store.session_key
+    return client
+
+
+def random_object(args):
+    index = random.randrange(args.objects)
+    return 'd%05d/o%09d' % (index // args.folder_size, index)
+
+
+def prepare(scenario, args, storage_url, token):
+    """ Returns (path, expected statuses) for one request.
+
+    Setup work for the request, like filling a container for
+    delete_container, happens here and is not timed. """
+    if scenario == 'containerview':
+        return ('/', (200, ))
+    if scenario == 'objectview':
+        if random.random() < 0.5:
+            return ('/objects/c0000/', (200, ))
+        folder = random.randrange(max(1, args.objects // args.folder_size))
+        return ('/objects/c0000/d%05d/' % folder, (200, ))
+    if scenario == 'download':
+        return ('/download/c0000/%s/' % quote(random_object(args)), (302, ))
+    if scenario == 'tempurl':
+        return ('/tempurl/c0000/%s/' % quote(random_object(args)), (200, ))
+    if scenario == 'delete_container':
+        name = 'delete-%s' % uuid.uuid4().hex
+        swift_request(storage_url, token, 'PUT', name,
+                      {'X-Fake-Object-Count': str(args.delete_objects)})
+        return ('/delete_container/%s/' % name, (302, ))
+    raise ValueError(scenario)
+
+
+def wait_for_job(client, response):
+    """ Polls the job a view redirected to until it has finished and
+    returns its final status """
+    status_url = response['Location'] + 'status/'
+    while True:
+        status = client.get(status_url).json()['status']
+        if status in ('done', 'failed', 'cancelled'):
+            return status
+        time.sleep(0.01)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_scenario(scenario, args, storage_url, token):
+    from swiftapp import metrics
+
+    requests = args.requests
+    if scenario == 'delete_container':
+        requests = max(1, requests // 10)
+    local = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(_i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = make_client(storage_url, token)
+        path, expected = prepare(scenario, args, storage_url, token)
+        start = time.perf_counter()
+        response = client.get(path)
+        if hasattr(response, 'streaming_content'):
+            for _chunk in response.streaming_content:
+                pass
+        job_status = None
+        if scenario == 'delete_container' and response.status_code == 302:
+            # The deletion runs as a background job; time it to the end
+            job_status = wait_for_job(client, response)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code not in expected:
+                errors.append('%s: %d' % (path, response.status_code))
+            elif job_status not in (None, 'done'):
+                errors.append('%s: job %s' % (path, job_status))
+
+    metrics.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    calls = sum(count for count, _s in metrics.totals().values())
+    waiters = sum(w for _c, w in metrics.coalesced_totals().values())
+    swift_seconds = sum(seconds for _c, seconds in metrics.totals().values())
+
+    return {
+        'scenario': scenario,
+        'requests': requests,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'throughput': requests / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'swift_calls_per_request': calls / float(requests),
+        'swift_ms_per_request': swift_seconds * 1000 / requests,
+        'coalesced_per_request': waiters / float(requests),
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+
+def print_table(results):
+    header = ('%-18s %8s %6s %9s %9s %9s %9s %7s %9s' % (
+        'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+        'p99 ms', 'calls', 'RSS MiB'))
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print('%-18s %8d %6d %9.1f %9.1f %9.1f %9.1f %7.1f %9.1f' % (
+            r['scenario'], r['requests'], r['errors'], r['throughput'],
+            r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['swift_calls_per_request'], r['peak_rss_mib']))
+        for sample in r['error_samples']:
+            print('    error: %s' % sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated, default: all')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario (a tenth of it for '
+                        'delete_container)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--containers', type=int, default=10)
+    parser.add_argument('--objects', type=int, default=100000,
+                        help='objects per synthetic container')
+    parser.add_argument('--folder-size', type=int, default=1000)
+    parser.add_argument('--delete-objects', type=int, default=1000,
+                        help='objects per container for delete_container')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stand-in adds to every request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    process, base_url = start_server(args)
+    try:
+        os.environ['BENCHMARK_AUTH_URL'] = base_url + '/v3'
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+        import django
+        django.setup()
+
+        storage_url, token = get_token(base_url)
+        results = [run_scenario(scenario, args, storage_url, token)
+                   for scenario in scenarios]
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return 1 if any(r['errors'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
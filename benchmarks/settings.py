@@ -0,0 +1,31 @@
+""" Project settings for the benchmarks.
+
+Caches and sessions stay in memory and the job database is a temporary
+file, so runs neither need nor leave state in the tree, and Keystone points
+at the stand-in server. """
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+from swiftproject.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver', 'localhost', '127.0.0.1']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+
+SWIFT_AUTH_URL = os.environ.get('BENCHMARK_AUTH_URL',
+                                'http://127.0.0.1:8080/v3')
+SWIFT_PROJECT_NAME = 'bench0'
+SWIFT_SEARCH_INDEX_DIR = os.path.join(tempfile.gettempdir(),
+                                      'swift-benchmark-index')
+SWIFT_JOBS_DB = os.path.join(tempfile.mkdtemp(prefix='swift-benchmark-'),
+                             'jobs.sqlite3')
@@ -0,0 +1,84 @@
+""" Micro-benchmark of temp URL signing.
+
+Compares signing every object the way the tempurl view does (cached key
+lookup plus a freshly keyed HMAC per URL) with one TempURLSigner per
+batch, for each digest:
+
+    python -m benchmarks.tempurl --urls 100000
+
+Reports signatures per second.
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+import time
+
+STORAGE_URL = 'https://swift.example.com/v1/AUTH_bench0'
+
+
+def names(count):
+    return ['folder/sub/object-%09d.jpg' % i for i in range(count)]
+
+
+def per_url(objects, digest):
+    from django.core.cache import cache
+    from swiftapp.utils import sign_temp_url
+
+    for name in objects:
+        key = cache.get('bench-temp-url-key')
+        sign_temp_url(STORAGE_URL, key, 'container', name, 3600,
+                      digest=digest)
+
+
+def batch(objects, digest):
+    from django.core.cache import cache
+    from swiftapp.utils import TempURLSigner
+
+    signer = TempURLSigner(STORAGE_URL, cache.get('bench-temp-url-key'),
+                           3600, digest=digest)
+    for name in objects:
+        signer.sign('container', name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=100000)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    from django.core.cache import cache
+    from swiftapp.utils import TEMP_URL_DIGESTS
+
+    cache.set('bench-temp-url-key', 'k' * 32, None)
+    objects = names(args.urls)
+    results = []
+    for digest in sorted(TEMP_URL_DIGESTS):
+        row = {'digest': digest}
+        for mode, func in (('per_url', per_url), ('batch', batch)):
+            start = time.perf_counter()
+            func(objects, digest)
+            row[mode] = args.urls / (time.perf_counter() - start)
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    header = '%-8s %14s %14s %8s' % ('digest', 'per URL/s', 'batch/s',
+                                     'speedup')
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print('%-8s %14.0f %14.0f %7.1fx' % (
+            row['digest'], row['per_url'], row['batch'],
+            row['batch'] / row['per_url']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
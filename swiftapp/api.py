@@ -0,0 +1,105 @@
+""" JSON listings for client-side rendering.
+
+Rows are sent as arrays in the order given by the `columns` of the
+response rather than as one object per row. Every response carries a
+strong ETag computed from the account or container stats, so the view
+answers a repeated poll with 304 Not Modified after a single (memoized)
+HEAD, before fetching the listing at all. Bodies are compressed with
+brotli, if it is installed, or gzip; the content coding is part of the
+ETag, so every representation has its own. """
+# -*- coding: utf-8 -*-
+import gzip
+import json
+from hashlib import sha1
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bump when the layout of the responses changes, so cached copies with the
+# same stats are not reused
+FORMAT_VERSION = 1
+
+CONTAINER_COLUMNS = ('name', 'count', 'bytes', 'last_modified')
+OBJECT_COLUMNS = ('name', 'bytes', 'last_modified', 'content_type')
+
+
+def container_rows(containers):
+    return [[c.get('name'), c.get('count', 0), c.get('bytes', 0),
+             c.get('last_modified')] for c in containers]
+
+
+def object_rows(objects):
+    return [[obj.get('name'), obj.get('bytes', 0), obj.get('last_modified'),
+             obj.get('content_type')] for obj in objects]
+
+
+def get_encoding(request):
+    """ Returns the content coding to use for the response, or None """
+    accepted = set()
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _sep, params = coding.partition(';')
+        params = params.replace(' ', '')
+        if params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def get_etag(encoding, *parts):
+    """ Returns a strong ETag for a listing described by `parts` """
+    digest = sha1(repr((FORMAT_VERSION, ) + parts).encode('utf-8'))
+    if encoding:
+        return '"%s-%s"' % (digest.hexdigest(), encoding)
+    return '"%s"' % digest.hexdigest()
+
+
+def _patch_headers(response, etag):
+    response['ETag'] = etag
+    # The browser keeps the copy but asks every time, and shared caches
+    # must not store it at all
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding', 'Cookie'))
+    return response
+
+
+def not_modified(request, etag):
+    """ Returns a 304 response if the client has `etag`, otherwise None """
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        return _patch_headers(HttpResponseNotModified(), etag)
+    return None
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def response(data, etag, encoding):
+    """ Returns `data` as a compressed JSON response """
+    body = _dumps(data)
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    elif encoding == 'gzip':
+        # A fixed mtime keeps the body identical for an identical ETag
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+    response = HttpResponse(body, content_type='application/json')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _patch_headers(response, etag)
@@ -0,0 +1,179 @@
+""" Streaming ZIP and TAR archives of a container or pseudofolder.
+
+The archive is produced by a chain of generators: the listing is walked
+page by page, a bounded pool prefetches the next few small objects while
+the current one is written, and every chunk is handed to the response as
+soon as it is encoded. Memory use therefore does not grow with the size of
+the archive; only ZIP keeps a small central directory entry per file. """
+# -*- coding: utf-8 -*-
+import logging
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from swiftapp import swift
+from swiftapp.listing import DIRECTORY_TYPES
+from swiftapp.utils import iter_listing, truncate_on_error
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+
+def _mtime(obj):
+    try:
+        modified = datetime.strptime(obj['last_modified'],
+                                     '%Y-%m-%dT%H:%M:%S.%f')
+    except (KeyError, ValueError):
+        return time.time()
+    return modified.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _fetch(storage_url, auth_token, container, obj, max_size):
+    """ Returns (size, chunks) of a small object, or (size, None) for an
+    object that turned out to be too large to download ahead """
+    size = obj['bytes']
+    if not size:
+        # DLO manifests are listed with 0 bytes but serve their segments
+        headers = swift.head_object(storage_url, auth_token, container,
+                                    obj['name'])
+        size = int(headers.get('content-length') or 0)
+        if size > max_size:
+            return (size, None)
+    _headers, body = swift.get_object(storage_url, auth_token, container,
+                                      obj['name'])
+    return (size, [body])
+
+
+def prefetch(storage_url, auth_token, container, objects):
+    """ Yields (obj, size, chunks) in listing order.
+
+    Up to SWIFT_ARCHIVE_PREFETCH objects of at most
+    SWIFT_ARCHIVE_PREFETCH_MAX_SIZE bytes are downloaded ahead in a thread
+    pool; larger objects are streamed in chunks when their turn comes.
+    `size` is the size of the content, which for a DLO manifest is not the
+    size in the listing. """
+    workers = getattr(settings, 'SWIFT_ARCHIVE_PREFETCH', 8)
+    max_size = getattr(settings, 'SWIFT_ARCHIVE_PREFETCH_MAX_SIZE',
+                       4 * 1024 * 1024)
+
+    def resolve(obj, future):
+        size, chunks = (obj['bytes'], None)
+        if future is not None:
+            size, chunks = future.result()
+        if chunks is None:
+            chunks = swift.iter_object(storage_url, auth_token, container,
+                                       obj['name'])
+        return (obj, size, chunks)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for obj in objects:
+            future = None
+            if obj['bytes'] <= max_size:
+                future = executor.submit(_fetch, storage_url, auth_token,
+                                         container, obj, max_size)
+            window.append((obj, future))
+            if len(window) > workers:
+                yield resolve(*window.popleft())
+        while window:
+            yield resolve(*window.popleft())
+
+
+class _Buffer(object):
+    """ Write-only file object whose content is drained after each write """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class TarWriter(object):
+
+    def add(self, name, size, mtime, chunks):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            yield chunk
+        if written != size:
+            raise IOError('%s changed while it was archived' % name)
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+
+    def close(self):
+        yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+class ZipWriter(object):
+
+    def __init__(self):
+        self.buffer = _Buffer()
+        self.zip = zipfile.ZipFile(self.buffer, 'w', zipfile.ZIP_STORED,
+                                   allowZip64=True)
+
+    def add(self, name, size, mtime, chunks):
+        date_time = max(time.gmtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.file_size = size
+        with self.zip.open(info, 'w',
+                           force_zip64=size > zipfile.ZIP64_LIMIT) as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+                yield self.buffer.drain()
+        yield self.buffer.drain()
+
+    def close(self):
+        self.zip.close()
+        yield self.buffer.drain()
+
+
+def stream_archive(storage_url, auth_token, container, prefix=None,
+                   archive_format='zip'):
+    """ Yields the archive of every object below `prefix` as byte chunks """
+    writer = ZipWriter() if archive_format == 'zip' else TarWriter()
+    objects = (obj for obj in iter_listing(storage_url, auth_token,
+                                           container, prefix=prefix)
+               if obj.get('content_type') not in DIRECTORY_TYPES and
+               not obj['name'].endswith('/'))
+    count = 0
+    started = time.monotonic()
+
+    def archive():
+        nonlocal count
+        for obj, size, chunks in prefetch(storage_url, auth_token,
+                                          container, objects):
+            name = obj['name'][len(prefix or ''):]
+            for data in writer.add(name, size, _mtime(obj), chunks):
+                if data:
+                    yield data
+            count += 1
+        for data in writer.close():
+            if data:
+                yield data
+
+    yield from truncate_on_error(
+        archive(), logger, lambda: 'Archive of %s/%s aborted after %d '
+        'objects' % (container, prefix or '', count))
+    logger.info('Archived %d objects of %s/%s in %.1fs', count, container,
+                prefix or '', time.monotonic() - started)
@@ -0,0 +1,163 @@
+""" Async access to the Swift API for the ASGI deployment.
+
+Mirrors the read helpers of swiftapp.swift on top of httpx. Each event loop
+gets one AsyncClient, whose connection pool keeps connections to the proxy
+alive across requests. Failures raise swiftclient's ClientException, so
+views handle errors the same way for both variants. """
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+import weakref
+from urllib.parse import quote, urlparse
+
+from swiftclient import client
+
+from django.conf import settings
+
+from swiftapp import listing, metrics, singleflight
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """ Returns the AsyncClient of the running event loop. """
+    if httpx is None:
+        raise RuntimeError('The async Swift client requires httpx')
+    loop = asyncio.get_running_loop()
+    http_client = _clients.get(loop)
+    if http_client is None:
+        limits = httpx.Limits(
+            max_connections=getattr(
+                settings, 'SWIFT_ASYNC_MAX_CONNECTIONS', 256),
+            max_keepalive_connections=getattr(
+                settings, 'SWIFT_POOL_MAX_SIZE', 32),
+            keepalive_expiry=getattr(settings, 'SWIFT_POOL_IDLE_TIMEOUT', 30))
+        http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(getattr(settings, 'SWIFT_TIMEOUT', None)))
+        _clients[loop] = http_client
+    return http_client
+
+
+def _headers(resp):
+    return {key.lower(): value for key, value in resp.headers.items()}
+
+
+async def _request(operation, container, method, url, token, msg,
+                   params=None, headers=None, content=None):
+    req_headers = {'X-Auth-Token': token}
+    if headers:
+        req_headers.update(headers)
+    start = time.perf_counter()
+    try:
+        resp = await get_client().request(method, url, params=params,
+                                          headers=req_headers,
+                                          content=content)
+    except Exception:
+        metrics.record(operation, container, 'error',
+                       time.perf_counter() - start)
+        raise
+    metrics.record(operation, container, str(resp.status_code),
+                   time.perf_counter() - start, len(resp.content))
+    if resp.status_code < 200 or resp.status_code >= 300:
+        parsed = urlparse(str(resp.request.url))
+        raise client.ClientException(
+            msg, http_scheme=parsed.scheme, http_host=parsed.hostname,
+            http_port=parsed.port, http_path=parsed.path,
+            http_query=parsed.query, http_status=resp.status_code,
+            http_reason=resp.reason_phrase,
+            http_response_content=resp.content,
+            http_response_headers=resp.headers)
+    return resp
+
+
+def _listing_params(marker=None, limit=None, prefix=None, delimiter=None,
+                    end_marker=None, query_string=None):
+    params = {'format': 'json'}
+    for key, value in (('marker', marker), ('limit', limit),
+                       ('prefix', prefix), ('delimiter', delimiter),
+                       ('end_marker', end_marker)):
+        if value:
+            params[key] = value
+    if query_string:
+        for pair in query_string.lstrip('?').split('&'):
+            key, _sep, value = pair.partition('=')
+            params[key] = value
+    return params
+
+
+def _parse_listing(resp):
+    if resp.status_code == 204 or not resp.content:
+        return []
+    return json.loads(resp.content)
+
+
+async def _read(func, storage_url, auth_token, *args, **kwargs):
+    """ Awaits func, sharing one call among identical concurrent reads
+    with the same token (see swiftapp.singleflight). """
+    operation = func.__name__.lstrip('_')
+    key = singleflight.get_key(operation, storage_url, auth_token, args,
+                               sorted(kwargs.items()))
+    return await singleflight.ado(
+        operation, key,
+        lambda: func(storage_url, auth_token, *args, **kwargs),
+        scope=(storage_url, args[0] if args else None))
+
+
+async def _head_account(storage_url, auth_token):
+    resp = await _request('head_account', None, 'HEAD', storage_url,
+                          auth_token, 'Account HEAD failed')
+    return _headers(resp)
+
+
+async def head_account(storage_url, auth_token):
+    return await _read(_head_account, storage_url, auth_token)
+
+
+async def _get_account(storage_url, auth_token, **kwargs):
+    resp = await _request('get_account', None, 'GET', storage_url,
+                          auth_token, 'Account GET failed',
+                          params=_listing_params(**kwargs))
+    return (_headers(resp), _parse_listing(resp))
+
+
+async def get_account(storage_url, auth_token, **kwargs):
+    return await _read(_get_account, storage_url, auth_token, **kwargs)
+
+
+async def post_account(storage_url, auth_token, headers):
+    resp = await _request('post_account', None, 'POST', storage_url,
+                          auth_token, 'Account POST failed', headers=headers)
+    return _headers(resp)
+
+
+async def _head_container(storage_url, auth_token, container):
+    resp = await _request('head_container', container, 'HEAD',
+                          '%s/%s' % (storage_url, quote(container)),
+                          auth_token, 'Container HEAD failed')
+    return _headers(resp)
+
+
+async def head_container(storage_url, auth_token, container):
+    return await _read(_head_container, storage_url, auth_token, container)
+
+
+async def _get_container(storage_url, auth_token, container, **kwargs):
+    resp = await _request('get_container', container, 'GET',
+                          '%s/%s' % (storage_url, quote(container)),
+                          auth_token, 'Container GET failed',
+                          params=_listing_params(**kwargs))
+    if resp.status_code == 204:
+        return (_headers(resp), [])
+    return (_headers(resp), listing.parse(resp.content))
+
+
+async def get_container(storage_url, auth_token, container, **kwargs):
+    return await _read(_get_container, storage_url, auth_token, container,
+                       **kwargs)
@@ -0,0 +1,204 @@
+""" Async variants of the read-only views for the ASGI deployment.
+
+Enabled with SWIFT_ASYNC_VIEWS. They talk to Swift through swiftapp.aswift,
+so a worker is not blocked while waiting for slow listings. """
+# -*- coding: utf-8 -*-
+from swiftclient import client
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.contrib import messages
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from swiftapp import aswift, listing_cache, metadata
+from swiftapp.utils import replace_hyphens, prefix_list, \
+    pseudofolder_object_list, get_base_url, aget_temp_url, \
+    get_page_size, ainvalidate_temp_key, is_public, patch_public_cache, \
+    public_not_modified, get_object_page_size, offered_page_sizes, \
+    ObjectRowStream
+
+
+async def _credentials(request):
+    storage_url = await request.session.aget('storage_url', '')
+    auth_token = await request.session.aget('auth_token', '')
+    return (storage_url, auth_token)
+
+
+async def containerview(request):
+    """ Returns a list of all containers in current account. """
+
+    storage_url, auth_token = await _credentials(request)
+
+    try:
+        account_stat, containers = await listing_cache.aget_account(
+            storage_url, auth_token)
+    except client.ClientException as exc:
+        if exc.http_status != 403:
+            return redirect('login')
+        account_stat = {}
+        containers = []
+        base_url = get_base_url(request)
+        msg = 'Container listing failed. You can manually choose a known '
+        msg += 'container by appending the name to the URL, for example: '
+        msg += '<a href="%s/objects/containername">' % base_url
+        msg += '%s/objects/containername</a>' % base_url
+        messages.add_message(request, messages.ERROR, msg)
+
+    return render(request, 'containerview.html', {
+        'account_stat': replace_hyphens(account_stat),
+        'containers': containers,
+        'session': request.session
+    })
+
+
+async def objectview(request, container, prefix=None):
+    """ Returns list of all objects in current container. """
+
+    storage_url, auth_token = await _credentials(request)
+
+    # FormPost redirects back here with the upload result
+    status = request.GET.get('status', '')
+    if status:
+        await listing_cache.ainvalidate(storage_url, container)
+
+    marker = request.GET.get('marker')
+    end_marker = request.GET.get('end_marker')
+    limit, streaming = get_object_page_size(request)
+
+    try:
+        if streaming:
+            meta = await metadata.ahead_container(storage_url, auth_token,
+                                                  container)
+        else:
+            meta, objects, page = \
+                await listing_cache.aget_listing_page_cached(
+                    storage_url, auth_token, container, prefix=prefix,
+                    marker=marker, end_marker=end_marker,
+                    limit=min(limit, getattr(settings, 'SWIFT_MAX_PAGE_SIZE',
+                                             10000)))
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect('containerview')
+
+    if status and not status.startswith('2'):
+        if status == '401':
+            await ainvalidate_temp_key(storage_url)
+        messages.add_message(request, messages.ERROR, _("Upload failed: %s")
+                             % request.GET.get('message', status))
+
+    context = {
+        'container': container,
+        'session': request.session,
+        'prefix': prefix,
+        'prefixes': prefix_list(prefix),
+        'base_url': get_base_url(request),
+        'account': storage_url.split('/')[-1],
+        'public': is_public(meta)}
+
+    if streaming:
+        return _stream_objectview(request, storage_url, auth_token, context,
+                                  marker, limit)
+
+    pseudofolders, objs = pseudofolder_object_list(objects, prefix)
+    context.update({
+        'objects': objs,
+        'folders': pseudofolders,
+        'page': dict(page,
+                     page_sizes=offered_page_sizes(page['page_sizes']))})
+    return render(request, "objectview.html", context)
+
+
+def _stream_objectview(request, storage_url, auth_token, context, marker,
+                       limit):
+    """ Async variant of views._stream_objectview """
+    listing = ObjectRowStream(request, context, marker, limit)
+
+    async def stream():
+        yield listing.head
+        while listing.more:
+            request_limit = listing.next_limit()
+            try:
+                _meta, entries = await aswift.get_container(
+                    storage_url, auth_token, listing.container,
+                    prefix=listing.prefix, delimiter='/',
+                    marker=listing.cursor, limit=request_limit)
+            except client.ClientException as e:
+                yield listing.failed(e)
+                break
+            yield listing.rows(entries, request_limit)
+        yield listing.end()
+
+    response = StreamingHttpResponse(stream())
+    # Ask proxies like nginx to pass rows on as they are rendered
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def public_objectview(request, account, container, prefix=None):
+    """ Returns list of all objects in current container. """
+    storage_url = settings.STORAGE_URL + account
+    try:
+        fresh_until, etag, objects, page = \
+            await listing_cache.aget_public_page(
+                storage_url, container, prefix=prefix,
+                marker=request.GET.get('marker'),
+                end_marker=request.GET.get('end_marker'),
+                limit=get_page_size(request))
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect('containerview')
+
+    response = public_not_modified(request, etag, fresh_until)
+    if response is not None:
+        return response
+    pseudofolders, objs = pseudofolder_object_list(objects, prefix)
+
+    response = render(request, "publicview.html", {
+        'container': container,
+        'objects': objs,
+        'folders': pseudofolders,
+        'prefix': prefix,
+        'prefixes': prefix_list(prefix),
+        'base_url': get_base_url(request),
+        'storage_url': storage_url,
+        'page': page,
+        'account': storage_url.split('/')[-1]})
+    return patch_public_cache(request, response, etag, fresh_until)
+
+
+async def download(request, container, objectname):
+    """ Download an object from Swift """
+
+    storage_url, auth_token = await _credentials(request)
+    url = await aget_temp_url(storage_url, auth_token, container, objectname)
+    if not url:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect('objectview', container=container)
+
+    return redirect(url)
+
+
+async def tempurl(request, container, objectname):
+    """ Displays a temporary URL for a given container object """
+
+    storage_url, auth_token = await _credentials(request)
+    url = await aget_temp_url(storage_url, auth_token, container, objectname,
+                              7 * 24 * 3600)
+
+    if not url:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect('objectview', container=container)
+
+    prefix = '/'.join(objectname.split('/')[:-1])
+    if prefix:
+        prefix += '/'
+
+    return render(request, 'tempurl.html', {
+        'url': url,
+        'account': storage_url.split('/')[-1],
+        'container': container,
+        'prefix': prefix,
+        'prefixes': prefix_list(prefix),
+        'objectname': objectname,
+        'session': request.session})
@@ -0,0 +1,169 @@
+""" Keystone authentication and proactive token refresh. """
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from hashlib import sha1
+
+import requests
+from asgiref.sync import sync_to_async
+from swiftclient import client
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Only kept in the server-side session, never in the cookie
+PASSWORD_KEY = '_swift_password'
+
+
+def get_token_expiry(auth_token):
+    """ Returns the expiry of a Keystone v3 token as a timestamp, or None """
+    if str(getattr(settings, 'SWIFT_AUTH_VERSION', '3')) != '3':
+        return None
+    url = settings.SWIFT_AUTH_URL.rstrip('/') + '/auth/tokens?nocatalog'
+    try:
+        resp = requests.get(url, timeout=10, headers={
+            'X-Auth-Token': auth_token, 'X-Subject-Token': auth_token})
+        resp.raise_for_status()
+        expires = parse_datetime(resp.json()['token']['expires_at'])
+    except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+        logger.warning('Could not read token expiry: %s', e)
+        return None
+    return expires.timestamp() if expires else None
+
+
+def authenticate(username, password):
+    """ Returns (storage_url, auth_token, expires) for the given user.
+
+    `expires` is a timestamp or None if the auth system does not tell. """
+    auth_version = getattr(settings, 'SWIFT_AUTH_VERSION', '3')
+    os_options = {
+        'user_domain_name': settings.SWIFT_USER_DOMAIN_NAME,
+        'project_domain_name': settings.SWIFT_PROJECT_DOMAIN_NAME,
+        'project_name': settings.SWIFT_PROJECT_NAME,
+    }
+    storage_url, auth_token = client.get_auth(
+        settings.SWIFT_AUTH_URL,
+        username,
+        password,
+        auth_version=auth_version,
+        os_options=os_options
+    )
+    return (storage_url, auth_token, get_token_expiry(auth_token))
+
+
+def login(session, username, password):
+    """ Authenticates and stores the token and its expiry in the session """
+    storage_url, auth_token, expires = authenticate(username, password)
+    session['auth_token'] = auth_token
+    session['storage_url'] = storage_url
+    session['username'] = username
+    session['token_expires'] = expires
+    if getattr(settings, 'SWIFT_TOKEN_REFRESH', False):
+        session[PASSWORD_KEY] = password
+
+
+def _expiring(auth_token, expires):
+    if not auth_token or not expires:
+        return False
+    margin = getattr(settings, 'SWIFT_TOKEN_REFRESH_MARGIN', 300)
+    return expires - time.time() < margin
+
+
+def needs_refresh(session):
+    return _expiring(session.get('auth_token'), session.get('token_expires'))
+
+
+async def aneeds_refresh(session):
+    """ Async variant of needs_refresh """
+    return _expiring(await session.aget('auth_token'),
+                     await session.aget('token_expires'))
+
+
+def _refresh_keys(username, old_token):
+    digest = sha1(('%s\n%s' % (username, old_token)).encode('utf-8'))
+    return ('swift-reauth:%s' % digest.hexdigest(),
+            'swift-reauth-lock:%s' % digest.hexdigest())
+
+
+def refresh(session):
+    """ Replaces a token that is about to expire with a new one.
+
+    Only one worker re-authenticates for a given token: it takes a lock in
+    the shared cache and publishes the new token there, where concurrent
+    requests with the same old token pick it up. Those keep using the old
+    token while it is still valid and only wait for the new one if it has
+    already expired. Returns False if the session could not be refreshed.
+    """
+    username = session.get('username')
+    password = session.get(PASSWORD_KEY)
+    old_token = session.get('auth_token')
+    if not password:
+        return False
+
+    result_key, lock_key = _refresh_keys(username, old_token)
+    result = cache.get(result_key)
+    if result is None and cache.add(lock_key, 1, 30):
+        try:
+            storage_url, auth_token, expires = authenticate(username,
+                                                            password)
+        except client.ClientException as e:
+            logger.warning('Token refresh for %s failed: %s', username, e)
+            return False
+        finally:
+            cache.delete(lock_key)
+        result = {'auth_token': auth_token, 'storage_url': storage_url,
+                  'token_expires': expires}
+        cache.set(result_key, result, 60)
+    elif result is None:
+        if session.get('token_expires', 0) > time.time():
+            return True
+        deadline = time.monotonic() + 10
+        while result is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+            result = cache.get(result_key)
+        if result is None:
+            return False
+
+    session.update(result)
+    return True
+
+
+async def arefresh(session):
+    """ Async variant of refresh; Keystone is called in a thread and the
+    wait for another worker's refresh does not block the event loop """
+    username = await session.aget('username')
+    password = await session.aget(PASSWORD_KEY)
+    old_token = await session.aget('auth_token')
+    if not password:
+        return False
+
+    result_key, lock_key = _refresh_keys(username, old_token)
+    result = await cache.aget(result_key)
+    if result is None and await cache.aadd(lock_key, 1, 30):
+        try:
+            storage_url, auth_token, expires = await sync_to_async(
+                authenticate, thread_sensitive=False)(username, password)
+        except client.ClientException as e:
+            logger.warning('Token refresh for %s failed: %s', username, e)
+            return False
+        finally:
+            await cache.adelete(lock_key)
+        result = {'auth_token': auth_token, 'storage_url': storage_url,
+                  'token_expires': expires}
+        await cache.aset(result_key, result, 60)
+    elif result is None:
+        if await session.aget('token_expires', 0) > time.time():
+            return True
+        deadline = time.monotonic() + 10
+        while result is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            result = await cache.aget(result_key)
+        if result is None:
+            return False
+
+    await session.aupdate(result)
+    return True
@@ -0,0 +1,346 @@
+""" Server-side copies and moves of objects and pseudofolders.
+
+Swift copies every object itself, from a PUT carrying X-Copy-From, so no
+data passes through Django. A pseudofolder is copied page by page with a
+bounded pool of SWIFT_COPY_CONCURRENCY threads, and a move deletes each
+source object only once its copy has been verified.
+
+Large objects are copied as manifests (multipart-manifest=get): the copy
+shares the segments of the original instead of Swift concatenating them
+into one object, and deleting the source of a move leaves the segments
+alone. A manifest whose segments are moved along with it, because they
+live below the moved pseudofolder, is rewritten to point at the moved
+segments once those have been copied. """
+# -*- coding: utf-8 -*-
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from urllib.parse import quote, unquote
+
+from swiftclient import client
+
+from django.conf import settings
+
+from swiftapp import deletion, swift
+from swiftapp.listing import DIRECTORY_TYPES
+from swiftapp.utils import iter_listing
+
+logger = logging.getLogger(__name__)
+
+# ETag of an empty body, which is also the ETag of every DLO manifest
+EMPTY_ETAG = 'd41d8cd98f00b204e9800998ecf8427e'
+
+MISMATCH = 'copy differs'
+DEFERRED = 'deferred'
+
+
+class CopyReport(object):
+    """ Progress and outcome of a copy or move run.
+
+    `marker` is the last name of the last completed batch and `retry` the
+    names that failed in an earlier run, as in deletion.DeleteReport.
+    `deferred` holds the manifests that are
+    rewritten after the last batch, as [name, ETag, length] of the
+    original, which may have lost its segments to the move by then. """
+
+    def __init__(self):
+        self.copied = 0
+        self.deleted = 0
+        self.failures = []
+        self.retry = []
+        self.deferred = []
+        self.marker = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Restores a report saved with as_dict, to resume its run; its
+        failures are tried again like in deletion.DeleteReport.from_dict """
+        report = cls()
+        report.copied = data.get('copied', 0)
+        report.deleted = data.get('deleted', 0)
+        report.deferred = [list(manifest)
+                           for manifest in data.get('deferred', [])]
+        report.retry, report.marker = deletion.retry_failures(data)
+        report.started -= data.get('elapsed', 0)
+        return report
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        """ Copied objects per second """
+        elapsed = self.elapsed
+        return self.copied / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'copied': self.copied,
+            'deleted': self.deleted,
+            'failed': len(self.failures),
+            'failures': self.failures[:100],
+            'deferred': self.deferred,
+            'marker': self.marker,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 1),
+        }
+
+
+def _path(container, name):
+    return '/%s/%s' % (container, name)
+
+
+class Copier(object):
+    """ Copies the objects below `prefix` in `container` to the same names
+    below `dst_prefix` in `dst_container`.
+
+    With a prefix that is not a pseudofolder, e.g. the full name of a
+    single object, only objects starting with it are mapped and segments
+    are never moved. """
+
+    def __init__(self, storage_url, auth_token, container, prefix,
+                 dst_container, dst_prefix):
+        self.storage_url = storage_url
+        self.auth_token = auth_token
+        self.container = container
+        self.prefix = prefix
+        self.dst_container = dst_container
+        self.dst_prefix = dst_prefix
+        self.folder = prefix.endswith('/')
+
+    def target(self, name):
+        return self.dst_prefix + name[len(self.prefix):]
+
+    def relocate(self, path):
+        """ Returns where the object at `path` ('/container/name') is
+        copied to, or None if it is not part of this copy """
+        source = _path(self.container, self.prefix)
+        if self.folder and path.startswith(source):
+            return _path(self.dst_container,
+                         self.dst_prefix + path[len(source):])
+        return None
+
+    def _put_copy(self, name, headers=None):
+        copy_headers = {'X-Copy-From': quote(_path(self.container, name))}
+        copy_headers.update(headers or {})
+        return swift.put_object(self.storage_url, self.auth_token,
+                                self.dst_container, self.target(name), None,
+                                headers=copy_headers,
+                                query_string='multipart-manifest=get')
+
+    def _get_manifest(self, name):
+        headers, body = swift.get_object(
+            self.storage_url, self.auth_token, self.container, name,
+            query_string='multipart-manifest=get')
+        return headers, json.loads(body)
+
+    def _moves_segments(self, name, headers):
+        """ Returns whether the manifest `name` has segments below the
+        copied pseudofolder """
+        if not self.folder:
+            return False
+        dlo = headers.get('x-object-manifest')
+        if dlo:
+            return self.relocate('/' + unquote(dlo)) is not None
+        if headers.get('x-static-large-object', '').lower() == 'true':
+            _headers, segments = self._get_manifest(name)
+            return any(self.relocate(segment['name']) is not None
+                       for segment in segments)
+        return False
+
+    def _verify(self, name, original):
+        """ Compares the copy of `name` with the [ETag, length] of the
+        original, read as large objects """
+        copy = swift.head_object(self.storage_url, self.auth_token,
+                                 self.dst_container, self.target(name))
+        if [copy.get('etag'), copy.get('content-length')] != original:
+            return MISMATCH
+        return None
+
+    def copy(self, name, etag=None):
+        """ Copies one object and verifies the copy.
+
+        Returns (status, original). The status is None once the copy is
+        verified, DEFERRED for a manifest that has to wait for its
+        segments, or the failure; `original` is the [ETag, length] a
+        deferred manifest is verified against later. The ETag Swift returns
+        for the copy is checked against `etag` from the listing; where they
+        differ or cannot be compared, like for manifests, both objects are
+        compared with HEAD requests instead. """
+        try:
+            copied = self._put_copy(name)
+            if etag and etag != EMPTY_ETAG and copied == etag:
+                return (None, None)
+            headers = swift.head_object(self.storage_url, self.auth_token,
+                                        self.container, name)
+            original = [headers.get('etag'), headers.get('content-length')]
+            if self._moves_segments(name, headers):
+                return (DEFERRED, original)
+            return (self._verify(name, original), None)
+        except client.ClientException as exc:
+            return (exc.http_status or str(exc), None)
+
+    def rewrite(self, name, original):
+        """ Copies a manifest pointing at the moved copies of its segments,
+        which have to be in place by now. Returns None or the failure. """
+        try:
+            headers = swift.head_object(self.storage_url, self.auth_token,
+                                        self.container, name)
+            dlo = headers.get('x-object-manifest')
+            if dlo:
+                moved = self.relocate('/' + unquote(dlo)) or '/' + unquote(dlo)
+                self._put_copy(name, {'X-Object-Manifest': quote(moved[1:])})
+            else:
+                manifest_headers, segments = self._get_manifest(name)
+                manifest = []
+                for segment in segments:
+                    entry = {
+                        'path': self.relocate(segment['name']) or
+                        segment['name'],
+                        # A nested manifest's listing hash is not its ETag
+                        'etag': None if segment.get('sub_slo')
+                        else segment['hash'],
+                        'size_bytes': segment['bytes']}
+                    if segment.get('range'):
+                        entry['range'] = segment['range']
+                    manifest.append(entry)
+                meta = dict((key, value)
+                            for key, value in manifest_headers.items()
+                            if key.startswith('x-object-meta-'))
+                swift.put_object(
+                    self.storage_url, self.auth_token, self.dst_container,
+                    self.target(name), json.dumps(manifest),
+                    content_type=manifest_headers.get('content-type'),
+                    headers=meta, query_string='multipart-manifest=put')
+            return self._verify(name, original)
+        except client.ClientException as exc:
+            return exc.http_status or str(exc)
+
+
+def _delete_sources(copier, names, report):
+    if not names:
+        return
+    deleted = deletion.delete_objects(copier.storage_url, copier.auth_token,
+                                      copier.container, names)
+    # A source that is already gone has been moved all the same
+    report.deleted += deleted.deleted + deleted.not_found
+    report.failures.extend(deleted.failures)
+
+
+def _copy_batch(executor, copier, batch, move, report):
+    results = executor.map(
+        lambda obj: (obj['name'], copier.copy(obj['name'], obj.get('hash'))),
+        batch)
+    verified = []
+    for name, (status, original) in results:
+        if status is None:
+            report.copied += 1
+            verified.append(name)
+        elif status == DEFERRED:
+            report.deferred.append([name] + original)
+        else:
+            report.failures.append((name, status))
+    if move:
+        _delete_sources(copier, verified, report)
+
+
+def copy_objects(copier, objects, move=False, progress=None, report=None):
+    """ Copies the listing entries `objects` and returns a CopyReport.
+
+    Entries are consumed lazily in batches of SWIFT_COPY_BATCH_SIZE, copied
+    in parallel, and with `move` the verified sources of a batch are
+    deleted before the next one starts. `progress` is called with the
+    report after every batch. """
+    report = report or CopyReport()
+    concurrency = getattr(settings, 'SWIFT_COPY_CONCURRENCY', 16)
+    batch_size = getattr(settings, 'SWIFT_COPY_BATCH_SIZE', 1000)
+
+    objects = iter(objects)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                break
+            _copy_batch(executor, copier, batch, move, report)
+            report.marker = batch[-1]['name']
+            if progress:
+                progress(report)
+
+    verified = []
+    for name, etag, length in report.deferred:
+        status = copier.rewrite(name, [etag, length])
+        if status is None:
+            report.copied += 1
+            verified.append(name)
+        else:
+            report.failures.append((name, status))
+    report.deferred = []
+    if move:
+        _delete_sources(copier, verified, report)
+
+    report.finished = time.monotonic()
+    logger.info('%s %d objects from %s/%s to %s/%s in %.1fs (%.0f/s), '
+                '%d failed', 'Moved' if move else 'Copied', report.copied,
+                copier.container, copier.prefix, copier.dst_container,
+                copier.dst_prefix, report.elapsed, report.throughput,
+                len(report.failures))
+    return report
+
+
+def copy_object(storage_url, auth_token, container, name, dst_container,
+                dst_name, move=False):
+    """ Copies or moves (renames) a single object.
+
+    Returns None on success or the failure, like Copier.copy. The source
+    of a move is deleted once the copy is verified. """
+    copier = Copier(storage_url, auth_token, container, name, dst_container,
+                    dst_name)
+    status, _original = copier.copy(name)
+    if status is None and move:
+        try:
+            swift.delete_object(storage_url, auth_token, container, name)
+        except client.ClientException as exc:
+            if exc.http_status != 404:
+                return exc.http_status or str(exc)
+    return status
+
+
+def copy_folder(storage_url, auth_token, container, prefix, dst_container,
+                dst_prefix, move=False, progress=None, report=None):
+    """ Copies or moves a pseudofolder with every object below it.
+
+    A directory marker object named like the folder without its trailing
+    slash is copied along, as deletion.delete_folder deletes it. Pass the
+    report of an interrupted run to resume it from its marker. """
+    copier = Copier(storage_url, auth_token, container, prefix,
+                    dst_container, dst_prefix)
+    # Names of an earlier run are tried first; the marker object is below
+    retry = [{'name': name} for name in (report.retry if report else [])
+             if name.startswith(prefix)]
+    objects = chain(retry, iter_listing(storage_url, auth_token, container,
+                                        prefix=prefix,
+                                        marker=report and report.marker))
+    report = copy_objects(copier, objects, move=move, progress=progress,
+                          report=report)
+
+    name = prefix.rstrip('/')
+    try:
+        _meta, objects = swift.get_container(
+            storage_url, auth_token, container, prefix=name, limit=1)
+    except client.ClientException:
+        return report
+    if objects and objects[0]['name'] == name and \
+            objects[0].get('content_type') in DIRECTORY_TYPES:
+        status = copy_object(storage_url, auth_token, container, name,
+                             dst_container, dst_prefix.rstrip('/'), move)
+        if status is None:
+            report.copied += 1
+            report.deleted += 1 if move else 0
+        else:
+            report.failures.append((name, status))
+    return report
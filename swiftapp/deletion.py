@@ -0,0 +1,234 @@
+""" Deletion of many objects, using bulk-delete where the cluster has it. """
+# -*- coding: utf-8 -*-
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from urllib.parse import unquote
+
+from swiftclient import client
+
+from django.conf import settings
+
+from swiftapp import swift
+from swiftapp.listing import DIRECTORY_TYPES
+from swiftapp.utils import get_capabilities, iter_listing
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """ Raised by a progress callback to stop a deletion run """
+
+
+class DeleteReport(object):
+    """ Progress and outcome of a deletion run.
+
+    `marker` is the last name of the last completed batch; every name up to
+    and including it has been handled, so a run can be resumed from it.
+    `retry` holds names that failed in an earlier run and are tried again
+    before the listing continues from the marker. """
+
+    def __init__(self):
+        self.deleted = 0
+        self.not_found = 0
+        self.failures = []
+        self.retry = []
+        self.marker = None
+        self.bulk = False
+        self.started = time.monotonic()
+        self.finished = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Restores a report saved with as_dict, to resume its run.
+
+        The failures of the earlier run are tried again: by name if as_dict
+        kept all of them, otherwise by listing from the start again. """
+        report = cls()
+        report.deleted = data.get('deleted', 0)
+        report.not_found = data.get('not_found', 0)
+        report.retry, report.marker = retry_failures(data)
+        report.bulk = data.get('bulk', False)
+        report.started -= data.get('elapsed', 0)
+        return report
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        """ Deleted objects per second """
+        elapsed = self.elapsed
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'deleted': self.deleted,
+            'not_found': self.not_found,
+            'failed': len(self.failures),
+            'failures': self.failures[:100],
+            'marker': self.marker,
+            'bulk': self.bulk,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 1),
+        }
+
+
+def retry_failures(data):
+    """ Returns (names to retry, marker to resume from) for the progress
+    `data` of an interrupted run, which keeps at most 100 failures """
+    failures = data.get('failures', [])
+    if data.get('failed', 0) > len(failures):
+        return ([], None)
+    return (sorted(name for name, _status in failures), data.get('marker'))
+
+
+def _delete_one(storage_url, auth_token, container, name):
+    try:
+        swift.delete_object(storage_url, auth_token, container, name)
+    except client.ClientException as exc:
+        return (name, exc.http_status or str(exc))
+    return (name, None)
+
+
+def _delete_parallel(executor, storage_url, auth_token, container, batch,
+                     report):
+    results = executor.map(
+        lambda name: _delete_one(storage_url, auth_token, container, name),
+        batch)
+    for name, status in results:
+        if status is None:
+            report.deleted += 1
+        elif status == 404:
+            report.not_found += 1
+        else:
+            report.failures.append((name, status))
+
+
+def _delete_bulk(executor, storage_url, auth_token, container, batch,
+                 report):
+    try:
+        result = swift.bulk_delete(storage_url, auth_token, container, batch)
+    except client.ClientException:
+        result = {}
+    errors = result.get('Errors') or []
+    if not result.get('Response Status', '').startswith('2') and not errors:
+        # The whole request was refused; delete this batch one by one
+        _delete_parallel(executor, storage_url, auth_token, container,
+                         batch, report)
+        return
+    report.deleted += result.get('Number Deleted', 0)
+    report.not_found += result.get('Number Not Found', 0)
+    for path, status in errors:
+        name = unquote(path).lstrip('/').split('/', 1)[-1]
+        report.failures.append((name, status))
+
+
+def delete_objects(storage_url, auth_token, container, names,
+                   progress=None, report=None):
+    """ Deletes the given object names and returns a DeleteReport.
+
+    Names are consumed lazily in batches. If the cluster advertises the
+    bulk middleware in /info, each batch is a single bulk-delete request of
+    up to max_deletes_per_request names. Otherwise the batch is deleted
+    with a bounded pool of SWIFT_DELETE_CONCURRENCY threads. `progress` is
+    called with the report after every batch. """
+    report = report or DeleteReport()
+    bulk_info = get_capabilities(storage_url).get('bulk_delete')
+    concurrency = getattr(settings, 'SWIFT_DELETE_CONCURRENCY', 16)
+    if bulk_info:
+        report.bulk = True
+        batch_size = bulk_info.get('max_deletes_per_request', 10000)
+        delete_batch = _delete_bulk
+    else:
+        batch_size = getattr(settings, 'SWIFT_DELETE_BATCH_SIZE', 1000)
+        delete_batch = _delete_parallel
+
+    names = iter(names)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            batch = list(islice(names, batch_size))
+            if not batch:
+                break
+            delete_batch(executor, storage_url, auth_token, container,
+                         batch, report)
+            report.marker = batch[-1]
+            if progress:
+                progress(report)
+
+    report.finished = time.monotonic()
+    logger.info('Deleted %d objects from %s in %.1fs (%.0f/s, %s), '
+                '%d not found, %d failed', report.deleted, container,
+                report.elapsed, report.throughput,
+                'bulk' if report.bulk else 'parallel', report.not_found,
+                len(report.failures))
+    return report
+
+
+def delete_prefix(storage_url, auth_token, container, prefix=None,
+                  marker=None, progress=None, report=None):
+    """ Deletes every object in a container below `prefix`.
+
+    The listing is walked with markers while the objects are deleted, so
+    neither the listing nor the deletion is limited to a single page. The
+    names in report.retry are deleted first. """
+    retry = report.retry if report else []
+    names = chain(retry, (obj['name'] for obj in iter_listing(
+        storage_url, auth_token, container, prefix=prefix, marker=marker)))
+    return delete_objects(storage_url, auth_token, container, names,
+                          progress=progress, report=report)
+
+
+def delete_container(storage_url, auth_token, container, progress=None,
+                     report=None):
+    """ Deletes all objects of a container and then the container itself.
+
+    The container is kept if any object could not be deleted. Raises
+    ClientException if the container DELETE itself fails. Pass the report
+    of an interrupted run to resume it from its marker. """
+    report = delete_prefix(storage_url, auth_token, container,
+                           marker=report and report.marker,
+                           progress=progress, report=report)
+    if report.failures:
+        return report
+
+    # Container listings are updated asynchronously, so the container may
+    # still look non-empty for a moment after its last object is gone.
+    for attempt in range(3):
+        try:
+            swift.delete_container(storage_url, auth_token, container)
+            break
+        except client.ClientException as exc:
+            if exc.http_status != 409 or attempt == 2:
+                raise
+            time.sleep(1 + attempt)
+    return report
+
+
+def delete_folder(storage_url, auth_token, container, prefix, progress=None,
+                  report=None):
+    """ Deletes a pseudofolder: every object below `prefix` and a
+    directory marker object named like the folder without its trailing
+    slash, if there is one. Like delete_container, resumes from the
+    marker of `report`. """
+    report = delete_prefix(storage_url, auth_token, container, prefix,
+                           marker=report and report.marker,
+                           progress=progress, report=report)
+    name = prefix.rstrip('/')
+    try:
+        _meta, objects = swift.get_container(
+            storage_url, auth_token, container, prefix=name, limit=1)
+    except client.ClientException:
+        return report
+    if objects and objects[0]['name'] == name and \
+            objects[0].get('content_type') in DIRECTORY_TYPES:
+        name, status = _delete_one(storage_url, auth_token, container,
+                                   name)
+        if status is None:
+            report.deleted += 1
+        elif status != 404:
+            report.failures.append((name, status))
+    return report
+
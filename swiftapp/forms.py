@@ -23,6 +23,38 @@ class PseudoFolderForm(forms.Form):
     foldername = forms.CharField(max_length=100)
 
 
+class UploadArchiveForm(forms.Form):
+    """ Archive upload form """
+    archive = forms.FileField()
+
+
+class SearchForm(forms.Form):
+    """ Object search form """
+    q = forms.CharField(max_length=1024, required=False)
+    pattern = forms.CharField(max_length=1024, required=False,
+                              help_text="Glob on the full name, e.g. *.jpg")
+    min_size = forms.IntegerField(min_value=0, required=False)
+    max_size = forms.IntegerField(min_value=0, required=False)
+    modified_after = forms.DateField(required=False)
+    modified_before = forms.DateField(required=False)
+
+
+class TempURLsForm(forms.Form):
+    """ Bulk temp URL export form """
+    expires = forms.TypedChoiceField(
+        coerce=int, initial=7 * 24 * 3600,
+        choices=((3600, '1 hour'), (24 * 3600, '1 day'),
+                 (7 * 24 * 3600, '7 days'), (30 * 24 * 3600, '30 days')))
+    format = forms.ChoiceField(choices=(('csv', 'CSV'), ('json', 'JSON')))
+
+
+class CopyForm(forms.Form):
+    """ Copy, move and rename form """
+    container = forms.CharField(max_length=256)
+    name = forms.CharField(max_length=1024)
+    move = forms.BooleanField(required=False)
+
+
 class LoginForm(forms.Form):
     """ Login form """
     username = forms.CharField(max_length=100)
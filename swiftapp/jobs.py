@@ -0,0 +1,462 @@
+""" Background jobs for long running Swift operations.
+
+Operations that touch many objects, like deleting a container or copying
+a pseudofolder, are submitted as jobs and run in a bounded thread pool of
+SWIFT_JOBS_WORKERS threads per worker process instead of inside the HTTP
+request. The browser polls the job's progress.
+
+Jobs are kept in a local SQLite database (SWIFT_JOBS_DB) together with
+their progress, which includes the listing marker of the last completed
+batch, and the runner that claimed them. Every runner records a heartbeat
+there every SWIFT_JOBS_HEARTBEAT seconds and then looks for running jobs
+of runners whose heartbeat is older than SWIFT_JOBS_STALE_AFTER seconds.
+Those jobs are queued again and continue from their marker, so a job
+interrupted by a restart resumes shortly after, in one of the new
+processes. A runner whose job was taken over stops it at its next batch.
+
+A job runs with the token of the session that submitted it. If the token
+expires before the job is done, the job fails and can be resumed from the
+job page with a fresh token. """
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from swiftclient import client
+
+from django.conf import settings
+from django.core.cache import cache
+
+from swiftapp import copying, deletion, listing_cache, search_index
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    description TEXT NOT NULL,
+    params TEXT NOT NULL,
+    storage_url TEXT NOT NULL,
+    auth_token TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    runner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS runners (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+
+_handlers = {}
+
+
+def handler(kind):
+    """ Registers the function that runs jobs of `kind`.
+
+    It is called with the Job and should report progress through
+    job.update, which raises deletion.Cancelled once the job is
+    cancelled. A resumed job finds the progress it saved last in
+    job.progress. """
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def _db_path():
+    return str(getattr(settings, 'SWIFT_JOBS_DB',
+                       os.path.join(settings.BASE_DIR, 'jobs.sqlite3')))
+
+
+def connect():
+    """ Opens the job database, creating it if needed. """
+    path = _db_path()
+    created = not os.path.exists(path)
+    db = sqlite3.connect(path, timeout=30)
+    if created:
+        # It holds the tokens of running jobs
+        os.chmod(path, 0o600)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    with db:
+        db.executescript(SCHEMA)
+        columns = [row['name']
+                   for row in db.execute('PRAGMA table_info(jobs)')]
+        if 'runner' not in columns:
+            # Databases created before jobs recorded their runner
+            db.execute('ALTER TABLE jobs ADD COLUMN runner TEXT')
+    return db
+
+
+class Job(object):
+    """ A job as seen by its handler. """
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.runner = row['runner']
+        self.kind = row['kind']
+        self.storage_url = row['storage_url']
+        self.auth_token = row['auth_token']
+        self.params = json.loads(row['params'])
+        self.progress = json.loads(row['progress'])
+
+    def save(self, progress):
+        """ Stores the progress of the job and returns whether it was
+        cancelled meanwhile, or taken over by another runner that thought
+        this one was gone. `progress` may be a dict or an object with an
+        as_dict method, like deletion.DeleteReport. """
+        if hasattr(progress, 'as_dict'):
+            progress = progress.as_dict()
+        self.progress = progress
+        db = connect()
+        try:
+            with db:
+                owned = db.execute(
+                    'UPDATE jobs SET progress = ?, updated = ? WHERE id = ? '
+                    'AND runner IS ?', (json.dumps(progress), time.time(),
+                                        self.id, self.runner)).rowcount
+            row = db.execute('SELECT cancel FROM jobs WHERE id = ?',
+                             (self.id, )).fetchone()
+        finally:
+            db.close()
+        return not owned or row is None or bool(row['cancel'])
+
+    def update(self, progress):
+        """ Like save, but raises deletion.Cancelled if the job was
+        cancelled, which stops the run at the current batch. """
+        if self.save(progress):
+            raise deletion.Cancelled()
+
+
+def _as_dict(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'description': row['description'],
+        'status': row['status'],
+        'progress': json.loads(row['progress']),
+        'error': row['error'],
+        'cancelling': bool(row['cancel']) and row['status'] not in FINISHED,
+        'created': row['created'],
+        'updated': row['updated'],
+    }
+
+
+def owner_of(session):
+    """ Returns the owner jobs of a session's user are filed under """
+    return '%s\n%s' % (session.get('storage_url', ''),
+                       session.get('username', ''))
+
+
+def submit(kind, owner, storage_url, auth_token, description, **params):
+    """ Queues a job and returns its id. """
+    if kind not in _handlers:
+        raise ValueError('Unknown job kind: %s' % kind)
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    db = connect()
+    try:
+        with db:
+            db.execute(
+                'INSERT INTO jobs (id, owner, kind, description, params, '
+                'storage_url, auth_token, status, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, owner, kind, description, json.dumps(params),
+                 storage_url, auth_token, QUEUED, now, now))
+    finally:
+        db.close()
+    get_runner().start(job_id)
+    return job_id
+
+
+def get(job_id, owner):
+    """ Returns the job as a dict, or None if `owner` has no such job. """
+    # Starts the runner of a fresh process, which picks up the jobs of
+    # workers that are gone, so a polled job is never left running
+    get_runner()
+    db = connect()
+    try:
+        row = db.execute('SELECT * FROM jobs WHERE id = ? AND owner = ?',
+                         (job_id, owner)).fetchone()
+    finally:
+        db.close()
+    return _as_dict(row) if row else None
+
+
+def list_jobs(owner, limit=50):
+    """ Returns the most recent jobs of `owner`, newest first. """
+    get_runner()
+    db = connect()
+    try:
+        rows = db.execute('SELECT * FROM jobs WHERE owner = ? '
+                          'ORDER BY created DESC LIMIT ?', (owner, limit))
+        return [_as_dict(row) for row in rows]
+    finally:
+        db.close()
+
+
+def cancel(job_id, owner):
+    """ Asks a job to stop; a queued job is cancelled right away.
+
+    Returns False if there is no such unfinished job. """
+    db = connect()
+    try:
+        with db:
+            changed = db.execute(
+                'UPDATE jobs SET cancel = 1, updated = ? WHERE id = ? AND '
+                'owner = ? AND status IN (?, ?)',
+                (time.time(), job_id, owner, QUEUED, RUNNING)).rowcount
+            db.execute('UPDATE jobs SET status = ? WHERE id = ? AND '
+                       'status = ?', (CANCELLED, job_id, QUEUED))
+    finally:
+        db.close()
+    return bool(changed)
+
+
+def resume(job_id, owner, auth_token):
+    """ Queues a failed or cancelled job again, with a fresh token.
+
+    The job continues from its stored progress. Returns False if there is
+    no such job. """
+    db = connect()
+    try:
+        with db:
+            changed = db.execute(
+                'UPDATE jobs SET status = ?, cancel = 0, error = NULL, '
+                'auth_token = ?, updated = ? WHERE id = ? AND owner = ? AND '
+                'status IN (?, ?)',
+                (QUEUED, auth_token, time.time(), job_id, owner, FAILED,
+                 CANCELLED)).rowcount
+    finally:
+        db.close()
+    if changed:
+        get_runner().start(job_id)
+    return bool(changed)
+
+
+def _finish(job, status, error=None):
+    db = connect()
+    try:
+        with db:
+            # The token is not needed any more; resume stores a new one
+            db.execute('UPDATE jobs SET status = ?, error = ?, updated = ?, '
+                       "auth_token = '' WHERE id = ? AND runner IS ? AND "
+                       'status = ?', (status, error, time.time(), job.id,
+                                      job.runner, RUNNING))
+    finally:
+        db.close()
+
+
+def _claim(job_id, runner_id):
+    """ Marks a queued job as running; returns its Job if this call won """
+    db = connect()
+    try:
+        with db:
+            claimed = db.execute(
+                'UPDATE jobs SET status = ?, runner = ?, updated = ? WHERE '
+                'id = ? AND status = ?',
+                (RUNNING, runner_id, time.time(), job_id, QUEUED)).rowcount
+            row = db.execute('SELECT * FROM jobs WHERE id = ?',
+                             (job_id, )).fetchone()
+    finally:
+        db.close()
+    return Job(row) if claimed else None
+
+
+def run(job_id, runner_id):
+    """ Runs a queued job in the current thread, for the runner with id
+    `runner_id`. """
+    job = _claim(job_id, runner_id)
+    if job is None:
+        return
+    logger.info('Job %s (%s) started', job.id, job.kind)
+    try:
+        _handlers[job.kind](job)
+    except deletion.Cancelled:
+        _finish(job, CANCELLED)
+        logger.info('Job %s cancelled', job.id)
+    except client.ClientException as exc:
+        _finish(job, FAILED, 'Swift returned %s' % (
+            exc.http_status or exc))
+        logger.warning('Job %s failed: %s', job.id, exc)
+    except Exception as exc:
+        _finish(job, FAILED, str(exc))
+        logger.exception('Job %s failed', job.id)
+    else:
+        _finish(job, DONE)
+        logger.info('Job %s done', job.id)
+
+
+class Runner(object):
+    """ Bounded thread pool that runs the jobs of this worker process. """
+
+    def __init__(self, workers, heartbeat, stale_after):
+        self.id = uuid.uuid4().hex
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='swift-job')
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        # Jobs submitted to the pool that have not finished yet
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def start(self, job_id):
+        with self.lock:
+            if job_id in self.pending:
+                return
+            self.pending.add(job_id)
+        self.executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            run(job_id, self.id)
+        finally:
+            with self.lock:
+                self.pending.discard(job_id)
+
+    def beat(self):
+        """ Records that this runner is alive """
+        db = connect()
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO runners (id, heartbeat) '
+                           'VALUES (?, ?)', (self.id, time.time()))
+        finally:
+            db.close()
+
+    def recover(self):
+        """ Queues the running jobs of runners that are gone again and
+        starts all queued jobs; another runner only gets the jobs this one
+        did not claim """
+        db = connect()
+        try:
+            with db:
+                db.execute('DELETE FROM runners WHERE heartbeat < ?',
+                           (time.time() - self.stale_after, ))
+                requeued = db.execute(
+                    'UPDATE jobs SET status = ?, runner = NULL WHERE '
+                    'status = ? AND (runner IS NULL OR runner NOT IN '
+                    '(SELECT id FROM runners))', (QUEUED, RUNNING)).rowcount
+                rows = db.execute('SELECT id FROM jobs WHERE status = ? '
+                                  'ORDER BY created', (QUEUED, )).fetchall()
+        finally:
+            db.close()
+        if requeued:
+            logger.info('Requeued %d jobs of stopped workers', requeued)
+        for row in rows:
+            self.start(row['id'])
+
+    def watch(self):
+        """ Beats and recovers every `heartbeat` seconds, forever """
+        while True:
+            try:
+                self.beat()
+                self.recover()
+            except sqlite3.Error:
+                logger.exception('Job recovery failed')
+            time.sleep(self.heartbeat)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """ Returns the job runner of this worker process, starting it and
+    its heartbeat thread on first use. """
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                runner = Runner(
+                    getattr(settings, 'SWIFT_JOBS_WORKERS', 2),
+                    getattr(settings, 'SWIFT_JOBS_HEARTBEAT', 10),
+                    getattr(settings, 'SWIFT_JOBS_STALE_AFTER', 30))
+                runner.beat()
+                runner.recover()
+                threading.Thread(target=runner.watch, daemon=True,
+                                 name='swift-job-watch').start()
+                _runner = runner
+    return _runner
+
+
+@handler('delete_container')
+def _delete_container(job):
+    container = job.params['container']
+    report = deletion.DeleteReport.from_dict(job.progress)
+    try:
+        report = deletion.delete_container(
+            job.storage_url, job.auth_token, container,
+            progress=job.update, report=report)
+    finally:
+        listing_cache.invalidate(job.storage_url, container)
+    job.save(report)
+    if report.failures:
+        raise RuntimeError('%d objects could not be deleted, the container '
+                           'was kept' % len(report.failures))
+
+
+@handler('delete_folder')
+def _delete_folder(job):
+    container = job.params['container']
+    report = deletion.DeleteReport.from_dict(job.progress)
+    try:
+        report = deletion.delete_folder(
+            job.storage_url, job.auth_token, container,
+            job.params['prefix'], progress=job.update, report=report)
+    finally:
+        listing_cache.invalidate(job.storage_url, container)
+    job.save(report)
+
+
+@handler('copy_folder')
+def _copy_folder(job):
+    params = job.params
+    report = copying.CopyReport.from_dict(job.progress)
+    try:
+        report = copying.copy_folder(
+            job.storage_url, job.auth_token, params['container'],
+            params['prefix'], params['dst_container'], params['dst_prefix'],
+            move=params['move'], progress=job.update, report=report)
+    finally:
+        listing_cache.invalidate(job.storage_url, params['dst_container'])
+        if params['move']:
+            listing_cache.invalidate(job.storage_url, params['container'])
+    job.save(report)
+
+
+@handler('search_index')
+def _search_index(job):
+    container = job.params['container']
+    try:
+        while True:
+            index = search_index.update(job.storage_url, job.auth_token,
+                                        container, search_index.JOB_BUDGET)
+            job.update(index)
+            if index['complete']:
+                break
+            # Lets a search request that holds the index lock finish
+            time.sleep(1)
+    finally:
+        cache.delete(search_index.job_key(job.storage_url, container))
@@ -0,0 +1,95 @@
+""" Temp URLs for every object of a container or pseudofolder.
+
+The listing is walked page by page and every object is signed with one
+TempURLSigner, so a folder of any size costs a single temp URL key lookup
+plus one listing request per page, and the export is streamed as CSV or
+JSON while it is produced. """
+# -*- coding: utf-8 -*-
+import csv
+import json
+import logging
+import time
+
+from swiftapp.listing import DIRECTORY_TYPES
+from swiftapp.utils import TempURLSigner, iter_listing, \
+    truncate_on_error
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8',
+                 'json': 'application/json'}
+# Rows written per chunk of the response
+BATCH_SIZE = 500
+
+
+class _Lines(object):
+    """ File-like object that hands the lines csv.writer writes back """
+
+    def write(self, line):
+        return line
+
+
+def iter_links(storage_url, auth_token, container, prefix, signer):
+    """ Yields (entry, temp URL) for every object below `prefix` """
+    for obj in iter_listing(storage_url, auth_token, container,
+                            prefix=prefix):
+        if obj.get('content_type') in DIRECTORY_TYPES or \
+                obj['name'].endswith('/'):
+            continue
+        yield (obj, signer.sign(container, obj['name']))
+
+
+def _batches(links):
+    batch = []
+    for link in links:
+        batch.append(link)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv(links, expires_at):
+    writer = csv.writer(_Lines())
+    yield writer.writerow(('name', 'bytes', 'expires', 'url'))
+    for batch in _batches(links):
+        yield ''.join(writer.writerow((obj['name'], obj.get('bytes', 0),
+                                       expires_at, url))
+                      for obj, url in batch)
+
+
+def _json(links, expires_at):
+    yield '{"expires":%d,"objects":[' % expires_at
+    separator = ''
+    for batch in _batches(links):
+        yield separator + ','.join(
+            json.dumps({'name': obj['name'], 'bytes': obj.get('bytes', 0),
+                        'url': url}, separators=(',', ':'))
+            for obj, url in batch)
+        separator = ','
+    yield ']}\n'
+
+
+def stream_links(storage_url, auth_token, container, prefix, key, expires,
+                 export_format='csv', digest='sha1'):
+    """ Yields the temp URLs of every object below `prefix` as text """
+    signer = TempURLSigner(storage_url, key, expires, digest=digest)
+    count = 0
+    started = time.monotonic()
+
+    def counted(links):
+        nonlocal count
+        for link in links:
+            count += 1
+            yield link
+
+    links = counted(iter_links(storage_url, auth_token, container, prefix,
+                               signer))
+    writer = _json if export_format == 'json' else _csv
+    yield from truncate_on_error(
+        writer(links, signer.expires), logger,
+        lambda: 'Temp URL export of %s/%s aborted after %d objects' % (
+            container, prefix or '', count))
+    logger.info('Signed %d temp URLs of %s/%s in %.1fs', count, container,
+                prefix or '', time.monotonic() - started)
@@ -0,0 +1,323 @@
+""" Shared cache for account and container listings.
+
+Entries are revalidated on every use with a cheap HEAD request: a cached
+listing is only served while the account or container stats returned by
+the HEAD still match the stats it was stored with. That HEAD bypasses the
+shared metadata cache (see swiftapp.metadata), so writes made outside this
+UI show up right away; only a HEAD made earlier in the same request is
+reused. Views that change a
+container bump its generation, which orphans all of its cached pages.
+
+Anonymous listings of public containers are cached differently, since
+they are hit far more often and by anyone: a page is served without any
+request to Swift for SWIFT_PUBLIC_CACHE_TIMEOUT seconds, and after that
+served stale for up to SWIFT_PUBLIC_CACHE_STALE seconds more while it is
+refreshed. The refresh is taken with cache.add, which is only atomic on
+backends like Memcached or Redis; on the file and local-memory caches two
+workers may occasionally refresh the same page at once. """
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from hashlib import sha1
+
+from swiftclient import client
+
+from django.conf import settings
+from django.core.cache import cache
+
+from swiftapp import aswift, metadata, swift
+from swiftapp.utils import aget_listing_page, get_listing_page
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_VALIDATORS = ('x-account-container-count', 'x-account-object-count',
+                      'x-account-bytes-used', 'x-timestamp',
+                      'x-put-timestamp')
+CONTAINER_VALIDATORS = ('x-container-object-count', 'x-container-bytes-used',
+                        'x-timestamp', 'x-put-timestamp', 'etag')
+
+
+def _hash(*parts):
+    return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _generation_key(storage_url, container):
+    return 'swift-listing-gen:%s' % _hash(storage_url, container)
+
+
+def _validator(meta, headers):
+    return '|'.join(str(meta.get(header, '')) for header in headers)
+
+
+def _timeout():
+    return getattr(settings, 'SWIFT_LISTING_CACHE_TIMEOUT', 300)
+
+
+def _public_timeouts():
+    """ Returns (fresh, stale) seconds of a public page """
+    return (getattr(settings, 'SWIFT_PUBLIC_CACHE_TIMEOUT', 30),
+            getattr(settings, 'SWIFT_PUBLIC_CACHE_STALE', 300))
+
+
+def _entry_key(generation, storage_url, container, *args):
+    return 'swift-listing:%s' % _hash(storage_url, container, generation,
+                                      *args)
+
+
+def _get_entry(storage_url, container, *args):
+    generation = cache.get(_generation_key(storage_url, container), 0)
+    key = _entry_key(generation, storage_url, container, *args)
+    return (key, cache.get(key))
+
+
+async def _aget_entry(storage_url, container, *args):
+    generation = await cache.aget(_generation_key(storage_url, container), 0)
+    key = _entry_key(generation, storage_url, container, *args)
+    return (key, await cache.aget(key))
+
+
+def _public_storage_url(storage_url):
+    """ Returns the storage URL anonymous views use for the same account """
+    account = storage_url.rstrip('/').rsplit('/', 1)[-1]
+    return getattr(settings, 'STORAGE_URL', '') + account
+
+
+def _generation_keys(storage_url, container):
+    keys = [_generation_key(storage_url, None)]
+    if container is not None:
+        keys.append(_generation_key(storage_url, container))
+        public_url = _public_storage_url(storage_url)
+        if public_url != storage_url:
+            keys.append(_generation_key(public_url, container))
+    return keys
+
+
+def invalidate(storage_url, container=None):
+    """ Drops all cached pages of a container and the account listing,
+    including the anonymous pages of the container.
+
+    Also drops their metadata, whose object counts have changed. """
+    metadata.invalidate(storage_url, container)
+    for key in _generation_keys(storage_url, container):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+async def ainvalidate(storage_url, container=None):
+    """ Async variant of invalidate. """
+    await metadata.ainvalidate(storage_url, container)
+    for key in _generation_keys(storage_url, container):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, 1, None)
+
+
+def get_account(storage_url, auth_token):
+    """ Returns (account_stat, containers) like swift.get_account.
+
+    The account is HEADed first; the container listing is only fetched if
+    the cached copy is missing or the account stats have changed. """
+    meta = metadata.head_account(storage_url, auth_token, cached=False)
+    validator = _validator(meta, ACCOUNT_VALIDATORS)
+    key, entry = _get_entry(storage_url, None)
+    if entry and entry[0] == validator:
+        return (meta, entry[1])
+
+    meta, containers = swift.get_account(storage_url, auth_token)
+    cache.set(key, (validator, containers), _timeout())
+    return (meta, containers)
+
+
+def get_listing_page_cached(storage_url, auth_token, container, prefix=None,
+                            marker=None, end_marker=None, limit=500):
+    """ Cached variant of utils.get_listing_page.
+
+    The returned meta always comes from a fresh HEAD, so ACLs and other
+    container metadata are never stale. """
+    meta = metadata.head_container(storage_url, auth_token, container,
+                                   cached=False)
+    validator = _validator(meta, CONTAINER_VALIDATORS)
+    key, entry = _get_entry(storage_url, container, prefix, marker,
+                            end_marker, limit)
+    if entry and entry[0] == validator:
+        return (meta, entry[1], entry[2])
+
+    _meta, objects, page = get_listing_page(
+        storage_url, auth_token, container, prefix=prefix, marker=marker,
+        end_marker=end_marker, limit=limit)
+    # Stored with the stats seen before the GET; a change in between only
+    # causes one needless refetch, never a stale hit.
+    cache.set(key, (validator, objects, page), _timeout())
+    return (meta, objects, page)
+
+
+async def aget_account(storage_url, auth_token):
+    """ Async variant of get_account.
+
+    The HEAD and the cache lookup run concurrently. """
+    meta, (key, entry) = await asyncio.gather(
+        metadata.ahead_account(storage_url, auth_token, cached=False),
+        _aget_entry(storage_url, None))
+    validator = _validator(meta, ACCOUNT_VALIDATORS)
+    if entry and entry[0] == validator:
+        return (meta, entry[1])
+
+    meta, containers = await aswift.get_account(storage_url, auth_token)
+    await cache.aset(key, (validator, containers), _timeout())
+    return (meta, containers)
+
+
+async def aget_listing_page_cached(storage_url, auth_token, container,
+                                   prefix=None, marker=None, end_marker=None,
+                                   limit=500):
+    """ Async variant of get_listing_page_cached.
+
+    The HEAD and the cache lookup run concurrently. """
+    meta, (key, entry) = await asyncio.gather(
+        metadata.ahead_container(storage_url, auth_token, container,
+                                 cached=False),
+        _aget_entry(storage_url, container, prefix, marker, end_marker,
+                    limit))
+    validator = _validator(meta, CONTAINER_VALIDATORS)
+    if entry and entry[0] == validator:
+        return (meta, entry[1], entry[2])
+
+    _meta, objects, page = await aget_listing_page(
+        storage_url, auth_token, container, prefix=prefix, marker=marker,
+        end_marker=end_marker, limit=limit)
+    await cache.aset(key, (validator, objects, page), _timeout())
+    return (meta, objects, page)
+
+
+# A refresh that takes longer than this lets another worker try
+PUBLIC_REFRESH_TIMEOUT = 30
+# Seconds a cold miss waits for the worker filling it before fetching itself
+PUBLIC_WAIT = 5
+# Swift answers that end a public listing instead of leaving it stale
+_PUBLIC_GONE = (401, 403, 404)
+
+
+def _public_entry(objects, page):
+    """ Returns the cache entry (fresh until, ETag, objects, page) """
+    fresh, _stale = _public_timeouts()
+    etag = '"%s"' % _hash(
+        [(obj.get('subdir') or obj.get('name'), obj.get('hash'),
+          obj.get('bytes'), obj.get('last_modified')) for obj in objects],
+        sorted(page.items()))
+    return (time.time() + fresh, etag, objects, page)
+
+
+def _fetch_public(storage_url, container, prefix, marker, end_marker, limit):
+    _meta, objects, page = get_listing_page(
+        storage_url, b'', container, prefix=prefix, marker=marker,
+        end_marker=end_marker, limit=limit)
+    return _public_entry(objects, page)
+
+
+def _store_public(key, entry):
+    fresh, stale = _public_timeouts()
+    cache.set(key, entry, fresh + stale)
+
+
+def get_public_page(storage_url, container, prefix=None, marker=None,
+                    end_marker=None, limit=500):
+    """ Returns (fresh until, ETag, objects, page) of one page of an
+    anonymous listing, like utils.get_listing_page without a token.
+
+    A fresh page comes from the cache alone. Once it is stale, the worker
+    that takes the refresh lock fetches it again while all others keep
+    serving the stale copy; a page nobody has cached yet is fetched by
+    that worker while the others wait for it. Only an atomic cache backend
+    guarantees a single refresher, see the module docstring. The ETag only changes with the
+    listing itself, so a refreshed but unchanged page keeps it. If Swift
+    fails, the stale copy is served until it expires, unless Swift says the
+    container is gone or no longer public. """
+    key, entry = _get_entry(storage_url, container, 'public', prefix,
+                            marker, end_marker, limit)
+    if entry is not None and entry[0] > time.time():
+        return entry
+    args = (storage_url, container, prefix, marker, end_marker, limit)
+    lock_key = key + ':refresh'
+
+    if cache.add(lock_key, 1, PUBLIC_REFRESH_TIMEOUT):
+        try:
+            fresh_entry = _fetch_public(*args)
+        except client.ClientException as exc:
+            if entry is None or exc.http_status in _PUBLIC_GONE:
+                cache.delete(key)
+                raise
+            logger.warning('Serving stale public listing of %s: %s',
+                           container, exc)
+            return entry
+        finally:
+            cache.delete(lock_key)
+        _store_public(key, fresh_entry)
+        return fresh_entry
+
+    if entry is not None:
+        return entry
+    deadline = time.monotonic() + PUBLIC_WAIT
+    while time.monotonic() < deadline and cache.get(lock_key) is not None:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    entry = _fetch_public(*args)
+    _store_public(key, entry)
+    return entry
+
+
+async def _afetch_public(storage_url, container, prefix, marker, end_marker,
+                         limit):
+    _meta, objects, page = await aget_listing_page(
+        storage_url, b'', container, prefix=prefix, marker=marker,
+        end_marker=end_marker, limit=limit)
+    return _public_entry(objects, page)
+
+
+async def _astore_public(key, entry):
+    fresh, stale = _public_timeouts()
+    await cache.aset(key, entry, fresh + stale)
+
+
+async def aget_public_page(storage_url, container, prefix=None, marker=None,
+                           end_marker=None, limit=500):
+    """ Async variant of get_public_page. """
+    key, entry = await _aget_entry(storage_url, container, 'public', prefix,
+                                   marker, end_marker, limit)
+    if entry is not None and entry[0] > time.time():
+        return entry
+    args = (storage_url, container, prefix, marker, end_marker, limit)
+    lock_key = key + ':refresh'
+
+    if await cache.aadd(lock_key, 1, PUBLIC_REFRESH_TIMEOUT):
+        try:
+            fresh_entry = await _afetch_public(*args)
+        except client.ClientException as exc:
+            if entry is None or exc.http_status in _PUBLIC_GONE:
+                await cache.adelete(key)
+                raise
+            logger.warning('Serving stale public listing of %s: %s',
+                           container, exc)
+            return entry
+        finally:
+            await cache.adelete(lock_key)
+        await _astore_public(key, fresh_entry)
+        return fresh_entry
+
+    if entry is not None:
+        return entry
+    deadline = time.monotonic() + PUBLIC_WAIT
+    while time.monotonic() < deadline and \
+            await cache.aget(lock_key) is not None:
+        await asyncio.sleep(0.05)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry
+    entry = await _afetch_public(*args)
+    await _astore_public(key, entry)
+    return entry
@@ -0,0 +1,306 @@
+""" Account and container metadata with memoization.
+
+HEAD results are memoized for the duration of a request (see
+swiftapp.middleware.SwiftMetadataMiddleware), so a view and the helpers it
+calls share a single HEAD, and kept in the shared cache for
+SWIFT_METADATA_CACHE_TIMEOUT seconds, so a redirect after a write does not
+fetch them again. Entries are per token, since the metadata a HEAD returns
+depends on the user's permissions. POSTs made through this module update
+the stored metadata in place; `invalidate` drops it after other writes.
+
+Writes made outside this UI only show up in the shared cache once the
+entry expires. Callers that must see them, like the listing cache, which
+revalidates its listings against the object counts, pass cached=False:
+they always get a HEAD made during the current request.
+
+Temp URL keys are secrets and never written to the shared cache; reading
+them takes a HEAD, see utils.get_temp_key. """
+# -*- coding: utf-8 -*-
+import contextvars
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+
+from swiftapp import aswift, singleflight, swift
+
+_memo = contextvars.ContextVar('swift_metadata', default=None)
+
+SECRET_HEADERS = ('x-account-meta-temp-url-key',
+                  'x-account-meta-temp-url-key-2',
+                  'x-container-meta-temp-url-key',
+                  'x-container-meta-temp-url-key-2')
+
+
+def start_request():
+    """ Starts memoizing metadata for the current request. """
+    return _memo.set({})
+
+
+def finish_request(token):
+    _memo.reset(token)
+
+
+def _timeout():
+    return getattr(settings, 'SWIFT_METADATA_CACHE_TIMEOUT', 10)
+
+
+def _hash(*parts):
+    return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _generation_key(storage_url, container):
+    return 'swift-meta-gen:%s' % _hash(storage_url, container)
+
+
+def _key(generation, storage_url, auth_token, container):
+    return 'swift-meta:%s' % _hash(storage_url, auth_token, container,
+                                   generation)
+
+
+def _shareable(meta):
+    """ Returns `meta` without the headers kept out of the shared cache """
+    return dict((name, value) for name, value in meta.items()
+                if name not in SECRET_HEADERS)
+
+
+def _updated(meta, headers):
+    """ Returns `meta` as it is after POSTing `headers` to Swift """
+    meta = dict(meta)
+    for name, value in headers.items():
+        name = name.lower()
+        if name.startswith('x-remove-'):
+            meta.pop('x-' + name[len('x-remove-'):], None)
+        elif value in ('', None):
+            meta.pop(name, None)
+        else:
+            meta[name] = str(value)
+    return meta
+
+
+def _memo_key(storage_url, auth_token, container):
+    return (storage_url, auth_token, container)
+
+
+def _get(storage_url, auth_token, container, fetch, refresh, cached=True):
+    memo = _memo.get()
+    memo_key = _memo_key(storage_url, auth_token, container)
+    if not refresh and memo is not None and memo_key in memo:
+        meta, fetched = memo[memo_key]
+        if cached or fetched:
+            return dict(meta)
+
+    timeout = _timeout()
+    meta = None
+    if timeout:
+        generation = cache.get(_generation_key(storage_url, container), 0)
+        key = _key(generation, storage_url, auth_token, container)
+        if not refresh and cached:
+            meta = cache.get(key)
+    fetched = meta is None
+    if fetched:
+        meta = fetch()
+        if timeout:
+            cache.set(key, _shareable(meta), timeout)
+    if memo is not None:
+        memo[memo_key] = (meta, fetched)
+    return dict(meta)
+
+
+async def _aget(storage_url, auth_token, container, fetch, refresh,
+                cached=True):
+    memo = _memo.get()
+    memo_key = _memo_key(storage_url, auth_token, container)
+    if not refresh and memo is not None and memo_key in memo:
+        meta, fetched = memo[memo_key]
+        if cached or fetched:
+            return dict(meta)
+
+    timeout = _timeout()
+    meta = None
+    if timeout:
+        generation = await cache.aget(
+            _generation_key(storage_url, container), 0)
+        key = _key(generation, storage_url, auth_token, container)
+        if not refresh and cached:
+            meta = await cache.aget(key)
+    fetched = meta is None
+    if fetched:
+        meta = await fetch()
+        if timeout:
+            await cache.aset(key, _shareable(meta), timeout)
+    if memo is not None:
+        memo[memo_key] = (meta, fetched)
+    return dict(meta)
+
+
+def _bump(storage_url, container):
+    # Reads still in flight may predate the write that got us here
+    singleflight.forget(storage_url, container)
+    key = _generation_key(storage_url, container)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+async def _abump(storage_url, container):
+    await singleflight.aforget(storage_url, container)
+    key = _generation_key(storage_url, container)
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, None)
+        return 1
+
+
+def _store(storage_url, auth_token, container, meta, generation):
+    """ Replaces the memoized and cached metadata after our own POST.
+
+    The generation was bumped by the caller, so entries cached for other
+    tokens are dropped rather than left stale. """
+    memo = _memo.get()
+    if memo is not None:
+        memo.pop(_memo_key(storage_url, auth_token, container), None)
+        if meta is not None:
+            memo[_memo_key(storage_url, auth_token, container)] = (meta,
+                                                                   False)
+    if meta is not None and _timeout():
+        cache.set(_key(generation, storage_url, auth_token, container),
+                  _shareable(meta), _timeout())
+
+
+async def _astore(storage_url, auth_token, container, meta, generation):
+    memo = _memo.get()
+    if memo is not None:
+        memo.pop(_memo_key(storage_url, auth_token, container), None)
+        if meta is not None:
+            memo[_memo_key(storage_url, auth_token, container)] = (meta,
+                                                                   False)
+    if meta is not None and _timeout():
+        await cache.aset(
+            _key(generation, storage_url, auth_token, container),
+            _shareable(meta), _timeout())
+
+
+def _known(storage_url, auth_token, container):
+    """ Returns the metadata read before, without a request, or None """
+    memo = _memo.get()
+    if memo is not None:
+        entry = memo.get(_memo_key(storage_url, auth_token, container))
+        if entry is not None:
+            return entry[0]
+    if not _timeout():
+        return None
+    generation = cache.get(_generation_key(storage_url, container), 0)
+    return cache.get(_key(generation, storage_url, auth_token, container))
+
+
+async def _aknown(storage_url, auth_token, container):
+    memo = _memo.get()
+    if memo is not None:
+        entry = memo.get(_memo_key(storage_url, auth_token, container))
+        if entry is not None:
+            return entry[0]
+    if not _timeout():
+        return None
+    generation = await cache.aget(_generation_key(storage_url, container), 0)
+    return await cache.aget(
+        _key(generation, storage_url, auth_token, container))
+
+
+def invalidate(storage_url, container=None):
+    """ Drops the metadata of a container and of its account. """
+    _bump(storage_url, None)
+    if container is not None:
+        _bump(storage_url, container)
+    memo = _memo.get()
+    if memo is not None:
+        for key in list(memo):
+            if key[0] == storage_url and key[2] in (None, container):
+                del memo[key]
+
+
+async def ainvalidate(storage_url, container=None):
+    """ Async variant of invalidate. """
+    await _abump(storage_url, None)
+    if container is not None:
+        await _abump(storage_url, container)
+    memo = _memo.get()
+    if memo is not None:
+        for key in list(memo):
+            if key[0] == storage_url and key[2] in (None, container):
+                del memo[key]
+
+
+def head_account(storage_url, auth_token, refresh=False, cached=True):
+    """ Returns the account metadata like swift.head_account.
+
+    `refresh` always makes a new HEAD; with `cached` off, a HEAD made
+    earlier in the same request is used, but no shared cache entry. """
+    return _get(storage_url, auth_token, None,
+                lambda: swift.head_account(storage_url, auth_token), refresh,
+                cached)
+
+
+def head_container(storage_url, auth_token, container, refresh=False,
+                   cached=True):
+    """ Returns the container metadata like swift.head_container, with
+    `refresh` and `cached` as in head_account. """
+    return _get(storage_url, auth_token, container,
+                lambda: swift.head_container(storage_url, auth_token,
+                                             container), refresh, cached)
+
+
+def post_account(storage_url, auth_token, headers):
+    """ POSTs account metadata and returns the updated metadata.
+
+    The result is only known if the metadata was read before and is still
+    memoized or cached; otherwise None is returned and the next HEAD
+    refetches. """
+    swift.post_account(storage_url, auth_token, headers)
+    meta = _known(storage_url, auth_token, None)
+    meta = _updated(meta, headers) if meta is not None else None
+    generation = _bump(storage_url, None)
+    _store(storage_url, auth_token, None, meta, generation)
+    return meta
+
+
+def post_container(storage_url, auth_token, container, headers):
+    """ POSTs container metadata and returns the updated metadata.
+
+    See post_account for when the result is None. """
+    swift.post_container(storage_url, auth_token, container, headers)
+    meta = _known(storage_url, auth_token, container)
+    meta = _updated(meta, headers) if meta is not None else None
+    generation = _bump(storage_url, container)
+    _store(storage_url, auth_token, container, meta, generation)
+    return meta
+
+
+async def ahead_account(storage_url, auth_token, refresh=False,
+                        cached=True):
+    """ Async variant of head_account. """
+    return await _aget(storage_url, auth_token, None,
+                       lambda: aswift.head_account(storage_url, auth_token),
+                       refresh, cached)
+
+
+async def ahead_container(storage_url, auth_token, container, refresh=False,
+                          cached=True):
+    """ Async variant of head_container. """
+    return await _aget(storage_url, auth_token, container,
+                       lambda: aswift.head_container(storage_url, auth_token,
+                                                     container),
+                       refresh, cached)
+
+
+async def apost_account(storage_url, auth_token, headers):
+    """ Async variant of post_account. """
+    await aswift.post_account(storage_url, auth_token, headers)
+    meta = await _aknown(storage_url, auth_token, None)
+    meta = _updated(meta, headers) if meta is not None else None
+    generation = await _abump(storage_url, None)
+    await _astore(storage_url, auth_token, None, meta, generation)
+    return meta
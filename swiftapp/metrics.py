@@ -0,0 +1,227 @@
+""" Timing of Swift API calls.
+
+Every call made through swiftapp.swift and swiftapp.aswift is recorded with
+its operation, container, status, latency and response size. Calls are
+collected per request for the Server-Timing header (see
+swiftapp.middleware.SwiftMetricsMiddleware) and aggregated into
+per-operation histograms that `render` exposes in the Prometheus text
+format, along with counters of the reads swiftapp.singleflight coalesced.
+Histograms live in the memory of each worker process, so every worker
+reports its own figures. """
+# -*- coding: utf-8 -*-
+import contextvars
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           float('inf'))
+QUANTILES = (0.5, 0.95, 0.99)
+
+Call = namedtuple('Call', 'operation container status seconds bytes')
+
+_calls = contextvars.ContextVar('swift_calls', default=None)
+
+
+class Histogram(object):
+    """ Latency histogram of one operation with fixed buckets. """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.bytes = 0
+        self.statuses = {}
+
+    def observe(self, seconds, size, status):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+        self.bytes += size
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def quantile(self, q):
+        """ Estimates a quantile like Prometheus' histogram_quantile. """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bound in enumerate(BUCKETS):
+            if seen + self.counts[i] >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                if bound == float('inf'):
+                    return lower
+                fraction = (rank - seen) / self.counts[i]
+                return lower + (bound - lower) * fraction
+            seen += self.counts[i]
+        return BUCKETS[-2]
+
+
+_histograms = {}
+# {(operation, scope): [calls, waiters]} of coalesced reads
+_coalesced = {}
+_lock = threading.Lock()
+
+
+def status_of(exc):
+    """ Returns the status label for a call that raised `exc`. """
+    status = getattr(exc, 'http_status', None)
+    return str(status) if status else 'error'
+
+
+def record(operation, container, status, seconds, size=0):
+    """ Records one finished Swift call. """
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = Histogram()
+        histogram.observe(seconds, size, status)
+    logger.debug('%s %s: %s in %.1f ms, %d bytes', operation, container or '',
+                 status, seconds * 1000, size)
+    calls = _calls.get()
+    if calls is not None:
+        calls.append(Call(operation, container, status, seconds, size))
+
+
+def record_coalesced(operation, scope, calls=0, waiters=0):
+    """ Counts reads that were answered by an identical call in flight
+    (`waiters`) and calls whose result was shared (`calls`). `scope` is
+    'local' within the worker process or 'shared' across workers. """
+    with _lock:
+        counts = _coalesced.setdefault((operation, scope), [0, 0])
+        counts[0] += calls
+        counts[1] += waiters
+
+
+def start_request():
+    """ Starts collecting the calls of the current request. """
+    calls = []
+    return (calls, _calls.set(calls))
+
+
+def finish_request(token):
+    _calls.reset(token)
+
+
+def server_timing(calls):
+    """ Returns a Server-Timing header value summarizing `calls`. """
+    totals = {}
+    for call in calls:
+        total = totals.setdefault(call.operation, [0, 0.0])
+        total[0] += 1
+        total[1] += call.seconds
+    entries = ['swift;dur=%.1f;desc="%d calls"' % (
+        sum(call.seconds for call in calls) * 1000, len(calls))]
+    for operation, (count, seconds) in sorted(totals.items()):
+        entries.append('swift-%s;dur=%.1f;desc="%d"' % (
+            operation.replace('_', '-'), seconds * 1000, count))
+    return ', '.join(entries)
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"'))
+                    for key, value in labels.items())
+
+
+def render():
+    """ Returns all histograms in the Prometheus text exposition format. """
+    with _lock:
+        histograms = sorted(
+            (operation, histogram.counts[:], histogram.sum, histogram.count,
+             histogram.bytes, dict(histogram.statuses),
+             [histogram.quantile(q) for q in QUANTILES])
+            for operation, histogram in _histograms.items())
+        coalesced = sorted((key, counts[:])
+                           for key, counts in _coalesced.items())
+
+    lines = [
+        '# HELP swift_requests_total Swift API calls by operation and status.',
+        '# TYPE swift_requests_total counter',
+    ]
+    for operation, _c, _s, _n, _b, statuses, _q in histograms:
+        for status, count in sorted(statuses.items()):
+            lines.append('swift_requests_total{%s} %d' % (
+                _labels(operation=operation, status=status), count))
+
+    lines += [
+        '# HELP swift_request_duration_seconds Latency of Swift API calls.',
+        '# TYPE swift_request_duration_seconds histogram',
+    ]
+    for operation, counts, total, count, _b, _st, _q in histograms:
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('swift_request_duration_seconds_bucket{%s} %d' % (
+                _labels(operation=operation, le=le), cumulative))
+        lines.append('swift_request_duration_seconds_sum{%s} %f' % (
+            _labels(operation=operation), total))
+        lines.append('swift_request_duration_seconds_count{%s} %d' % (
+            _labels(operation=operation), count))
+
+    lines += [
+        '# HELP swift_request_duration_quantile_seconds Latency quantiles '
+        'estimated from the histogram.',
+        '# TYPE swift_request_duration_quantile_seconds gauge',
+    ]
+    for operation, _c, _s, _n, _b, _st, quantiles in histograms:
+        for q, value in zip(QUANTILES, quantiles):
+            lines.append('swift_request_duration_quantile_seconds{%s} %f' % (
+                _labels(operation=operation, quantile=q), value))
+
+    lines += [
+        '# HELP swift_response_bytes_total Bytes received from Swift.',
+        '# TYPE swift_response_bytes_total counter',
+    ]
+    for operation, _c, _s, _n, size, _st, _q in histograms:
+        lines.append('swift_response_bytes_total{%s} %d' % (
+            _labels(operation=operation), size))
+
+    lines += [
+        '# HELP swift_coalesced_calls_total Swift calls whose result was '
+        'shared with identical concurrent reads.',
+        '# TYPE swift_coalesced_calls_total counter',
+    ]
+    for (operation, scope), (calls, _w) in coalesced:
+        if scope == 'local':
+            lines.append('swift_coalesced_calls_total{%s} %d' % (
+                _labels(operation=operation), calls))
+    lines += [
+        '# HELP swift_coalesced_waiters_total Reads answered by an '
+        'identical call already in flight instead of calling Swift.',
+        '# TYPE swift_coalesced_waiters_total counter',
+    ]
+    for (operation, scope), (_c, waiters) in coalesced:
+        lines.append('swift_coalesced_waiters_total{%s} %d' % (
+            _labels(operation=operation, scope=scope), waiters))
+    return '\n'.join(lines) + '\n'
+
+
+def totals():
+    """ Returns {operation: (calls, seconds)} over all recorded calls. """
+    with _lock:
+        return {operation: (histogram.count, histogram.sum)
+                for operation, histogram in _histograms.items()}
+
+
+def coalesced_totals():
+    """ Returns {operation: (calls, waiters)} of coalesced reads. """
+    totals = {}
+    with _lock:
+        for (operation, _scope), (calls, waiters) in _coalesced.items():
+            total = totals.get(operation, (0, 0))
+            totals[operation] = (total[0] + calls, total[1] + waiters)
+    return totals
+
+
+def reset():
+    """ Drops all recorded histograms and counters. """
+    with _lock:
+        _histograms.clear()
+        _coalesced.clear()
@@ -0,0 +1,97 @@
+""" Middleware for the Swift web interface. """
+# -*- coding: utf-8 -*-
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from swiftapp import auth, metadata, metrics
+
+
+class SwiftAuthMiddleware(object):
+    """ Refreshes the Keystone token of a session before it expires.
+
+    Must come after SessionMiddleware. Works for both the sync and the
+    async views. """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if auth.needs_refresh(request.session):
+            auth.refresh(request.session)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if await auth.aneeds_refresh(request.session):
+            await auth.arefresh(request.session)
+        return await self.get_response(request)
+
+
+class SwiftMetricsMiddleware(object):
+    """ Adds a Server-Timing header with the Swift calls of a request.
+
+    Works for both the sync and the async views. Calls made while a
+    streaming response is sent happen after the headers and only show up
+    in the metrics endpoint. """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        calls, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        if calls:
+            response['Server-Timing'] = metrics.server_timing(calls)
+        return response
+
+    async def __acall__(self, request):
+        calls, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        if calls:
+            response['Server-Timing'] = metrics.server_timing(calls)
+        return response
+
+
+class SwiftMetadataMiddleware(object):
+    """ Memoizes account and container metadata for one request.
+
+    See swiftapp.metadata. Works for both the sync and the async views. """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metadata.start_request()
+        try:
+            return self.get_response(request)
+        finally:
+            metadata.finish_request(token)
+
+    async def __acall__(self, request):
+        token = metadata.start_request()
+        try:
+            return await self.get_response(request)
+        finally:
+            metadata.finish_request(token)
@@ -0,0 +1,343 @@
+""" Local search index of container listings.
+
+Every container gets a SQLite database below SWIFT_SEARCH_INDEX_DIR that
+holds name, size, content type and last modification of each object, with
+an FTS5 trigram index on the names for substring queries. The index is
+filled by streaming the container listing page by page. A pass resumes
+from the last stored marker: a search request only indexes for a fraction
+of a second, and a background job (see swiftapp.jobs) finishes a pass the
+request could not. Later passes only write the objects that have changed,
+and a pass is skipped entirely while the container stats are unchanged.
+
+The same pass keeps per-pseudofolder totals of bytes and objects at every
+depth up to date, by applying the size difference of each written or
+removed object to all of its parent folders. """
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sqlite3
+import time
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+
+from swiftapp import metadata, swift
+from swiftapp.listing_cache import CONTAINER_VALIDATORS
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10000
+# Seconds a background job indexes before saving its progress
+JOB_BUDGET = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT NOT NULL UNIQUE,
+    bytes INTEGER NOT NULL,
+    content_type TEXT,
+    last_modified TEXT,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_bytes ON objects (bytes);
+CREATE INDEX IF NOT EXISTS objects_last_modified ON objects (last_modified);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    objects INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+    name, content='objects', content_rowid='rowid', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS objects_ai AFTER INSERT ON objects BEGIN
+    INSERT INTO names (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS objects_ad AFTER DELETE ON objects BEGIN
+    INSERT INTO names (names, rowid, name)
+    VALUES ('delete', old.rowid, old.name);
+END;
+"""
+
+
+def _index_path(storage_url, container):
+    directory = getattr(settings, 'SWIFT_SEARCH_INDEX_DIR',
+                        os.path.join(settings.BASE_DIR, 'index'))
+    os.makedirs(directory, exist_ok=True)
+    digest = sha1(('%s\n%s' % (storage_url, container)).encode('utf-8'))
+    return os.path.join(directory, '%s.sqlite3' % digest.hexdigest())
+
+
+def connect(storage_url, container):
+    """ Opens the index of a container, creating it if needed. """
+    db = sqlite3.connect(_index_path(storage_url, container), timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    with db:
+        db.executescript(SCHEMA)
+        if _get_meta(db, 'fts') is None:
+            try:
+                db.executescript(FTS_SCHEMA)
+                _set_meta(db, 'fts', '1')
+            except sqlite3.OperationalError:
+                # SQLite without FTS5 or the trigram tokenizer
+                _set_meta(db, 'fts', '0')
+        if _get_meta(db, 'folders') is None:
+            _rebuild_folders(db)
+            _set_meta(db, 'folders', '1')
+    return db
+
+
+def _get_meta(db, key, default=None):
+    row = db.execute('SELECT value FROM meta WHERE key = ?',
+                     (key, )).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(db, key, value):
+    db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+               (key, value))
+
+
+def _validator(meta):
+    return '|'.join(str(meta.get(header, ''))
+                    for header in CONTAINER_VALIDATORS)
+
+
+def _parents(name):
+    """ Returns '' and every pseudofolder above an object name. """
+    parents = ['']
+    pos = name.find('/')
+    while 0 <= pos < len(name) - 1:
+        parents.append(name[:pos + 1])
+        pos = name.find('/', pos + 1)
+    return parents
+
+
+def _add_usage(usage, name, size, count):
+    for path in _parents(name):
+        total = usage.get(path)
+        if total is None:
+            usage[path] = [size, count]
+        else:
+            total[0] += size
+            total[1] += count
+
+
+def _write_usage(db, usage):
+    db.executemany(
+        'INSERT INTO folders (path, bytes, objects) VALUES (?, ?, ?) '
+        'ON CONFLICT (path) DO UPDATE SET bytes = bytes + excluded.bytes, '
+        'objects = objects + excluded.objects',
+        [(path, total[0], total[1]) for path, total in usage.items()
+         if total[0] or total[1]])
+    db.execute('DELETE FROM folders WHERE objects <= 0')
+
+
+def _rebuild_folders(db):
+    db.execute('DELETE FROM folders')
+    usage = {}
+    for name, size in db.execute('SELECT name, bytes FROM objects'):
+        _add_usage(usage, name, size, 1)
+    _write_usage(db, usage)
+
+
+def _apply_page(db, objects, marker, last):
+    """ Syncs the index rows between `marker` and `last` with a page.
+
+    Rows in that range that are missing from the page were deleted in
+    Swift; rows whose etag or modification time differ are rewritten. """
+    if last is None:
+        rows = db.execute('SELECT name, hash, last_modified, bytes '
+                          'FROM objects WHERE name > ?', (marker, ))
+    else:
+        rows = db.execute('SELECT name, hash, last_modified, bytes '
+                          'FROM objects WHERE name > ? AND name <= ?',
+                          (marker, last))
+    known = {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    added = []
+    changed = []
+    usage = {}
+    for obj in objects:
+        name = obj.get('name')
+        if name is None:
+            continue
+        state = (obj.get('hash'), obj.get('last_modified'))
+        old = known.pop(name, None)
+        if old is None or old[:2] != state:
+            size = obj.get('bytes', 0)
+            row = (size, obj.get('content_type'), state[1], state[0], name)
+            if old is None:
+                added.append(row)
+                _add_usage(usage, name, size, 1)
+            else:
+                changed.append(row)
+                _add_usage(usage, name, size - old[2], 0)
+    for name, old in known.items():
+        _add_usage(usage, name, -old[2], -1)
+
+    if usage:
+        _write_usage(db, usage)
+    if known:
+        db.executemany('DELETE FROM objects WHERE name = ?',
+                       [(name, ) for name in known])
+    if changed:
+        db.executemany(
+            'UPDATE objects SET bytes = ?, content_type = ?, '
+            'last_modified = ?, hash = ? WHERE name = ?', changed)
+    if added:
+        db.executemany(
+            'INSERT INTO objects (bytes, content_type, last_modified, hash, '
+            'name) VALUES (?, ?, ?, ?, ?)', added)
+    return (len(added) + len(changed), len(known))
+
+
+def _key(prefix, storage_url, container):
+    return '%s:%s' % (prefix, sha1(
+        _index_path(storage_url, container).encode('utf-8')).hexdigest())
+
+
+def job_key(storage_url, container):
+    """ Returns the cache key that is set while a job indexes a container """
+    return _key('swift-search-job', storage_url, container)
+
+
+def update(storage_url, auth_token, container, budget=None):
+    """ Brings the index of a container up to date.
+
+    Stops after `budget` seconds, checked after every page, and continues
+    from the stored marker on the next call. Only one worker updates a
+    given index at a time; others return right away. Returns the index
+    status, see `status`. """
+    if budget is None:
+        budget = getattr(settings, 'SWIFT_SEARCH_UPDATE_BUDGET', 0.5)
+    db = connect(storage_url, container)
+    lock_key = _key('swift-search-lock', storage_url, container)
+    try:
+        if not cache.add(lock_key, 1, budget + 60):
+            return status(db)
+        try:
+            _update(db, storage_url, auth_token, container, budget)
+        finally:
+            cache.delete(lock_key)
+        return status(db)
+    finally:
+        db.close()
+
+
+def _update(db, storage_url, auth_token, container, budget):
+    deadline = time.monotonic() + budget
+    marker = _get_meta(db, 'marker')
+    if marker is None:
+        meta = metadata.head_container(storage_url, auth_token, container)
+        validator = _validator(meta)
+        if validator == _get_meta(db, 'validator'):
+            return
+        # Stats taken before the pass; changes during it trigger another
+        with db:
+            _set_meta(db, 'pass_validator', validator)
+            _set_meta(db, 'marker', '')
+        marker = ''
+
+    written = removed = 0
+    while time.monotonic() < deadline:
+        _meta, objects = swift.get_container(
+            storage_url, auth_token, container, marker=marker,
+            limit=PAGE_SIZE)
+        last = objects[-1]['name'] if len(objects) == PAGE_SIZE else None
+        with db:
+            counts = _apply_page(db, objects, marker, last)
+            if last is None:
+                _set_meta(db, 'validator', _get_meta(db, 'pass_validator'))
+                _set_meta(db, 'updated', str(time.time()))
+                db.execute("DELETE FROM meta WHERE key = 'marker'")
+            else:
+                _set_meta(db, 'marker', last)
+        written += counts[0]
+        removed += counts[1]
+        if last is None:
+            break
+        marker = last
+    logger.info('Search index of %s: %d objects written, %d removed',
+                container, written, removed)
+
+
+def status(db):
+    """ Returns a dict with the object count and the state of the index """
+    count = db.execute('SELECT count(*) FROM objects').fetchone()[0]
+    updated = _get_meta(db, 'updated')
+    return {
+        'objects': count,
+        'complete': _get_meta(db, 'marker') is None and updated is not None,
+        'updated': float(updated) if updated else None,
+    }
+
+
+def usage(db, prefix=None, limit=500):
+    """ Returns the pseudofolders below `prefix` at any depth, largest first.
+
+    Each row holds the path and the bytes and objects below it. """
+    sql = 'SELECT path, bytes, objects FROM folders WHERE path != ?'
+    args = [prefix or '']
+    if prefix:
+        sql += ' AND path >= ? AND path < ?'
+        args.extend((prefix, prefix + chr(0x10FFFF)))
+    sql += ' ORDER BY bytes DESC, path LIMIT ?'
+    args.append(limit)
+    return [dict(row) for row in db.execute(sql, args)]
+
+
+def folder_total(db, prefix=None):
+    """ Returns (bytes, objects) below a pseudofolder or the container. """
+    row = db.execute('SELECT bytes, objects FROM folders WHERE path = ?',
+                     (prefix or '', )).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def query(db, substring=None, pattern=None, prefix=None, min_size=None,
+          max_size=None, modified_after=None, modified_before=None,
+          limit=1000):
+    """ Returns the index rows that match all of the given filters.
+
+    `substring` matches anywhere in the name, case-insensitively. `pattern`
+    is a case-sensitive glob on the full name, e.g. '*.jpg'. Dates are ISO
+    8601 strings compared with Swift's last_modified. """
+    fts = _get_meta(db, 'fts') == '1'
+    joins = ''
+    where = []
+    args = []
+    if substring and fts and len(substring) >= 3:
+        joins = ' JOIN names ON names.rowid = objects.rowid'
+        where.append('names MATCH ?')
+        args.append('"%s"' % substring.replace('"', '""'))
+    elif substring:
+        where.append('instr(lower(objects.name), lower(?)) > 0')
+        args.append(substring)
+    if pattern:
+        where.append('objects.name GLOB ?')
+        args.append(pattern)
+    if prefix:
+        where.append('objects.name >= ? AND objects.name < ?')
+        args.extend((prefix, prefix + chr(0x10FFFF)))
+    for clause, value in (('objects.bytes >= ?', min_size),
+                          ('objects.bytes <= ?', max_size),
+                          ('objects.last_modified >= ?', modified_after),
+                          ('objects.last_modified < ?', modified_before)):
+        if value is not None and value != '':
+            where.append(clause)
+            args.append(value)
+
+    sql = ('SELECT objects.name, objects.bytes, objects.content_type, '
+           'objects.last_modified FROM objects' + joins)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY objects.name LIMIT ?'
+    args.append(limit)
+    return [dict(row) for row in db.execute(sql, args)]
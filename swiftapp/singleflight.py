@@ -0,0 +1,317 @@
+""" Coalescing of identical concurrent Swift reads ("single flight").
+
+When several requests make the same read at the same moment, e.g. a team
+opening one big container together, only the first of them (the leader)
+calls Swift; the others wait for that call and share its result, or its
+exception. Reads are identical when the operation, storage URL, token and
+arguments all match, so a result is only shared between requests using the
+same token and never crosses users; anonymous reads of public containers
+share theirs with every anonymous visitor. Nothing is kept once the call
+has returned, so coalescing never serves older data than a read started at
+the same time would have returned.
+
+Within a worker process waiters simply block on the leader's call
+(SWIFT_SINGLEFLIGHT). With SWIFT_SINGLEFLIGHT_SHARED, leaders also announce
+their call in the shared cache and publish its result there, so that
+workers in other processes wait up to SWIFT_SINGLEFLIGHT_WAIT seconds for
+it instead of repeating the call. Electing one leader takes an atomic
+cache.add, as Memcached and Redis have; with the file or local-memory
+cache the setting is ignored and every process coalesces on its own. A result that cannot be published, for
+example because it is too large for the cache backend, only makes them
+fall back to calling Swift themselves. Account reads are only coalesced
+within a process, since their headers carry the temp URL key.
+
+Writes end the flights of what they changed (see `forget`): a read that
+starts after a write never joins a call that started before it, and so
+always sees the write. Waiters that joined earlier still share the result
+of that call. """
+# -*- coding: utf-8 -*-
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+import weakref
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from swiftapp import metrics
+
+logger = logging.getLogger(__name__)
+
+# Poll interval of workers waiting for a call in another process
+POLL_INTERVAL = 0.02
+# Reads whose results must not be published in the shared cache
+LOCAL_ONLY = ('head_account', 'get_account')
+# Whether _atomic_cache has warned about the cache backend
+_warned = False
+
+
+class _Flight(object):
+    """ A call in progress and its outcome
+
+    `scope` is the (storage URL, container) the call reads; `forget`
+    marks the flights of a scope as broken, so no one joins them. """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.broken = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        # The call of an async flight
+        self.task = None
+
+
+_flights = {}
+# Flights of the async helpers, per event loop
+_aflights = weakref.WeakKeyDictionary()
+# Guards both; forget runs in any thread
+_lock = threading.Lock()
+
+
+def _enabled():
+    return getattr(settings, 'SWIFT_SINGLEFLIGHT', True)
+
+
+def _atomic_cache():
+    """ Returns whether cache.add is atomic across processes; warns once
+    if it is not although SWIFT_SINGLEFLIGHT_SHARED asks for it """
+    global _warned
+    if not isinstance(caches['default'], (FileBasedCache, LocMemCache)):
+        return True
+    if not _warned:
+        _warned = True
+        logger.warning('SWIFT_SINGLEFLIGHT_SHARED needs an atomic cache '
+                       'backend like Memcached or Redis; coalescing within '
+                       'each process only')
+    return False
+
+
+def _shared(operation=None):
+    return (getattr(settings, 'SWIFT_SINGLEFLIGHT_SHARED', False) and
+            operation not in LOCAL_ONLY and _atomic_cache())
+
+
+def _wait():
+    return getattr(settings, 'SWIFT_SINGLEFLIGHT_WAIT', 10)
+
+
+def get_key(operation, *parts):
+    """ Returns the key of a read; `parts` must include the token """
+    return sha1(repr((operation, ) + parts).encode('utf-8')).hexdigest()
+
+
+def _share(result):
+    """ Returns a copy of `result` a waiter may modify without affecting
+    the other requests: the headers and the listing are copied, the
+    listing entries themselves are shared """
+    if isinstance(result, tuple):
+        return tuple(_share(item) for item in result)
+    if isinstance(result, (dict, list)):
+        return type(result)(result)
+    return result
+
+
+def _error(error):
+    """ Returns a copy of the leader's exception for one waiter to raise.
+
+    Raising one instance in several threads or tasks at once would mix up
+    its __traceback__ and __context__. """
+    try:
+        return copy.copy(error)
+    except Exception:
+        return error
+
+
+def _generation_key(scope):
+    return 'swift-flight-gen:%s' % sha1(repr(scope).encode('utf-8')) \
+        .hexdigest()
+
+
+def _cache_keys(key, generation):
+    lock_key = 'swift-flight:%s:%s' % (key, generation)
+    return (lock_key, lambda flight_id: '%s:%s' % (lock_key, flight_id))
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def _break(storage_url, container):
+    with _lock:
+        for flights in [_flights] + list(_aflights.values()):
+            for flight in flights.values():
+                if flight.scope == (storage_url, container):
+                    flight.broken = True
+
+
+def forget(storage_url, container=None):
+    """ Ends the flights reading the account or container, after a write
+    to it; reads that start later make a call of their own. """
+    if not _enabled():
+        return
+    _break(storage_url, container)
+    if _shared():
+        _bump(_generation_key((storage_url, container)))
+
+
+async def aforget(storage_url, container=None):
+    """ Async variant of forget """
+    if not _enabled():
+        return
+    _break(storage_url, container)
+    if _shared():
+        key = _generation_key((storage_url, container))
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, 1, None)
+
+
+def _call_shared(operation, key, scope, func):
+    """ Runs `func` as the leader across worker processes, or waits for the
+    result of the leader in another process """
+    generation = cache.get(_generation_key(scope), 0)
+    lock_key, result_key = _cache_keys(key, generation)
+    flight_id = uuid.uuid4().hex
+    if cache.add(lock_key, flight_id, _wait()):
+        try:
+            result = func()
+            cache.set(result_key(flight_id), (result, ), _wait())
+        finally:
+            cache.delete(lock_key)
+        return result
+
+    leader = cache.get(lock_key)
+    deadline = time.monotonic() + _wait()
+    while leader is not None and time.monotonic() < deadline:
+        outcome = cache.get(result_key(leader))
+        if outcome is not None:
+            metrics.record_coalesced(operation, 'shared', waiters=1)
+            return outcome[0]
+        if cache.get(lock_key) != leader:
+            # The leader failed or gave up; its result was not published
+            break
+        time.sleep(POLL_INTERVAL)
+    return func()
+
+
+def do(operation, key, func, scope=None):
+    """ Returns func(), sharing one call among all concurrent callers with
+    the same `key` (see get_key). Exceptions are shared the same way.
+    `scope` is the (storage URL, container) the call reads, for forget. """
+    if not _enabled():
+        return func()
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None or flight.broken
+        if leader:
+            flight = _flights[key] = _Flight(scope)
+        else:
+            flight.waiters += 1
+
+    if not leader:
+        flight.done.wait()
+        metrics.record_coalesced(operation, 'local', waiters=1)
+        if flight.error is not None:
+            raise _error(flight.error)
+        return _share(flight.result)
+
+    try:
+        if _shared(operation):
+            flight.result = _call_shared(operation, key, scope, func)
+        else:
+            flight.result = func()
+        return flight.result
+    except BaseException as exc:
+        flight.error = exc
+        raise
+    finally:
+        with _lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+        flight.done.set()
+        if flight.waiters:
+            metrics.record_coalesced(operation, 'local', calls=1)
+
+
+async def _acall_shared(operation, key, scope, func):
+    """ Async variant of _call_shared """
+    generation = await cache.aget(_generation_key(scope), 0)
+    lock_key, result_key = _cache_keys(key, generation)
+    flight_id = uuid.uuid4().hex
+    if await cache.aadd(lock_key, flight_id, _wait()):
+        try:
+            result = await func()
+            await cache.aset(result_key(flight_id), (result, ), _wait())
+        finally:
+            await cache.adelete(lock_key)
+        return result
+
+    leader = await cache.aget(lock_key)
+    deadline = time.monotonic() + _wait()
+    while leader is not None and time.monotonic() < deadline:
+        outcome = await cache.aget(result_key(leader))
+        if outcome is not None:
+            metrics.record_coalesced(operation, 'shared', waiters=1)
+            return outcome[0]
+        if await cache.aget(lock_key) != leader:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+    return await func()
+
+
+async def ado(operation, key, func, scope=None):
+    """ Async variant of do; `func` returns an awaitable. Calls are only
+    coalesced within one event loop. """
+    if not _enabled():
+        return await func()
+    loop = asyncio.get_running_loop()
+    with _lock:
+        flights = _aflights.setdefault(loop, {})
+        flight = flights.get(key)
+        leader = flight is None or flight.broken
+        if leader:
+            flight = flights[key] = _Flight(scope)
+        else:
+            flight.waiters += 1
+
+    if not leader:
+        try:
+            result = await asyncio.shield(flight.task)
+        except BaseException as exc:
+            if flight.task.done() and not flight.task.cancelled() and \
+                    flight.task.exception() is exc:
+                raise _error(exc) from None
+            raise
+        metrics.record_coalesced(operation, 'local', waiters=1)
+        return _share(result)
+
+    # The call runs as a task of its own, so cancelling the request that
+    # started it does not cancel it for the waiters
+    flight.task = asyncio.ensure_future(
+        _acall_shared(operation, key, scope, func) if _shared(operation)
+        else func())
+
+    def finished(task):
+        with _lock:
+            if flights.get(key) is flight:
+                del flights[key]
+        if not task.cancelled():
+            # Retrieved here, in case no request is left to await it
+            task.exception()
+        if flight.waiters:
+            metrics.record_coalesced(operation, 'local', calls=1)
+
+    flight.task.add_done_callback(finished)
+    return await asyncio.shield(flight.task)
@@ -0,0 +1,114 @@
+""" Resumable uploads of large files as Static Large Objects (SLO).
+
+The browser splits a file into segments and PUTs each one with its own
+short-lived temp URL into `<container>_segments`. Segment names are derived
+from the object name, file size, modification time and segment size, so an
+interrupted upload of the same file maps onto the same segments and only
+the missing ones have to be sent again. Once all segments are in place the
+manifest is written from the segment listing. """
+# -*- coding: utf-8 -*-
+import json
+import math
+
+from swiftclient import client
+
+from django.conf import settings
+
+from swiftapp import swift
+from swiftapp.utils import TempURLSigner, get_capabilities, \
+    get_temp_url_digest, iter_listing
+
+MiB = 1024 * 1024
+
+
+class IncompleteUpload(Exception):
+    """ Raised when a manifest is requested before all segments exist """
+
+    def __init__(self, missing):
+        super().__init__('%d segments missing' % len(missing))
+        self.missing = missing
+
+
+def segments_container(container):
+    return '%s_segments' % container
+
+
+def get_plan(storage_url, container, name, size, mtime):
+    """ Returns how a file of `size` bytes is split into segments.
+
+    The segment size is SWIFT_SEGMENT_SIZE, raised if needed to stay within
+    the cluster's max_manifest_segments and rounded up to whole MiB. """
+    slo = get_capabilities(storage_url).get('slo', {})
+    max_segments = slo.get('max_manifest_segments', 1000)
+    segment_size = max(getattr(settings, 'SWIFT_SEGMENT_SIZE', 100 * MiB),
+                       slo.get('min_segment_size', 1),
+                       int(math.ceil(size / float(max_segments))))
+    segment_size = int(math.ceil(segment_size / float(MiB))) * MiB
+    count = int(math.ceil(size / float(segment_size)))
+    return {
+        'name': name,
+        'size': size,
+        'segment_size': segment_size,
+        'count': count,
+        'container': segments_container(container),
+        'prefix': '%s/slo/%s/%s/%s/' % (name, mtime, size, segment_size),
+    }
+
+
+def _expected_size(plan, index):
+    if index == plan['count'] - 1:
+        return plan['size'] - plan['segment_size'] * index
+    return plan['segment_size']
+
+
+def get_uploaded_segments(storage_url, auth_token, plan):
+    """ Returns {index: listing entry} of the complete segments in place """
+    segments = {}
+    try:
+        for obj in iter_listing(storage_url, auth_token, plan['container'],
+                                prefix=plan['prefix']):
+            try:
+                index = int(obj['name'][len(plan['prefix']):])
+            except ValueError:
+                continue
+            if 0 <= index < plan['count'] and \
+                    obj['bytes'] == _expected_size(plan, index):
+                segments[index] = obj
+    except client.ClientException as exc:
+        if exc.http_status != 404:
+            raise
+    return segments
+
+
+def segment_name(plan, index):
+    return '%s%08d' % (plan['prefix'], index)
+
+
+def sign_segment_urls(storage_url, key, plan, indexes):
+    """ Returns {index: PUT temp URL} for the given segment indexes """
+    expires = getattr(settings, 'SWIFT_SEGMENT_URL_EXPIRES', 900)
+    signer = TempURLSigner(storage_url, key, expires, method='PUT',
+                           digest=get_temp_url_digest(storage_url))
+    return dict(
+        (index, signer.sign(plan['container'], segment_name(plan, index)))
+        for index in indexes if 0 <= index < plan['count'])
+
+
+def write_manifest(storage_url, auth_token, container, plan,
+                   content_type=None):
+    """ Writes the SLO manifest once every segment has been uploaded.
+
+    Raises IncompleteUpload listing the missing indexes otherwise. """
+    segments = get_uploaded_segments(storage_url, auth_token, plan)
+    missing = [i for i in range(plan['count']) if i not in segments]
+    if missing:
+        raise IncompleteUpload(missing)
+
+    manifest = [{'path': '/%s/%s' % (plan['container'], segments[i]['name']),
+                 'etag': segments[i]['hash'],
+                 'size_bytes': segments[i]['bytes']}
+                for i in range(plan['count'])]
+    swift.put_object(storage_url, auth_token, container, plan['name'],
+                     json.dumps(manifest),
+                     content_type=content_type or None,
+                     query_string='multipart-manifest=put')
@@ -0,0 +1,384 @@
+""" Pooled access to the Swift API. """
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+from swiftclient import client
+from swiftclient.utils import get_body
+
+from django.conf import settings
+
+from swiftapp import listing, metrics, singleflight
+
+
+class ConnectionPool(object):
+    """ Keeps idle keep-alive HTTP connections to the Swift proxy.
+
+    Connections are keyed by (storage_url, auth_token) and checked out for
+    exclusive use, so a connection is never shared between two threads at
+    the same time. Idle connections are closed after `idle_timeout` seconds
+    and the oldest idle connection is dropped once `max_size` is reached. """
+
+    def __init__(self, max_size=32, idle_timeout=30, timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0, 'evicted': 0,
+                       'discarded': 0}
+
+    def acquire(self, storage_url, auth_token):
+        """ Returns an idle connection for the key or opens a new one. """
+        key = (storage_url, auth_token)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            conns = self._idle.get(key)
+            if conns:
+                http_conn, _released = conns.pop()
+                if not conns:
+                    del self._idle[key]
+                self._size -= 1
+                self._stats['reused'] += 1
+                return http_conn
+            self._stats['created'] += 1
+        return client.http_connection(storage_url, timeout=self.timeout)
+
+    def release(self, storage_url, auth_token, http_conn):
+        """ Puts a healthy connection back into the pool. """
+        key = (storage_url, auth_token)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            if self.max_size < 1:
+                self._close(http_conn)
+                self._stats['evicted'] += 1
+                return
+            while self._size >= self.max_size:
+                self._evict_oldest()
+            self._idle.setdefault(key, []).append(
+                (http_conn, time.monotonic()))
+            self._size += 1
+
+    def discard(self, http_conn):
+        """ Closes a connection that must not be reused. """
+        self._close(http_conn)
+        with self._lock:
+            self._stats['discarded'] += 1
+
+    def connection(self, storage_url, auth_token):
+        """ Checks out a connection for the duration of a with-block. """
+        return _PooledConnection(self, storage_url, auth_token)
+
+    def clear(self):
+        """ Closes all idle connections. """
+        with self._lock:
+            for conns in self._idle.values():
+                for http_conn, _released in conns:
+                    self._close(http_conn)
+            self._idle = {}
+            self._size = 0
+
+    def stats(self):
+        """ Returns counters on reused vs. newly created connections. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = self._size
+        return stats
+
+    def _evict_expired(self, now):
+        deadline = now - self.idle_timeout
+        for key in list(self._idle):
+            conns = self._idle[key]
+            fresh = [c for c in conns if c[1] >= deadline]
+            for http_conn, _released in conns[:len(conns) - len(fresh)]:
+                self._close(http_conn)
+                self._stats['evicted'] += 1
+            self._size -= len(conns) - len(fresh)
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _evict_oldest(self):
+        key = min(self._idle, key=lambda k: self._idle[k][0][1])
+        http_conn, _released = self._idle[key].pop(0)
+        if not self._idle[key]:
+            del self._idle[key]
+        self._size -= 1
+        self._close(http_conn)
+        self._stats['evicted'] += 1
+
+    @staticmethod
+    def _close(http_conn):
+        try:
+            http_conn[1].close()
+        except Exception:
+            pass
+
+
+class _PooledConnection(object):
+    """ Context manager that returns the connection to the pool on exit.
+
+    HTTP error responses (ClientException) leave the connection usable;
+    any other error may leave it half-read, so it is closed instead. """
+
+    def __init__(self, pool, storage_url, auth_token):
+        self.pool = pool
+        self.storage_url = storage_url
+        self.auth_token = auth_token
+        self.http_conn = None
+
+    def __enter__(self):
+        self.http_conn = self.pool.acquire(self.storage_url, self.auth_token)
+        return self.http_conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or issubclass(exc_type, client.ClientException):
+            self.pool.release(self.storage_url, self.auth_token,
+                              self.http_conn)
+        else:
+            self.pool.discard(self.http_conn)
+        return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Returns the connection pool of this worker process. """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    max_size=getattr(settings, 'SWIFT_POOL_MAX_SIZE', 32),
+                    idle_timeout=getattr(
+                        settings, 'SWIFT_POOL_IDLE_TIMEOUT', 30),
+                    timeout=getattr(settings, 'SWIFT_TIMEOUT', None))
+    return _pool
+
+
+def _size(result):
+    headers = result[0] if isinstance(result, tuple) else None
+    try:
+        return int(headers.get('content-length', 0))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _call(func, storage_url, auth_token, *args, **kwargs):
+    operation = func.__name__.lstrip('_')
+    container = args[0] if args and isinstance(args[0], str) else None
+    start = time.perf_counter()
+    try:
+        with get_pool().connection(storage_url, auth_token) as http_conn:
+            result = func(storage_url, auth_token, *args,
+                          http_conn=http_conn, **kwargs)
+    except Exception as e:
+        metrics.record(operation, container, metrics.status_of(e),
+                       time.perf_counter() - start)
+        raise
+    metrics.record(operation, container, '2xx', time.perf_counter() - start,
+                   _size(result))
+    return result
+
+
+def _read(func, storage_url, auth_token, *args, **kwargs):
+    """ Like _call, but identical concurrent reads with the same token
+    share a single call (see swiftapp.singleflight). """
+    operation = func.__name__.lstrip('_')
+    key = singleflight.get_key(operation, storage_url, auth_token, args,
+                               sorted(kwargs.items()))
+    return singleflight.do(
+        operation, key,
+        lambda: _call(func, storage_url, auth_token, *args, **kwargs),
+        scope=(storage_url, args[0] if args else None))
+
+
+def get_account(storage_url, auth_token, **kwargs):
+    return _read(client.get_account, storage_url, auth_token, **kwargs)
+
+
+def head_account(storage_url, auth_token, **kwargs):
+    return _read(client.head_account, storage_url, auth_token, **kwargs)
+
+
+def post_account(storage_url, auth_token, headers, **kwargs):
+    return _call(client.post_account, storage_url, auth_token, headers,
+                 **kwargs)
+
+
+def _get_container(url, token, container, http_conn, marker=None,
+                   limit=None, prefix=None, delimiter=None, end_marker=None,
+                   query_string=None, headers=None):
+    parsed, conn = http_conn
+    query = [('format', 'json')]
+    for key, value in (('marker', marker), ('limit', limit),
+                       ('prefix', prefix), ('delimiter', delimiter),
+                       ('end_marker', end_marker)):
+        if value:
+            query.append((key, quote(str(value))))
+    qs = '&'.join('%s=%s' % pair for pair in query)
+    if query_string:
+        qs += '&' + query_string.lstrip('?')
+    req_headers = {'X-Auth-Token': token, 'Accept-Encoding': 'gzip'}
+    if headers:
+        req_headers.update(headers)
+    conn.request('GET', '%s/%s?%s' % (parsed.path, quote(container), qs), '',
+                 req_headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status < 200 or resp.status >= 300:
+        raise client.ClientException.from_response(
+            resp, 'Container GET failed', body)
+    resp_headers = client.resp_header_dict(resp)
+    if resp.status == 204:
+        return (resp_headers, [])
+    return (resp_headers, listing.parse(get_body(resp_headers, body)))
+
+
+def get_container(storage_url, auth_token, container, **kwargs):
+    """ Returns (headers, entries) for one page of a container listing.
+
+    Like client.get_container, but the body is decoded straight into
+    compact swiftapp.listing.Entry objects instead of dicts. """
+    return _read(_get_container, storage_url, auth_token, container,
+                 **kwargs)
+
+
+def head_container(storage_url, auth_token, container, **kwargs):
+    return _read(client.head_container, storage_url, auth_token, container,
+                 **kwargs)
+
+
+def put_container(storage_url, auth_token, container, **kwargs):
+    return _call(client.put_container, storage_url, auth_token, container,
+                 **kwargs)
+
+
+def post_container(storage_url, auth_token, container, headers, **kwargs):
+    return _call(client.post_container, storage_url, auth_token, container,
+                 headers, **kwargs)
+
+
+def delete_container(storage_url, auth_token, container, **kwargs):
+    return _call(client.delete_container, storage_url, auth_token,
+                 container, **kwargs)
+
+
+def put_object(storage_url, auth_token, container, name, contents,
+               **kwargs):
+    return _call(client.put_object, storage_url, auth_token, container,
+                 name, contents, **kwargs)
+
+
+def get_object(storage_url, auth_token, container, name, **kwargs):
+    return _call(client.get_object, storage_url, auth_token, container,
+                 name, **kwargs)
+
+
+def head_object(storage_url, auth_token, container, name, **kwargs):
+    return _call(client.head_object, storage_url, auth_token, container,
+                 name, **kwargs)
+
+
+def iter_object(storage_url, auth_token, container, name, chunk_size=65536):
+    """ Yields the body of an object in chunks.
+
+    The pooled connection stays checked out until the body has been read;
+    if the generator is closed early the half-read connection is dropped. """
+    start = time.perf_counter()
+    status = '2xx'
+    size = 0
+    try:
+        with get_pool().connection(storage_url, auth_token) as http_conn:
+            _headers, body = client.get_object(
+                storage_url, auth_token, container, name,
+                http_conn=http_conn, resp_chunk_size=chunk_size)
+            for chunk in body:
+                size += len(chunk)
+                yield chunk
+    except BaseException as e:
+        status = metrics.status_of(e)
+        raise
+    finally:
+        metrics.record('get_object', container, status,
+                       time.perf_counter() - start, size)
+
+
+def delete_object(storage_url, auth_token, container, name, **kwargs):
+    return _call(client.delete_object, storage_url, auth_token, container,
+                 name, **kwargs)
+
+
+def get_capabilities(storage_url):
+    """ Returns the cluster capabilities advertised by the proxy's /info """
+    parsed = urlparse(storage_url)
+    info_url = '%s://%s/info' % (parsed.scheme, parsed.netloc)
+    start = time.perf_counter()
+    try:
+        with get_pool().connection(info_url, '') as http_conn:
+            capabilities = client.get_capabilities(http_conn)
+    except Exception as e:
+        metrics.record('get_capabilities', None, metrics.status_of(e),
+                       time.perf_counter() - start)
+        raise
+    metrics.record('get_capabilities', None, '2xx',
+                   time.perf_counter() - start)
+    return capabilities
+
+
+def _bulk_delete(url, token, container, names, http_conn):
+    parsed, conn = http_conn
+    body = '\n'.join('/%s/%s' % (quote(container), quote(name))
+                     for name in names)
+    headers = {'X-Auth-Token': token,
+               'Content-Type': 'text/plain',
+               'Accept': 'application/json'}
+    conn.request('POST', '%s?bulk-delete' % parsed.path,
+                 body.encode('utf-8'), headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status < 200 or resp.status >= 300:
+        raise client.ClientException.from_response(
+            resp, 'Bulk delete failed', body)
+    return json.loads(body)
+
+
+def bulk_delete(storage_url, auth_token, container, names):
+    """ Deletes many objects with one request to the bulk middleware.
+
+    Returns the parsed JSON report, which holds 'Number Deleted',
+    'Number Not Found', 'Response Status' and a list of 'Errors'. """
+    return _call(_bulk_delete, storage_url, auth_token, container, names)
+
+
+def _extract_archive(url, token, container, prefix, contents, archive_format,
+                     http_conn):
+    parsed, conn = http_conn
+    path = '%s/%s' % (parsed.path, quote(container))
+    if prefix:
+        path += '/' + quote(prefix.strip('/'))
+    headers = {'X-Auth-Token': token, 'Accept': 'application/json'}
+    conn.putrequest('%s?extract-archive=%s' % (path, archive_format),
+                    data=contents, headers=headers)
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status < 200 or resp.status >= 300:
+        raise client.ClientException.from_response(
+            resp, 'Archive extraction failed', body)
+    return json.loads(body)
+
+
+def extract_archive(storage_url, auth_token, container, prefix, contents,
+                    archive_format):
+    """ Uploads a tar archive that the bulk middleware expands into objects.
+
+    Returns the parsed JSON report, which holds 'Number Files Created',
+    'Response Status' and a list of 'Errors' per failed file. """
+    return _call(_extract_archive, storage_url, auth_token, container,
+                 prefix, contents, archive_format)
@@ -1,3 +1,341 @@
-from django.test import TestCase
+""" Behavior tests against the stand-in Swift server of the benchmarks """
+# -*- coding: utf-8 -*-
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from swiftclient import client
+
+from asgiref.sync import async_to_sync
+from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from benchmarks import fakeswift
+from swiftapp import archive, async_views, deletion, jobs, listing_cache, \
+    metadata, metrics, singleflight, swift, utils, views
+
+ACCOUNT = 'AUTH_bench0'
+
+
+class FakeSwiftTestCase(TestCase):
+    """ Runs every test against a fresh stand-in cluster with one account
+    of two containers, c0000 and c0001, of 50 objects in folders of 10 """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = fakeswift.serve(fakeswift.FakeSwift())
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        tmp = tempfile.mkdtemp(prefix='swiftapp-tests-')
+        cls.addClassCleanup(shutil.rmtree, tmp, True)
+        cls.base_url = 'http://127.0.0.1:%d/v1/' % cls.server.server_port
+        cls.enterClassContext(override_settings(
+            CACHES={
+                'default': {'BACKEND':
+                            'django.core.cache.backends.locmem.LocMemCache'},
+                'sessions': {'BACKEND':
+                             'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'sessions'}},
+            STORAGE_URL=cls.base_url,
+            SWIFT_JOBS_DB='%s/jobs.sqlite3' % tmp,
+            SWIFT_SEARCH_INDEX_DIR='%s/index' % tmp))
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.fake = fakeswift.FakeSwift(containers=2, objects=50,
+                                        folder_size=10)
+        self.server.swift = self.fake
+        self.storage_url = self.base_url + ACCOUNT
+        self.token = self.fake.issue_token(ACCOUNT)[0]
+
+    def names(self, container, prefix=None):
+        _meta, objects = client.get_container(
+            self.storage_url, self.token, container, prefix=prefix,
+            full_listing=True)
+        return [obj['name'] for obj in objects]
+
+    def login(self):
+        session = self.client.session
+        session.update({'storage_url': self.storage_url,
+                        'auth_token': self.token, 'username': 'tester'})
+        session.save()
+
+    def calls(self, operation):
+        return metrics.totals().get(operation, (0, 0))[0]
+
+
+class ResumeTest(FakeSwiftTestCase):
+
+    def test_resumed_deletion_retries_failures(self):
+        report = deletion.DeleteReport.from_dict({
+            'deleted': 5, 'failed': 1,
+            'failures': [['d00001/o000000011', 503]],
+            'marker': 'd00001/o000000015'})
+        report = deletion.delete_folder(self.storage_url, self.token,
+                                        'c0000', 'd00001/', report=report)
+
+        self.assertEqual(report.failures, [])
+        self.assertEqual(report.deleted, 5 + 1 + 4)
+        # Only names the earlier run got past without a failure are left
+        self.assertEqual(self.names('c0000', 'd00001/'), [
+            'd00001/o000000010', 'd00001/o000000012', 'd00001/o000000013',
+            'd00001/o000000014', 'd00001/o000000015'])
+
+    def test_truncated_failures_restart_from_the_start(self):
+        report = deletion.DeleteReport.from_dict({
+            'deleted': 0, 'failed': 150,
+            'failures': [['d00001/o000000011', 503]] * 100,
+            'marker': 'd00001/o000000015'})
+        self.assertEqual((report.retry, report.marker), ([], None))
+
+        deletion.delete_folder(self.storage_url, self.token, 'c0000',
+                               'd00001/', report=report)
+        self.assertEqual(self.names('c0000', 'd00001/'), [])
+
+
+class RecoveryTest(FakeSwiftTestCase):
+
+    def add_job(self, runner, heartbeat):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        db = jobs.connect()
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO runners (id, heartbeat) '
+                           'VALUES (?, ?)', (runner, heartbeat))
+                db.execute(
+                    'INSERT INTO jobs (id, owner, kind, description, params, '
+                    'storage_url, auth_token, status, progress, created, '
+                    'updated, runner) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, 'owner', 'delete_folder', 'Delete d00002/',
+                     json.dumps({'container': 'c0000', 'prefix': 'd00002/'}),
+                     self.storage_url, self.token, jobs.RUNNING,
+                     json.dumps({'marker': 'd00002/o000000024'}), now, now,
+                     runner))
+        finally:
+            db.close()
+        return job_id
+
+    def status(self, job_id, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            db = jobs.connect()
+            try:
+                row = db.execute('SELECT status FROM jobs WHERE id = ?',
+                                 (job_id, )).fetchone()
+            finally:
+                db.close()
+            if row['status'] in jobs.FINISHED or \
+                    time.monotonic() > deadline:
+                return row['status']
+            time.sleep(0.05)
+
+    def test_jobs_of_a_stopped_runner_are_resumed(self):
+        job_id = self.add_job('stopped', time.time() - 60)
+        runner = jobs.Runner(1, 0.1, 1)
+        runner.beat()
+        runner.recover()
+
+        self.assertEqual(self.status(job_id), jobs.DONE)
+        # Continued from the saved marker instead of starting over
+        self.assertEqual(self.names('c0000', 'd00002/'), [
+            'd00002/o0000000%d' % i for i in range(20, 25)])
+
+    def test_jobs_of_a_live_runner_are_left_alone(self):
+        job_id = self.add_job('alive', time.time())
+        runner = jobs.Runner(1, 0.1, 1)
+        runner.beat()
+        runner.recover()
+
+        self.assertEqual(self.status(job_id, timeout=0.2), jobs.RUNNING)
+        self.assertEqual(len(self.names('c0000', 'd00002/')), 10)
+
+
+class CacheInvalidationTest(FakeSwiftTestCase):
+
+    def test_listing_revalidates_writes_made_elsewhere(self):
+        def listing():
+            _meta, objects, _page = listing_cache.get_listing_page_cached(
+                self.storage_url, self.token, 'c0000', prefix='d00000/')
+            return [obj['name'] for obj in objects]
+
+        listing()
+        self.assertEqual(len(listing()), 10)
+        self.assertEqual(self.calls('get_container'), 1)
+
+        # Another client, so neither the cache nor singleflight hear of it
+        client.put_object(self.storage_url, self.token, 'c0000',
+                          'd00000/new', b'')
+        self.assertIn('d00000/new', listing())
+        self.assertEqual(self.calls('get_container'), 2)
+
+    def test_api_etag_follows_writes_made_elsewhere(self):
+        self.login()
+        url = '/api/objects/c0000/d00000/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        client.put_object(self.storage_url, self.token, 'c0000',
+                          'd00000/new', b'')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'd00000/new')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_toggle_public_drops_public_pages(self):
+        client.post_container(self.storage_url, self.token, 'c0000',
+                              {'X-Container-Read': '.r:*,.rlistings'})
+        self.login()
+        public_url = '/public/%s/c0000/' % ACCOUNT
+
+        response = self.client.get(public_url)
+        self.assertContains(response, 'd00000/')
+
+        self.client.get('/toggle_public/c0000/')
+        response = self.client.get(public_url)
+        self.assertEqual(response.status_code, 302)
+
+
+class ObjectviewTest(FakeSwiftTestCase):
+
+    def request(self, **query):
+        self.login()
+        request = RequestFactory().get('/objects/c0000/', query)
+        request.session = self.client.session
+        request._messages = default_storage(request)
+        return request
+
+    def render(self, view, prefix=None, **query):
+        response = view(self.request(**query), 'c0000', prefix)
+        if not response.streaming:
+            return response.content
+        if response.is_async:
+            async def consume():
+                return [part async for part in response]
+            return b''.join(async_to_sync(consume)())
+        return b''.join(response)
+
+    def test_async_view_matches_the_sync_view(self):
+        async_view = async_to_sync(async_views.objectview)
+        # A rendered and a streamed page
+        for query in ({'limit': '20'}, {'limit': '2000', 'marker': 'd00001/'}):
+            self.assertEqual(self.render(async_view, **query),
+                             self.render(views.objectview, **query))
+
+    @override_settings(SWIFT_STREAM_THRESHOLD=2, SWIFT_STREAM_PAGE_SIZE=2)
+    def test_streamed_page_stops_at_its_limit(self):
+        async_view = async_to_sync(async_views.objectview)
+        for view in (views.objectview, async_view):
+            html = self.render(view, 'd00001/', limit='5')
+            self.assertEqual(html.count(b'/download/c0000/d00001/o'), 5)
+            self.assertIn(b'marker=d00001%2Fo000000014', html)
+
+
+class ArchiveTest(FakeSwiftTestCase):
+
+    def test_archive_holds_the_folder(self):
+        data = b''.join(archive.stream_archive(
+            self.storage_url, self.token, 'c0000', 'd00001/', 'tar'))
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.getnames(),
+                             ['o0000000%d' % i for i in range(10, 20)])
+
+    def test_failed_archive_is_cut_short(self):
+        chunks = archive.stream_archive(self.storage_url, self.token,
+                                        'c0000', None, 'tar')
+        next(chunks)
+        self.fake.tokens.clear()
+        with self.assertLogs('swiftapp.archive', 'ERROR') as logs, \
+                self.assertRaises(client.ClientException):
+            list(chunks)
+        self.assertIn('Archive of c0000/ aborted', logs.output[0])
+
+
+class TempKeyTest(FakeSwiftTestCase):
+
+    def test_key_is_only_served_to_tokens_that_read_it(self):
+        utils.invalidate_temp_key(self.storage_url)
+        key = utils.get_temp_key(self.storage_url, self.token)
+        self.assertEqual(key, fakeswift.TEMP_URL_KEY)
+
+        self.assertIsNone(utils.get_temp_key(self.storage_url, 'other'))
+        self.assertEqual(utils.get_temp_key(self.storage_url, self.token),
+                         key)
+
+    def test_key_stays_out_of_the_shared_cache(self):
+        metadata.head_account(self.storage_url, self.token)
+        utils.get_temp_key(self.storage_url, self.token)
+
+        self.assertNotIn('x-account-meta-temp-url-key',
+                         metadata.head_account(self.storage_url, self.token))
+
+
+class SingleflightTest(FakeSwiftTestCase):
+
+    def test_concurrent_reads_share_one_call(self):
+        self.fake.latency = 0.2
+        barrier = threading.Barrier(8)
+
+        def read(_i):
+            barrier.wait()
+            return swift.get_container(self.storage_url, self.token,
+                                       'c0000', limit=5)
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(read, range(8)))
+
+        self.assertEqual(self.calls('get_container'), 1)
+        self.assertTrue(all(result == results[0] for result in results))
+        # Everyone gets a copy of the listing to modify
+        self.assertEqual(len({id(result[1]) for result in results}), 8)
+
+    def test_waiters_raise_their_own_exception(self):
+        self.fake.latency = 0.2
+        barrier = threading.Barrier(4)
+
+        def read(_i):
+            barrier.wait()
+            try:
+                swift.get_container(self.storage_url, self.token, 'missing')
+            except client.ClientException as exc:
+                return exc
+
+        with ThreadPoolExecutor(4) as executor:
+            errors = list(executor.map(read, range(4)))
+
+        self.assertEqual([exc.http_status for exc in errors], [404] * 4)
+        self.assertEqual(len({id(exc) for exc in errors}), 4)
+
+    def test_writes_break_pending_flights(self):
+        key = singleflight.get_key('get_container', self.storage_url,
+                                   self.token, 'c0000')
+        scope = (self.storage_url, 'c0000')
+        started = threading.Event()
+        release = threading.Event()
+
+        def stale():
+            started.set()
+            release.wait(10)
+            return 'stale'
+
+        with ThreadPoolExecutor(1) as executor:
+            pending = executor.submit(singleflight.do, 'get_container', key,
+                                      stale, scope)
+            started.wait(10)
+            singleflight.forget(self.storage_url, 'c0000')
+            fresh = singleflight.do('get_container', key, lambda: 'fresh',
+                                    scope)
+            release.set()
+
+        self.assertEqual(fresh, 'fresh')
+        self.assertEqual(pending.result(), 'stale')
@@ -1,15 +1,32 @@
 """ Standalone webinterface for Openstack Swift. """
 # -*- coding: utf-8 -*-
+import base64
+import logging
 import time
 import hmac
 import string
 import random
-from hashlib import sha1
-from urllib.parse import urlparse
+import threading
+from hashlib import sha1, sha256, sha512
+from urllib.parse import quote, urlparse
 
+from asgiref.sync import sync_to_async
 from swiftclient import client
 
 from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.html import format_html
+from django.utils.http import parse_etags
+from django.utils.translation import gettext as _
+
+from swiftapp import aswift, metadata, swift
+from swiftapp.listing import DIRECTORY_TYPES
+
+logger = logging.getLogger(__name__)
 
 
 def get_base_url(request):
@@ -48,69 +65,542 @@ def prefix_list(prefix):
     return prefixes
 
 
-def pseudofolder_object_list(objects, prefix):
+def pseudofolder_object_list(objects, prefix, seen=None):
+    """ Splits a listing into pseudofolders and objects.
+
+    Returns (pseudofolders, objects) where each pseudofolder is a tuple of
+    (path with a single trailing slash, name as listed). Folders in `seen`
+    are skipped and new ones are added to it, so a listing fetched in
+    several batches lists every folder once. The entries are not
+    modified. """
     pseudofolders = []
     objs = []
-
-    duplist = []
+    if seen is None:
+        seen = set()
 
     for obj in objects:
+        subdir = obj.get('subdir')
         # Rackspace Cloudfiles uses application/directory
         # Cyberduck uses application/x-directory
-        if obj.get('content_type', None) in ('application/directory',
-                                             'application/x-directory'):
-            obj['subdir'] = obj['name']
+        if subdir is None and obj.get('content_type') in DIRECTORY_TYPES:
+            subdir = obj.get('name')
 
-        if 'subdir' in obj:
+        if subdir is not None:
             # make sure that there is a single slash at the end
             # Cyberduck appends a slash to the name of a pseudofolder
-            entry = obj['subdir'].strip('/') + '/'
-            if entry != prefix and entry not in duplist:
-                duplist.append(entry)
-                pseudofolders.append((entry, obj['subdir']))
+            entry = subdir.strip('/') + '/'
+            if entry != prefix and entry not in seen:
+                seen.add(entry)
+                pseudofolders.append((entry, subdir))
         else:
             objs.append(obj)
 
     return (pseudofolders, objs)
 
 
-def get_temp_key(storage_url, auth_token):
-    """Gets or generates temp URL key with better error handling"""
+def patch_public_cache(request, response, etag, fresh_until):
+    """ Lets browsers and shared caches, like a CDN in front of the app,
+    keep an anonymous listing page until `fresh_until`, then serve it stale
+    for SWIFT_PUBLIC_CACHE_STALE seconds while revalidating it by ETag.
+
+    There is no stale-if-error: the page is only public as long as the
+    container ACL says so, and a cache must not keep serving it while the
+    app is unreachable after the container was made private. """
+    if len(messages.get_messages(request)):
+        # The page shows messages meant for this visitor alone
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    stale = getattr(settings, 'SWIFT_PUBLIC_CACHE_STALE', 300)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True,
+                        max_age=max(0, int(fresh_until - time.time())),
+                        stale_while_revalidate=stale)
+    return response
+
+
+def public_not_modified(request, etag, fresh_until):
+    """ Returns a 304 response if the client has the page with `etag`,
+    otherwise None """
+    if etag not in parse_etags(request.headers.get('If-None-Match', '')):
+        return None
+    return patch_public_cache(request, HttpResponseNotModified(), etag,
+                              fresh_until)
+
+
+def is_public(meta):
+    """ True if the container read ACL allows anonymous listings """
+    read_acl = meta.get('x-container-read', '').split(',')
+    required_acl = ['.r:*', '.rlistings']
+    return bool([x for x in read_acl if x in required_acl])
+
+
+def origin_missing(meta, origin):
+    """ True if allow_origin would add `origin` to the container """
+    allowed = meta.get('x-container-meta-access-control-allow-origin', '')
+    allowed = allowed.split()
+    return getattr(settings, 'SWIFT_UPLOAD_SET_CORS', True) and \
+        origin not in allowed and '*' not in allowed
+
+
+def allow_origin(storage_url, auth_token, container, meta, origin):
+    """ Adds `origin` to the container's CORS metadata if it is missing.
+
+    Browser uploads straight to Swift are cross-origin XHRs, which the
+    proxy only allows for origins listed on the container. Does nothing
+    if SWIFT_UPLOAD_SET_CORS is off; failures are ignored since the
+    cluster may allow the origin globally. Only call it from POST requests
+    of an upload that is about to start. """
+    if not origin_missing(meta, origin):
+        return
+    allowed = meta.get('x-container-meta-access-control-allow-origin', '')
+    allowed = allowed.split()
+    headers = {'X-Container-Meta-Access-Control-Allow-Origin':
+               ' '.join(allowed + [origin])}
+    try:
+        metadata.post_container(storage_url, auth_token, container, headers)
+    except client.ClientException:
+        pass
+
+
+def archive_format(filename):
+    """ Returns the extract-archive format for a file name, or None """
+    filename = filename.lower()
+    for suffixes, archive_format in ((('.tar',), 'tar'),
+                                     (('.tar.gz', '.tgz'), 'tar.gz'),
+                                     (('.tar.bz2', '.tbz2'), 'tar.bz2')):
+        if filename.endswith(suffixes):
+            return archive_format
+    return None
+
+
+def get_page_size(request, maximum=None):
+    """ Returns the listing page size requested by the client.
+
+    Falls back to SWIFT_PAGE_SIZE and is capped by `maximum`, which
+    defaults to SWIFT_MAX_PAGE_SIZE. """
+    default = getattr(settings, 'SWIFT_PAGE_SIZE', 500)
+    if maximum is None:
+        maximum = getattr(settings, 'SWIFT_MAX_PAGE_SIZE', 10000)
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def get_object_page_size(request):
+    """ Returns (limit, streaming) of an objectview page.
+
+    Pages larger than SWIFT_STREAM_THRESHOLD rows are streamed, except
+    when paging backwards, which needs a reversed listing. """
+    limit = get_page_size(
+        request, maximum=getattr(settings, 'SWIFT_STREAM_MAX_ROWS', 1000000))
+    streaming = (limit > getattr(settings, 'SWIFT_STREAM_THRESHOLD', 1000) and
+                 not request.GET.get('end_marker'))
+    return (limit, streaming)
+
+
+def offered_page_sizes(page_sizes):
+    """ Returns `page_sizes` followed by the streamed page sizes """
+    return tuple(page_sizes) + tuple(
+        getattr(settings, 'SWIFT_STREAM_PAGE_SIZES', (10000, 100000)))
+
+
+class ObjectRowStream(object):
+    """ Renders a streamed objectview page of up to `limit` rows.
+
+    The listing is fetched SWIFT_STREAM_PAGE_SIZE entries at a time and
+    each batch is rendered into table rows as it arrives, so memory stays
+    bounded by one listing page and the browser paints the page head
+    before the listing is complete. The caller fetches: while `more`, it
+    lists `next_limit()` entries after `cursor` and passes them to `rows`,
+    then sends `end()`. This is how the sync and the async objectview
+    share it. """
+
+    def __init__(self, request, context, marker, limit):
+        self.request = request
+        self.container = context['container']
+        self.prefix = context['prefix']
+        self.marker = marker
+        self.limit = limit
+        self.page_size = getattr(settings, 'SWIFT_STREAM_PAGE_SIZE', 1000)
+        # Rendered up front, so messages are consumed before the response
+        html = render_to_string('objectview.html',
+                                dict(context, streaming=True), request)
+        self.head, rest = html.split('<!-- rows -->', 1)
+        self.middle, self.tail = rest.split('<!-- pagination -->', 1)
+        self.cursor = marker
+        self.remaining = limit
+        self.first = None
+        self.has_next = False
+        self.done = False
+        self.seen = set()
+
+    @property
+    def more(self):
+        return not self.done and self.remaining > 0
+
+    def next_limit(self):
+        # One extra entry on the last request tells if there is more
+        if self.remaining <= self.page_size:
+            return self.remaining + 1
+        return self.page_size
+
+    def _render_rows(self, **rows):
+        return render_to_string('objectview_rows.html',
+                                dict(rows, container=self.container),
+                                self.request)
+
+    def rows(self, entries, request_limit):
+        """ Returns the rows of one batch of `request_limit` entries """
+        self.has_next = len(entries) > self.remaining
+        entries = entries[:self.remaining]
+        if not entries:
+            self.done = True
+            return ''
+        if self.first is None:
+            self.first = _entry_name(entries[0])
+        self.cursor = _entry_name(entries[-1])
+        self.remaining -= len(entries)
+        if self.has_next or len(entries) < request_limit:
+            self.done = True
+        folders, objs = pseudofolder_object_list(entries, self.prefix,
+                                                 self.seen)
+        return self._render_rows(folders=folders, objects=objs)
+
+    def failed(self, exc):
+        """ Returns the row that ends a listing Swift refused """
+        self.done = True
+        return format_html(
+            '<tr><td colspan="5" class="text-error">{}</td></tr>',
+            _("Listing failed: %s") % exc.http_status)
+
+    def end(self):
+        """ Returns the rest of the page after the last row """
+        empty = self._render_rows(empty=True) if self.first is None else ''
+        pagination = render_to_string('pagination.html', {'page': {
+            'limit': self.limit,
+            'page_sizes': offered_page_sizes(
+                getattr(settings, 'SWIFT_PAGE_SIZES', (100, 500, 1000))),
+            'marker': self.marker or '',
+            'end_marker': '',
+            'next_marker': self.cursor if self.has_next else None,
+            'prev_marker': self.first if self.marker else None,
+        }}, self.request)
+        return empty + self.middle + pagination + self.tail
+
+
+def _entry_name(entry):
+    return entry.get('subdir', entry.get('name'))
+
+
+def _listing_query(prefix, marker, end_marker, limit):
+    if end_marker and not marker:
+        return {'delimiter': '/', 'prefix': prefix, 'marker': end_marker,
+                'limit': limit + 1, 'query_string': 'reverse=on'}
+    return {'delimiter': '/', 'prefix': prefix, 'marker': marker,
+            'limit': limit + 1}
+
+
+def _listing_page(objects, marker, end_marker, limit):
+    if end_marker and not marker:
+        has_prev = len(objects) > limit
+        objects = objects[:limit][::-1]
+        has_next = True
+    else:
+        has_next = len(objects) > limit
+        objects = objects[:limit]
+        has_prev = bool(marker)
+
+    page = {
+        'limit': limit,
+        'page_sizes': getattr(settings, 'SWIFT_PAGE_SIZES',
+                              (100, 500, 1000)),
+        'marker': marker or '',
+        'end_marker': end_marker or '',
+        'next_marker': None,
+        'prev_marker': None,
+    }
+    if objects:
+        if has_next:
+            page['next_marker'] = _entry_name(objects[-1])
+        if has_prev:
+            page['prev_marker'] = _entry_name(objects[0])
+    return (objects, page)
+
+
+def get_listing_page(storage_url, auth_token, container, prefix=None,
+                     marker=None, end_marker=None, limit=500):
+    """ Returns one page of a pseudofolder listing.
+
+    Pages forward from `marker` or, if only `end_marker` is given, backward
+    from it using a reversed listing. One extra entry is requested to find
+    out whether there is a further page, so every page costs a single
+    bounded GET regardless of the container size. Returns a tuple of
+    (meta, objects, page) where page holds the cursors for the pager. """
+    meta, objects = swift.get_container(
+        storage_url, auth_token, container,
+        **_listing_query(prefix, marker, end_marker, limit))
+    objects, page = _listing_page(objects, marker, end_marker, limit)
+    return (meta, objects, page)
+
+
+async def aget_listing_page(storage_url, auth_token, container, prefix=None,
+                            marker=None, end_marker=None, limit=500):
+    """ Async variant of get_listing_page. """
+    meta, objects = await aswift.get_container(
+        storage_url, auth_token, container,
+        **_listing_query(prefix, marker, end_marker, limit))
+    objects, page = _listing_page(objects, marker, end_marker, limit)
+    return (meta, objects, page)
+
+
+def iter_listing(storage_url, auth_token, container, prefix=None,
+                 marker=None, page_size=None):
+    """ Yields every object of a container, one listing page at a time.
+
+    Only a single page is held in memory, so this is safe to use on
+    containers of any size. """
+    while True:
+        _meta, objects = swift.get_container(
+            storage_url, auth_token, container, prefix=prefix,
+            marker=marker, limit=page_size)
+        if not objects:
+            return
+        for obj in objects:
+            yield obj
+        marker = objects[-1]['name']
+
+
+def truncate_on_error(chunks, log, describe):
+    """ Yields the body `chunks` of a streamed response, logging an error
+    with the message `describe()` to `log` before passing it on.
+
+    The status and headers have been sent by the time the error happens,
+    so the only way to signal it is to cut the body short: the exception
+    ends the response early and the client is left with a truncated
+    download. """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        log.exception(describe())
+        raise
+
+
+def get_capabilities(storage_url):
+    """ Returns the cached cluster capabilities, {} if /info is disabled """
+    netloc = urlparse(storage_url).netloc
+    cache_key = 'swift-capabilities:%s' % sha1(
+        netloc.encode('utf-8')).hexdigest()
+    capabilities = cache.get(cache_key)
+    if capabilities is None:
+        try:
+            capabilities = swift.get_capabilities(storage_url)
+        except client.ClientException:
+            capabilities = {}
+        timeout = getattr(settings, 'SWIFT_CAPABILITIES_CACHE_TIMEOUT', 3600)
+        cache.set(cache_key, capabilities, timeout)
+    return capabilities
+
+
+# Temp URL keys by (storage URL, token digest), as (key, expires). Only
+# account owners may read the key, so it is cached per token, and kept in
+# process memory since it is a secret.
+_temp_keys = {}
+_temp_keys_lock = threading.Lock()
+
+
+def _temp_key_id(storage_url, auth_token):
+    if isinstance(auth_token, str):
+        auth_token = auth_token.encode('utf-8')
+    return (storage_url, sha1(auth_token or b'').hexdigest())
+
+
+def _cached_temp_key(storage_url, auth_token):
+    entry = _temp_keys.get(_temp_key_id(storage_url, auth_token))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def _cache_temp_key(storage_url, auth_token, key):
+    now = time.monotonic()
+    timeout = getattr(settings, 'SWIFT_TEMP_KEY_CACHE_TIMEOUT', 300)
+    with _temp_keys_lock:
+        for expired in [entry_id for entry_id, entry in _temp_keys.items()
+                        if entry[1] <= now]:
+            del _temp_keys[expired]
+        _temp_keys[_temp_key_id(storage_url, auth_token)] = (key,
+                                                             now + timeout)
+
+
+def invalidate_temp_key(storage_url):
+    """ Drops the cached temp URL keys of an account, e.g. after a
+    signature was rejected """
+    with _temp_keys_lock:
+        for entry_id in [entry_id for entry_id in _temp_keys
+                         if entry_id[0] == storage_url]:
+            del _temp_keys[entry_id]
+
+
+def _generate_temp_key():
+    chars = string.ascii_lowercase + string.digits
+    return ''.join(random.choice(chars) for x in range(32))
+
+
+async def ainvalidate_temp_key(storage_url):
+    """ Async variant of invalidate_temp_key. """
+    invalidate_temp_key(storage_url)
+
+
+def get_temp_key(storage_url, auth_token, refresh=False):
+    """Gets or generates temp URL key with better error handling
+
+    The key is cached in process memory per storage URL and token for
+    SWIFT_TEMP_KEY_CACHE_TIMEOUT seconds, so the account is only HEADed
+    when the cached key is missing or expired."""
+    if not refresh:
+        key = _cached_temp_key(storage_url, auth_token)
+        if key:
+            return key
+
     try:
-        account = client.get_account(storage_url, auth_token)
+        # The shared metadata cache leaves the key out
+        account = metadata.head_account(storage_url, auth_token,
+                                        refresh=refresh, cached=False)
     except client.ClientException as e:
-        print(f"Error getting account: {str(e)}")
+        logger.warning('Could not read the temp URL key: %s', e)
         return None
 
-    key = account[0].get('x-account-meta-temp-url-key')
+    key = account.get('x-account-meta-temp-url-key')
 
     if not key:
         try:
             # Generate random key
-            chars = string.ascii_lowercase + string.digits
-            key = ''.join(random.choice(chars) for x in range(32))
+            key = _generate_temp_key()
             # Set the key on the account
             headers = {'x-account-meta-temp-url-key': key}
-            client.post_account(storage_url, auth_token, headers)
+            metadata.post_account(storage_url, auth_token, headers)
         except client.ClientException as e:
-            print(f"Error setting temp URL key: {str(e)}")
+            logger.warning('Could not set the temp URL key: %s', e)
             return None
-            
+
+    _cache_temp_key(storage_url, auth_token, key)
     return key
 
 
+async def aget_temp_key(storage_url, auth_token, refresh=False):
+    """ Async variant of get_temp_key. """
+    if not refresh:
+        key = _cached_temp_key(storage_url, auth_token)
+        if key:
+            return key
+
+    try:
+        account = await metadata.ahead_account(
+            storage_url, auth_token, refresh=refresh, cached=False)
+    except client.ClientException as e:
+        logger.warning('Could not read the temp URL key: %s', e)
+        return None
+
+    key = account.get('x-account-meta-temp-url-key')
+
+    if not key:
+        try:
+            key = _generate_temp_key()
+            headers = {'x-account-meta-temp-url-key': key}
+            await metadata.apost_account(storage_url, auth_token, headers)
+        except client.ClientException as e:
+            logger.warning('Could not set the temp URL key: %s', e)
+            return None
+
+    _cache_temp_key(storage_url, auth_token, key)
+    return key
+
+
+TEMP_URL_DIGESTS = {'sha1': sha1, 'sha256': sha256, 'sha512': sha512}
+
+
+class TempURLSigner(object):
+    """ Signs temp URLs for any number of objects of one account.
+
+    The HMAC is keyed once and fed the part of the message that all URLs
+    share; every signature continues from a copy of that state, so only
+    the container and object name are hashed per URL. All URLs expire at
+    the same time. SHA-512 signatures are sent as `sha512:<base64>`, as
+    the tempurl middleware expects; the others as hex. """
+
+    def __init__(self, storage_url, key, expires=600, method='GET',
+                 digest='sha1'):
+        url_parts = urlparse(storage_url)
+        self.base = "%s://%s" % (url_parts.scheme, url_parts.netloc)
+        self.path = url_parts.path
+        self.expires = int(time.time()) + expires
+        self.digest = digest
+        self._hmac = hmac.new(bytes(key, "utf-8"),
+                              digestmod=TEMP_URL_DIGESTS[digest])
+        self._hmac.update(bytes('%s\n%s\n%s/' % (method, self.expires,
+                                                  self.path), "utf-8"))
+
+    def signature(self, container, objectname):
+        mac = self._hmac.copy()
+        mac.update(bytes('%s/%s' % (container, objectname), "utf-8"))
+        if self.digest == 'sha512':
+            return 'sha512:' + base64.urlsafe_b64encode(
+                mac.digest()).decode('ascii').rstrip('=')
+        return mac.hexdigest()
+
+    def sign(self, container, objectname):
+        """ Returns the temp URL of one object """
+        path = "%s/%s/%s" % (self.path, container, objectname)
+        return '%s%s?temp_url_sig=%s&temp_url_expires=%s' % (
+            self.base, quote(path),
+            quote(self.signature(container, objectname), safe=':'),
+            self.expires)
+
+
+def get_temp_url_digest(storage_url):
+    """ Returns the digest to sign temp URLs with.
+
+    That is SWIFT_TEMP_URL_DIGEST if the cluster lists it in the
+    `allowed_digests` of its /info, and sha1 otherwise, which every
+    version of the tempurl middleware accepts. """
+    digest = getattr(settings, 'SWIFT_TEMP_URL_DIGEST', 'sha256')
+    allowed = get_capabilities(storage_url).get('tempurl', {}).get(
+        'allowed_digests', ())
+    return digest if digest in allowed else 'sha1'
+
+
+def sign_temp_url(storage_url, key, container, objectname, expires=600,
+                  method='GET', digest='sha1'):
+    """ Returns a temp URL for an object, valid for `expires` seconds """
+    signer = TempURLSigner(storage_url, key, expires, method, digest)
+    return signer.sign(container, objectname)
+
+
+def sign_form_post(key, path, redirect, max_file_size, max_file_count,
+                   expires):
+    """ Returns the FormPost signature for the given form parameters """
+    hmac_body = '%s\n%s\n%s\n%s\n%s' % (
+        path, redirect, max_file_size, max_file_count, expires)
+    return hmac.new(
+        bytes(key, "utf-8"), bytes(hmac_body, "utf-8"), sha1).hexdigest()
+
+
 def get_temp_url(storage_url, auth_token, container, objectname, expires=600):
     key = get_temp_key(storage_url, auth_token)
     if not key:
         return None
+    return sign_temp_url(storage_url, key, container, objectname, expires,
+                         digest=get_temp_url_digest(storage_url))
 
-    expires += int(time.time())
-    url_parts = urlparse(storage_url)
-    path = "%s/%s/%s" % (url_parts.path, container, objectname)
-    base = "%s://%s" % (url_parts.scheme, url_parts.netloc)
-    hmac_body = 'GET\n%s\n%s' % (expires, path)
-    sig = hmac.new(
-        bytes(key, "utf-8"), bytes(hmac_body, "utf-8"), sha1).hexdigest()
-    url = '%s%s?temp_url_sig=%s&temp_url_expires=%s' % (
-        base, path, sig, expires)
-    return url
+
+async def aget_temp_url(storage_url, auth_token, container, objectname,
+                        expires=600):
+    key = await aget_temp_key(storage_url, auth_token)
+    if not key:
+        return None
+    digest = await sync_to_async(get_temp_url_digest)(storage_url)
+    return sign_temp_url(storage_url, key, container, objectname, expires,
+                         digest=digest)
@@ -2,22 +2,33 @@
 # -*- coding: utf-8 -*-
 import os
 import time
-import hmac
-from hashlib import sha1
 from urllib.parse import urlparse
 
 from swiftclient import client
 
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.translation import gettext as _
 from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_POST
 
+from swiftapp import api, archive, auth, copying, jobs, links, \
+    listing_cache, metadata, metrics, search_index, slo, swift
 from swiftapp.forms import CreateContainerForm, PseudoFolderForm, \
-    LoginForm, AddACLForm
+    LoginForm, AddACLForm, UploadArchiveForm, SearchForm, TempURLsForm, \
+    CopyForm
 from swiftapp.utils import replace_hyphens, prefix_list, \
-    pseudofolder_object_list, get_temp_key, get_base_url, get_temp_url
+    pseudofolder_object_list, get_temp_key, get_base_url, get_temp_url, \
+    invalidate_temp_key, get_page_size, is_public, \
+    sign_form_post, allow_origin, origin_missing, archive_format, get_capabilities, \
+    get_temp_url_digest, patch_public_cache, public_not_modified, \
+    get_object_page_size, offered_page_sizes, ObjectRowStream
 
 import swiftapp
 
@@ -29,24 +40,7 @@ def login(request):
         username = form.cleaned_data['username']
         password = form.cleaned_data['password']
         try:
-            auth_version = getattr(settings, 'SWIFT_AUTH_VERSION', '3')
-            os_options = {
-                'user_domain_name': settings.SWIFT_USER_DOMAIN_NAME,
-                'project_domain_name': settings.SWIFT_PROJECT_DOMAIN_NAME,
-                'project_name': settings.SWIFT_PROJECT_NAME,
-            }
-            
-            storage_url, auth_token = client.get_auth(
-                settings.SWIFT_AUTH_URL,
-                username,
-                password,
-                auth_version=auth_version,
-                os_options=os_options
-            )
-            
-            request.session['auth_token'] = auth_token
-            request.session['storage_url'] = storage_url
-            request.session['username'] = username
+            auth.login(request.session, username, password)
             return redirect('containerview')
             
         except client.ClientException as e:
@@ -62,7 +56,8 @@ def containerview(request):
     auth_token = request.session.get('auth_token', '')
 
     try:
-        account_stat, containers = client.get_account(storage_url, auth_token)
+        account_stat, containers = listing_cache.get_account(storage_url,
+                                                             auth_token)
         account_stat = replace_hyphens(account_stat)
 
         return render(request, 'containerview.html', {
@@ -96,7 +91,8 @@ def create_container(request):
     if form.is_valid():
         container = form.cleaned_data['containername']
         try:
-            client.put_container(storage_url, auth_token, container)
+            swift.put_container(storage_url, auth_token, container)
+            listing_cache.invalidate(storage_url)
             messages.add_message(request, messages.INFO,
                                  _("Container created."))
         except client.ClientException:
@@ -108,22 +104,22 @@ def create_container(request):
 
 
 def delete_container(request, container):
-    """ Deletes a container """
+    """ Deletes a container and all of its objects in a background job """
 
     storage_url = request.session.get('storage_url', '')
     auth_token = request.session.get('auth_token', '')
 
     try:
-        _m, objects = client.get_container(storage_url, auth_token, container)
-        for obj in objects:
-            client.delete_object(storage_url, auth_token,
-                                 container, obj['name'])
-        client.delete_container(storage_url, auth_token, container)
-        messages.add_message(request, messages.INFO, _("Container deleted."))
+        metadata.head_container(storage_url, auth_token, container)
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
 
-    return redirect(containerview)
+    job_id = jobs.submit('delete_container', jobs.owner_of(request.session),
+                         storage_url, auth_token,
+                         _("Delete container %s") % container,
+                         container=container)
+    return redirect(job, job_id=job_id)
 
 
 def objectview(request, container, prefix=None):
@@ -132,39 +128,168 @@ def objectview(request, container, prefix=None):
     storage_url = request.session.get('storage_url', '')
     auth_token = request.session.get('auth_token', '')
 
+    # FormPost redirects back here with the upload result
+    status = request.GET.get('status', '')
+    if status:
+        listing_cache.invalidate(storage_url, container)
+
+    marker = request.GET.get('marker')
+    end_marker = request.GET.get('end_marker')
+    limit, streaming = get_object_page_size(request)
+
     try:
-        meta, objects = client.get_container(storage_url, auth_token,
-                                             container, delimiter='/',
-                                             prefix=prefix)
+        if streaming:
+            meta = metadata.head_container(storage_url, auth_token, container)
+        else:
+            meta, objects, page = listing_cache.get_listing_page_cached(
+                storage_url, auth_token, container, prefix=prefix,
+                marker=marker, end_marker=end_marker,
+                limit=min(limit, getattr(settings, 'SWIFT_MAX_PAGE_SIZE',
+                                         10000)))
 
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
         return redirect(containerview)
 
-    prefixes = prefix_list(prefix)
-    pseudofolders, objs = pseudofolder_object_list(objects, prefix)
-    base_url = get_base_url(request)
-    account = storage_url.split('/')[-1]
+    if status and not status.startswith('2'):
+        if status == '401':
+            # Signature rejected, the account key has probably changed
+            invalidate_temp_key(storage_url)
+        messages.add_message(request, messages.ERROR, _("Upload failed: %s")
+                             % request.GET.get('message', status))
 
-    read_acl = meta.get('x-container-read', '').split(',')
-    public = False
-    required_acl = ['.r:*', '.rlistings']
-    if [x for x in read_acl if x in required_acl]:
-        public = True
-
-    return render(request, "objectview.html", {
+    context = {
         'container': container,
-        'objects': objs,
-        'folders': pseudofolders,
         'session': request.session,
         'prefix': prefix,
-        'prefixes': prefixes,
-        'base_url': base_url,
-        'account': account,
-        'public': public})
+        'prefixes': prefix_list(prefix),
+        'base_url': get_base_url(request),
+        'account': storage_url.split('/')[-1],
+        'public': is_public(meta)}
+
+    if streaming:
+        return _stream_objectview(request, storage_url, auth_token, context,
+                                  marker, limit)
+
+    pseudofolders, objs = pseudofolder_object_list(objects, prefix)
+    context.update({
+        'objects': objs,
+        'folders': pseudofolders,
+        'page': dict(page,
+                     page_sizes=offered_page_sizes(page['page_sizes']))})
+    return render(request, "objectview.html", context)
+
+
+def _stream_objectview(request, storage_url, auth_token, context, marker,
+                       limit):
+    """ Streams an objectview page of up to `limit` rows, see
+    utils.ObjectRowStream """
+    listing = ObjectRowStream(request, context, marker, limit)
+
+    def stream():
+        yield listing.head
+        while listing.more:
+            request_limit = listing.next_limit()
+            try:
+                _meta, entries = swift.get_container(
+                    storage_url, auth_token, listing.container,
+                    prefix=listing.prefix, delimiter='/',
+                    marker=listing.cursor, limit=request_limit)
+            except client.ClientException as e:
+                yield listing.failed(e)
+                break
+            yield listing.rows(entries, request_limit)
+        yield listing.end()
+
+    response = StreamingHttpResponse(stream())
+    # Ask proxies like nginx to pass rows on as they are rendered
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def api_containers(request):
+    """ Returns one page of the container listing as JSON. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+    marker = request.GET.get('marker') or None
+    limit = get_page_size(request)
+    encoding = api.get_encoding(request)
+
+    try:
+        # Not from the shared cache, which may predate writes made elsewhere
+        meta = metadata.head_account(storage_url, auth_token, cached=False)
+        etag = api.get_etag(encoding, storage_url, marker, limit, [
+            meta.get(header) for header in listing_cache.ACCOUNT_VALIDATORS])
+        response = api.not_modified(request, etag)
+        if response:
+            return response
+        _meta, containers = swift.get_account(
+            storage_url, auth_token, marker=marker, limit=limit + 1)
+    except client.ClientException:
+        return JsonResponse({'error': _("Access denied.")}, status=403)
+
+    next_marker = containers[limit - 1]['name'] \
+        if len(containers) > limit else None
+    return api.response({
+        'marker': marker or '',
+        'next_marker': next_marker,
+        'columns': api.CONTAINER_COLUMNS,
+        'containers': api.container_rows(containers[:limit]),
+    }, etag, encoding)
+
+
+def api_objects(request, container, prefix=None):
+    """ Returns one page of a pseudofolder listing as JSON.
+
+    Folders are sent as [path, name] pairs, where path has a single
+    trailing slash, and objects as rows of OBJECT_COLUMNS. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    marker = request.GET.get('marker') or None
+    limit = get_page_size(request)
+    encoding = api.get_encoding(request)
+
+    try:
+        # The same uncached HEAD get_listing_page_cached revalidates with
+        meta = metadata.head_container(storage_url, auth_token, container,
+                                       cached=False)
+        etag = api.get_etag(
+            encoding, storage_url, container, prefix, marker, limit,
+            [meta.get(header)
+             for header in listing_cache.CONTAINER_VALIDATORS])
+        response = api.not_modified(request, etag)
+        if response:
+            return response
+        _meta, objects, page = listing_cache.get_listing_page_cached(
+            storage_url, auth_token, container, prefix=prefix,
+            marker=marker, limit=limit)
+    except client.ClientException:
+        return JsonResponse({'error': _("Access denied.")}, status=403)
+
+    pseudofolders, objs = pseudofolder_object_list(objects, prefix)
+    return api.response({
+        'container': container,
+        'prefix': prefix or '',
+        'marker': marker or '',
+        'next_marker': page['next_marker'],
+        'columns': api.OBJECT_COLUMNS,
+        'folders': [list(folder) for folder in pseudofolders],
+        'objects': api.object_rows(objs),
+    }, etag, encoding)
 
 
 def upload(request, container, prefix=None):
+    """ Renders a form that uploads files directly from the browser to Swift
+
+    A single FormPost signature is valid for any number of requests until
+    it expires, so the browser uploads all selected files (or a whole
+    folder, keeping relative paths below `prefix`) in parallel, one file
+    per request, without Django in the data path. The form is signed
+    without a redirect; the page returns to objectview once all uploads
+    have finished. If the container does not allow this site's origin
+    yet, the page asks upload_origin to add it before the first upload. """
     storage_url = request.session.get('storage_url', '')
     auth_token = request.session.get('auth_token', '')
     
@@ -174,14 +299,17 @@ def upload(request, container, prefix=None):
 
     try:
         # Verify container exists and user has access
-        client.head_container(storage_url, auth_token, container)
+        meta = metadata.head_container(storage_url, auth_token, container)
     except client.ClientException:
         messages.error(request, _("Access denied or container not found"))
         return redirect('containerview')
 
-    # Build redirect URL
-    redirect_url = get_base_url(request)
-    redirect_url += reverse('objectview', kwargs={'container': container})
+    origin_url = ''
+    if origin_missing(meta, get_base_url(request)):
+        origin_url = reverse('upload_origin', kwargs={'container': container})
+
+    # Page to return to after the upload
+    redirect_url = reverse('objectview', kwargs={'container': container})
     if prefix:
         redirect_url += prefix
 
@@ -192,18 +320,18 @@ def upload(request, container, prefix=None):
 
     # Generate temporary URL parameters
     max_file_size = 5 * 1024 * 1024 * 1024  # 5GB
-    max_file_count = 1
-    expires = int(time.time() + 15 * 60)  # 15 minutes
+    max_file_count = getattr(settings, 'SWIFT_UPLOAD_MAX_FILE_COUNT', 1000)
+    expires = int(time.time() + getattr(settings, 'SWIFT_UPLOAD_EXPIRES',
+                                        3600))
     
     key = get_temp_key(storage_url, auth_token)
     if not key:
         messages.error(request, _("Could not generate upload URL"))
         return redirect('objectview', container=container)
 
-    # Generate HMAC signature
     path = urlparse(swift_url).path
-    hmac_body = f'{path}\n{redirect_url}\n{max_file_size}\n{max_file_count}\n{expires}'
-    signature = hmac.new(key.encode('utf-8'), hmac_body.encode('utf-8'), sha1).hexdigest()
+    signature = sign_form_post(key, path, '', max_file_size, max_file_count,
+                               expires)
 
     return render(request, 'upload_form.html', {
         'swift_url': swift_url,
@@ -212,12 +340,208 @@ def upload(request, container, prefix=None):
         'max_file_count': max_file_count,
         'expires': expires,
         'signature': signature,
+        'concurrency': getattr(settings, 'SWIFT_UPLOAD_CONCURRENCY', 4),
+        'origin_url': origin_url,
         'container': container,
         'prefix': prefix,
         'prefixes': prefix_list(prefix)
     })
 
 
+@require_POST
+def upload_origin(request, container):
+    """ Allows this site's origin on a container right before browser
+    uploads to it start, see utils.allow_origin """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    try:
+        meta = metadata.head_container(storage_url, auth_token, container)
+    except client.ClientException:
+        return JsonResponse({'error': _("Access denied.")}, status=403)
+    allow_origin(storage_url, auth_token, container, meta,
+                 get_base_url(request))
+    return JsonResponse({})
+
+
+def large_upload(request, container, prefix=None):
+    """ Renders the resumable upload page for files larger than 5 GB """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+    except client.ClientException:
+        messages.error(request, _("Access denied or container not found"))
+        return redirect('containerview')
+
+    return render(request, 'large_upload.html', {
+        'container': container,
+        'prefix': prefix or '',
+        'prefixes': prefix_list(prefix),
+        'concurrency': getattr(settings, 'SWIFT_UPLOAD_CONCURRENCY', 4),
+        'session': request.session})
+
+
+def _large_upload_plan(request, storage_url, container):
+    name = request.POST.get('name', '').lstrip('/')
+    try:
+        size = int(request.POST.get('size', ''))
+        mtime = int(request.POST.get('mtime', '0'))
+    except ValueError:
+        return None
+    if not name or size <= 0:
+        return None
+    return slo.get_plan(storage_url, container, name, size, mtime)
+
+
+def _prepare_segments(request, storage_url, auth_token, container):
+    """ Creates the segments container of `container` if it is missing and
+    allows this site's origin on it """
+    segments = slo.segments_container(container)
+    try:
+        meta = metadata.head_container(storage_url, auth_token, segments)
+    except client.ClientException as exc:
+        if exc.http_status != 404:
+            raise
+        swift.put_container(storage_url, auth_token, segments)
+        listing_cache.invalidate(storage_url)
+        meta = {}
+    allow_origin(storage_url, auth_token, segments, meta,
+                 get_base_url(request))
+
+
+@require_POST
+def large_upload_segments(request, container):
+    """ Returns the segment plan of a large upload as JSON.
+
+    Lists the segments that are already in place, so an interrupted upload
+    resumes where it stopped, and signs short-lived PUT URLs for the
+    segment indexes given in `indexes`. The first request of an upload,
+    without indexes, also prepares the segments container. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    plan = _large_upload_plan(request, storage_url, container)
+    if not plan:
+        return JsonResponse({'error': _("Invalid upload.")}, status=400)
+
+    try:
+        indexes = [int(i) for i in request.POST.get('indexes', '').split(',')
+                   if i]
+    except ValueError:
+        return JsonResponse({'error': _("Invalid upload.")}, status=400)
+
+    response = dict(plan)
+    try:
+        if indexes:
+            key = get_temp_key(storage_url, auth_token)
+            if not key:
+                raise client.ClientException('No temp URL key')
+            response['urls'] = slo.sign_segment_urls(
+                storage_url, key, plan, indexes)
+        else:
+            _prepare_segments(request, storage_url, auth_token, container)
+            response['done'] = sorted(slo.get_uploaded_segments(
+                storage_url, auth_token, plan))
+    except client.ClientException:
+        return JsonResponse({'error': _("Access denied.")}, status=403)
+
+    return JsonResponse(response)
+
+
+@require_POST
+def large_upload_complete(request, container):
+    """ Writes the SLO manifest of a finished large upload """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    plan = _large_upload_plan(request, storage_url, container)
+    if not plan:
+        return JsonResponse({'error': _("Invalid upload.")}, status=400)
+
+    try:
+        slo.write_manifest(storage_url, auth_token, container, plan,
+                           content_type=request.POST.get('content_type'))
+    except slo.IncompleteUpload as exc:
+        return JsonResponse({'error': str(exc), 'missing': exc.missing},
+                            status=409)
+    except client.ClientException:
+        return JsonResponse({'error': _("Access denied.")}, status=403)
+
+    listing_cache.invalidate(storage_url, container)
+    return JsonResponse({'name': plan['name'], 'size': plan['size']})
+
+
+def upload_archive(request, container, prefix=None):
+    """ Uploads a tar archive and lets Swift expand it below `prefix`
+
+    The bulk middleware's extract-archive creates all files of the archive
+    as objects in a single request. Files that could not be created are
+    listed in the message shown by objectview. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    form = UploadArchiveForm(request.POST or None, request.FILES or None)
+    if form.is_valid():
+        uploaded = form.cleaned_data['archive']
+        fmt = archive_format(uploaded.name)
+        if not fmt:
+            messages.add_message(request, messages.ERROR,
+                                 _("Please upload a .tar, .tar.gz or "
+                                   ".tar.bz2 archive."))
+        elif 'bulk_upload' not in get_capabilities(storage_url):
+            messages.add_message(request, messages.ERROR,
+                                 _("Archive extraction is not enabled on "
+                                   "this cluster."))
+        else:
+            try:
+                result = swift.extract_archive(storage_url, auth_token,
+                                               container, prefix, uploaded,
+                                               fmt)
+            except client.ClientException:
+                messages.add_message(request, messages.ERROR,
+                                     _("Access denied."))
+            else:
+                listing_cache.invalidate(storage_url, container)
+                _extract_archive_messages(request, result)
+            if prefix:
+                return redirect(objectview, container=container,
+                                prefix=prefix)
+            return redirect(objectview, container=container)
+
+    return render(request, 'upload_archive.html', {
+        'container': container,
+        'prefix': prefix,
+        'prefixes': prefix_list(prefix),
+        'session': request.session})
+
+
+def _extract_archive_messages(request, result):
+    created = result.get('Number Files Created', 0)
+    errors = result.get('Errors') or []
+    status = result.get('Response Status', '')
+    if created:
+        messages.add_message(
+            request, messages.INFO,
+            _("%(count)d objects extracted.") % {'count': created})
+    if errors:
+        shown = errors[:20]
+        msg = format_html(
+            '{}<ul>{}</ul>',
+            _("%(count)d files could not be extracted:")
+            % {'count': len(errors)},
+            format_html_join('', '<li>{} ({})</li>', shown))
+        if len(errors) > len(shown):
+            msg += format_html('<p>{}</p>', _("and %(count)d more.") % {
+                'count': len(errors) - len(shown)})
+        messages.add_message(request, messages.ERROR, msg)
+    elif not status.startswith('2'):
+        messages.add_message(request, messages.ERROR, format_html(
+            '{} {}', _("Archive extraction failed:"),
+            result.get('Response Body') or status))
+
+
 def download(request, container, objectname):
     """ Download an object from Swift """
 
@@ -232,20 +556,85 @@ def download(request, container, objectname):
     return redirect(url)
 
 
+def download_archive(request, container, prefix=None):
+    """ Streams a ZIP or TAR archive of a container or pseudofolder """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    archive_format = request.GET.get('format', 'zip')
+    if archive_format not in archive.CONTENT_TYPES:
+        archive_format = 'zip'
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
+
+    name = prefix.strip('/').split('/')[-1] if prefix else container
+    response = StreamingHttpResponse(
+        archive.stream_archive(storage_url, auth_token, container, prefix,
+                               archive_format),
+        content_type=archive.CONTENT_TYPES[archive_format])
+    response['Content-Disposition'] = content_disposition_header(
+        True, '%s.%s' % (name, archive_format))
+    return response
+
+
+def temp_urls(request, container, prefix=None):
+    """ Exports temp URLs for every object below a pseudofolder as CSV or
+    JSON, signed in one pass over the listing """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    form = TempURLsForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'temp_urls.html', {
+            'container': container,
+            'prefix': prefix,
+            'prefixes': prefix_list(prefix),
+            'form': form,
+            'session': request.session})
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
+    key = get_temp_key(storage_url, auth_token)
+    if not key:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(objectview, container=container)
+
+    export_format = form.cleaned_data['format']
+    name = prefix.strip('/').split('/')[-1] if prefix else container
+    response = StreamingHttpResponse(
+        links.stream_links(storage_url, auth_token, container, prefix, key,
+                           form.cleaned_data['expires'], export_format,
+                           digest=get_temp_url_digest(storage_url)),
+        content_type=links.CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = content_disposition_header(
+        True, '%s-links.%s' % (name, export_format))
+    return response
+
+
 def delete_object(request, container, objectname):
     """ Deletes an object """
     storage_url = request.session.get('storage_url', '')
     auth_token = request.session.get('auth_token', '')
+
+    if objectname.endswith('/'):
+        # A pseudofolder; deleting just its marker would leave the objects
+        return redirect(delete_folder, container=container, prefix=objectname)
     
     try:
-        client.delete_object(storage_url, auth_token, container, objectname)
+        swift.delete_object(storage_url, auth_token, container, objectname)
+        listing_cache.invalidate(storage_url, container)
         messages.add_message(request, messages.INFO, _("Object deleted."))
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
         
     # Calculate prefix for redirection
-    if objectname.endswith('/'):  # deleting a pseudofolder
-        objectname = objectname[:-1]
     prefix = '/'.join(objectname.split('/')[:-1])
     
     # Redirect with or without prefix
@@ -254,6 +643,164 @@ def delete_object(request, container, objectname):
     return redirect('objectview', container=container)
 
 
+def delete_folder(request, container, prefix):
+    """ Deletes a pseudofolder and every object below it.
+
+    GET asks for confirmation; the POST starts a background job. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+    prefix = prefix.strip('/') + '/'
+    parent = '/'.join(prefix.split('/')[:-2])
+
+    if request.method != 'POST':
+        return render(request, 'delete_folder.html', {
+            'container': container,
+            'prefix': prefix,
+            'prefixes': prefix_list(prefix),
+            'parent': parent + '/' if parent else '',
+            'session': request.session})
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
+
+    job_id = jobs.submit('delete_folder', jobs.owner_of(request.session),
+                         storage_url, auth_token,
+                         _("Delete folder %s/%s") % (container, prefix),
+                         container=container, prefix=prefix)
+    return redirect(job, job_id=job_id)
+
+
+def copy_object(request, container, objectname):
+    """ Copies, moves or renames an object or a pseudofolder, possibly into
+    another container, without the data passing through Django.
+
+    A single object is copied right away; a pseudofolder is copied by a
+    background job. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+    folder = objectname.endswith('/')
+    if folder:
+        objectname = objectname.strip('/') + '/'
+    parent = '/'.join(objectname.rstrip('/').split('/')[:-1])
+    parent = parent + '/' if parent else ''
+
+    form = CopyForm(request.POST or None, initial={
+        'container': container, 'name': objectname})
+    if form.is_valid():
+        dst_container = form.cleaned_data['container']
+        dst_name = form.cleaned_data['name']
+        move = form.cleaned_data['move']
+        if folder:
+            dst_name = dst_name.strip('/') + '/'
+        if dst_name == '/':
+            form.add_error('name', _("Please enter a name."))
+        elif dst_container == container and (
+                dst_name == objectname or
+                folder and dst_name.startswith(objectname)):
+            form.add_error('name', _("A folder or object cannot be copied "
+                                     "onto or into itself."))
+
+    if request.method != 'POST' or not form.is_valid():
+        return render(request, 'copy.html', {
+            'container': container,
+            'objectname': objectname,
+            'folder': folder,
+            'prefixes': prefix_list(parent),
+            'parent': parent,
+            'form': form,
+            'session': request.session})
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+        metadata.head_container(storage_url, auth_token, dst_container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(objectview, container=container)
+
+    if folder:
+        if move:
+            description = _("Move %(source)s to %(destination)s")
+        else:
+            description = _("Copy %(source)s to %(destination)s")
+        job_id = jobs.submit(
+            'copy_folder', jobs.owner_of(request.session), storage_url,
+            auth_token, description % {
+                'source': '%s/%s' % (container, objectname),
+                'destination': '%s/%s' % (dst_container, dst_name)},
+            container=container, prefix=objectname,
+            dst_container=dst_container, dst_prefix=dst_name, move=move)
+        return redirect(job, job_id=job_id)
+
+    status = copying.copy_object(storage_url, auth_token, container,
+                                 objectname, dst_container, dst_name, move)
+    listing_cache.invalidate(storage_url, dst_container)
+    if move:
+        listing_cache.invalidate(storage_url, container)
+    if status is None:
+        messages.add_message(request, messages.INFO,
+                             _("Object moved.") if move
+                             else _("Object copied."))
+    else:
+        messages.add_message(request, messages.ERROR,
+                             _("The object could not be copied."))
+        dst_container = container
+        dst_name = objectname
+
+    prefix = '/'.join(dst_name.split('/')[:-1])
+    if prefix:
+        return redirect(objectview, container=dst_container,
+                        prefix=prefix + '/')
+    return redirect(objectview, container=dst_container)
+
+
+def job_list(request):
+    """ Lists the recent background jobs of the user """
+    return render(request, 'jobs.html', {
+        'jobs': jobs.list_jobs(jobs.owner_of(request.session)),
+        'session': request.session})
+
+
+def job(request, job_id):
+    """ Shows the progress of a background job """
+    info = jobs.get(job_id, jobs.owner_of(request.session))
+    if info is None:
+        messages.add_message(request, messages.ERROR, _("Job not found."))
+        return redirect(job_list)
+    return render(request, 'job.html', {
+        'job': info,
+        'session': request.session})
+
+
+def job_status(request, job_id):
+    """ Returns the state and progress of a background job as JSON """
+    info = jobs.get(job_id, jobs.owner_of(request.session))
+    if info is None:
+        return JsonResponse({'error': _("Job not found.")}, status=404)
+    return JsonResponse(info)
+
+
+@require_POST
+def job_cancel(request, job_id):
+    """ Stops a background job after its current batch """
+    if not jobs.cancel(job_id, jobs.owner_of(request.session)):
+        messages.add_message(request, messages.ERROR,
+                             _("The job is not running."))
+    return redirect(job, job_id=job_id)
+
+
+@require_POST
+def job_resume(request, job_id):
+    """ Continues a failed or cancelled job where it stopped """
+    if not jobs.resume(job_id, jobs.owner_of(request.session),
+                       request.session.get('auth_token', '')):
+        messages.add_message(request, messages.ERROR,
+                             _("The job cannot be resumed."))
+    return redirect(job, job_id=job_id)
+
+
 def toggle_public(request, container):
     """ Sets/unsets '.r:*,.rlistings' container read ACL """
 
@@ -261,7 +808,7 @@ def toggle_public(request, container):
     auth_token = request.session.get('auth_token', '')
 
     try:
-        meta = client.head_container(storage_url, auth_token, container)
+        meta = metadata.head_container(storage_url, auth_token, container)
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
         return redirect(containerview)
@@ -276,7 +823,9 @@ def toggle_public(request, container):
     headers = {'X-Container-Read': read_acl, }
 
     try:
-        client.post_container(storage_url, auth_token, container, headers)
+        metadata.post_container(storage_url, auth_token, container, headers)
+        # Anonymous listings must not outlive the ACL that allowed them
+        listing_cache.invalidate(storage_url, container)
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
 
@@ -284,23 +833,32 @@ def toggle_public(request, container):
 
 
 def public_objectview(request, account, container, prefix=None):
-    """ Returns list of all objects in current container. """
+    """ Returns list of all objects in current container.
+
+    Pages come from the shared public listing cache and carry public
+    Cache-Control and ETag headers, so a CDN can absorb the traffic. """
     storage_url = settings.STORAGE_URL + account
-    auth_token = b''
     try:
-        _meta, objects = client.get_container(
-            storage_url, auth_token, container, delimiter='/', prefix=prefix)
+        fresh_until, etag, objects, page = listing_cache.get_public_page(
+            storage_url, container, prefix=prefix,
+            marker=request.GET.get('marker'),
+            end_marker=request.GET.get('end_marker'),
+            limit=get_page_size(request))
 
     except client.ClientException:
         messages.add_message(request, messages.ERROR, _("Access denied."))
         return redirect(containerview)
 
+    response = public_not_modified(request, etag, fresh_until)
+    if response is not None:
+        return response
+
     prefixes = prefix_list(prefix)
     pseudofolders, objs = pseudofolder_object_list(objects, prefix)
     base_url = get_base_url(request)
     account = storage_url.split('/')[-1]
 
-    return render(request, "publicview.html", {
+    response = render(request, "publicview.html", {
         'container': container,
         'objects': objs,
         'folders': pseudofolders,
@@ -308,7 +866,9 @@ def public_objectview(request, account, container, prefix=None):
         'prefixes': prefixes,
         'base_url': base_url,
         'storage_url': storage_url,
+        'page': page,
         'account': account})
+    return patch_public_cache(request, response, etag, fresh_until)
 
 
 def tempurl(request, container, objectname):
@@ -339,6 +899,101 @@ def tempurl(request, container, objectname):
         'session': request.session})
 
 
+def _update_index(request, storage_url, auth_token, container):
+    """ Updates the search index of a container for a moment and leaves
+    the rest of the pass to a background job """
+    index = search_index.update(storage_url, auth_token, container)
+    if not index['complete'] and cache.add(
+            search_index.job_key(storage_url, container), 1, 3600):
+        jobs.submit('search_index', jobs.owner_of(request.session),
+                    storage_url, auth_token,
+                    _("Index container %s") % container, container=container)
+    return index
+
+
+def search(request, container):
+    """ Searches the objects of a container by name, size and date.
+
+    Queries run against the local search index, which is brought up to
+    date first for SWIFT_SEARCH_UPDATE_BUDGET seconds. A pass that takes
+    longer continues in a background job; results are shown for the part
+    indexed so far. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+
+    form = SearchForm(request.GET or None)
+    try:
+        # The index is shared, so check access with the user's token
+        metadata.head_container(storage_url, auth_token, container)
+        index = _update_index(request, storage_url, auth_token, container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
+
+    results = None
+    if form.is_valid() and any(form.cleaned_data.values()):
+        data = form.cleaned_data
+        db = search_index.connect(storage_url, container)
+        try:
+            results = search_index.query(
+                db, substring=data['q'], pattern=data['pattern'],
+                min_size=data['min_size'], max_size=data['max_size'],
+                modified_after=data['modified_after'] and
+                data['modified_after'].isoformat(),
+                modified_before=data['modified_before'] and
+                data['modified_before'].isoformat(),
+                limit=getattr(settings, 'SWIFT_SEARCH_MAX_RESULTS', 1000))
+        finally:
+            db.close()
+
+    return render(request, 'search.html', {
+        'container': container,
+        'form': form,
+        'index': index,
+        'results': results,
+        'max_results': getattr(settings, 'SWIFT_SEARCH_MAX_RESULTS', 1000),
+        'session': request.session})
+
+
+def usage(request, container, prefix=None):
+    """ Shows the bytes and objects below each pseudofolder, largest first
+
+    Totals come from the local container index and are updated together
+    with it; see swiftapp.search_index. """
+    storage_url = request.session.get('storage_url', '')
+    auth_token = request.session.get('auth_token', '')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+
+    try:
+        metadata.head_container(storage_url, auth_token, container)
+        index = _update_index(request, storage_url, auth_token, container)
+    except client.ClientException:
+        messages.add_message(request, messages.ERROR, _("Access denied."))
+        return redirect(containerview)
+
+    db = search_index.connect(storage_url, container)
+    try:
+        total_bytes, total_objects = search_index.folder_total(db, prefix)
+        folders = search_index.usage(
+            db, prefix, limit=getattr(settings, 'SWIFT_USAGE_MAX_ROWS', 500))
+    finally:
+        db.close()
+    for folder in folders:
+        folder['percent'] = (100.0 * folder['bytes'] / total_bytes
+                             if total_bytes else 0)
+
+    return render(request, 'usage.html', {
+        'container': container,
+        'prefix': prefix,
+        'prefixes': prefix_list(prefix),
+        'index': index,
+        'total_bytes': total_bytes,
+        'total_objects': total_objects,
+        'folders': folders,
+        'session': request.session})
+
+
 def create_pseudofolder(request, container, prefix=None):
     """ Creates a pseudofolder (empty object of type application/directory) """
     storage_url = request.session.get('storage_url', '')
@@ -357,9 +1012,10 @@ def create_pseudofolder(request, container, prefix=None):
         obj = None
 
         try:
-            client.put_object(storage_url, auth_token,
-                              container, foldername, obj,
-                              content_type=content_type)
+            swift.put_object(storage_url, auth_token,
+                             container, foldername, obj,
+                             content_type=content_type)
+            listing_cache.invalidate(storage_url, container)
             messages.add_message(request, messages.INFO,
                                  _("Pseudofolder created."))
         except client.ClientException:
@@ -375,7 +1031,7 @@ def create_pseudofolder(request, container, prefix=None):
 
 def get_acls(storage_url, auth_token, container):
     """ Returns ACLs of given container. """
-    cont = client.head_container(storage_url, auth_token, container)
+    cont = metadata.head_container(storage_url, auth_token, container)
     readers = cont.get('x-container-read', '')
     writers = cont.get('x-container-write', '')
     return (readers, writers)
@@ -395,7 +1051,7 @@ def edit_acl(request, container):
     auth_token = request.session.get('auth_token', '')
 
     try:
-        meta = client.head_container(storage_url, auth_token, container)
+        meta = metadata.head_container(storage_url, auth_token, container)
     except client.ClientException:
         messages.error(request, _("Access denied."))
         return redirect('containerview')
@@ -432,7 +1088,10 @@ def edit_acl(request, container):
             }
 
             try:
-                client.post_container(storage_url, auth_token, container, headers)
+                # Show the ACLs just set without another HEAD
+                meta = metadata.post_container(
+                    storage_url, auth_token, container, headers) or meta
+                listing_cache.invalidate(storage_url, container)
                 messages.success(request, _("ACL updated successfully."))
             except client.ClientException:
                 messages.error(request, _("Failed to update ACL."))
@@ -455,4 +1114,13 @@ def edit_acl(request, container):
         'acls': acls,
         'form': AddACLForm(),
         'session': request.session
-    })
\ No newline at end of file
+    })
+
+
+def swift_metrics(request):
+    """ Exposes the Swift call histograms of this worker for Prometheus """
+    allowed = getattr(settings, 'SWIFT_METRICS_ALLOWED_IPS', None)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
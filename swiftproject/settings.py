@@ -42,6 +42,60 @@ STORAGE_URL = 'http://controller:8080/v1/'
 SWIFT_AUTO_CREATE_CONTAINER = True  # Automatically create containers
 SWIFT_AUTO_CREATE_CONTAINER_PUBLIC = True  # Make containers publicly readable
 SWIFT_EXTRA_OPTIONS = {}
+SWIFT_POOL_MAX_SIZE = 32  # Idle keep-alive connections kept per worker
+SWIFT_POOL_IDLE_TIMEOUT = 30  # Seconds before an idle connection is closed
+SWIFT_TEMP_KEY_CACHE_TIMEOUT = 300  # Seconds the temp URL key is cached per token, in memory
+SWIFT_PAGE_SIZE = 500  # Default number of listing entries per page
+SWIFT_PAGE_SIZES = (100, 500, 1000)  # Page sizes offered in listings
+SWIFT_MAX_PAGE_SIZE = 10000  # Upper bound for the ?limit= parameter
+SWIFT_CAPABILITIES_CACHE_TIMEOUT = 3600  # Seconds /info results are cached
+SWIFT_DELETE_CONCURRENCY = 16  # Parallel DELETEs without bulk-delete
+SWIFT_DELETE_BATCH_SIZE = 1000  # Names per batch without bulk-delete
+SWIFT_COPY_CONCURRENCY = 16  # Parallel server-side copies
+SWIFT_COPY_BATCH_SIZE = 1000  # Objects copied between progress reports
+SWIFT_LISTING_CACHE_TIMEOUT = 300  # Seconds a cached listing may be reused
+SWIFT_SINGLEFLIGHT = True  # Identical concurrent reads share one call
+SWIFT_SINGLEFLIGHT_SHARED = False  # Also across workers; needs Memcached or Redis
+SWIFT_SINGLEFLIGHT_WAIT = 10  # Seconds to wait for another worker's call
+SWIFT_PUBLIC_CACHE_TIMEOUT = 30  # Seconds a public listing is served fresh
+SWIFT_PUBLIC_CACHE_STALE = 300  # Further seconds it is served while refreshed
+# One refresher per public page needs an atomic cache.add (Memcached, Redis);
+# the FileBasedCache below may let two workers refresh a page at once.
+# Serve the read-only views asynchronously (requires httpx, run under ASGI)
+SWIFT_ASYNC_VIEWS = False
+SWIFT_ASYNC_MAX_CONNECTIONS = 256  # Concurrent connections per event loop
+SWIFT_UPLOAD_EXPIRES = 3600  # Seconds an upload form signature is valid
+SWIFT_UPLOAD_MAX_FILE_COUNT = 1000  # Files per FormPost request
+SWIFT_UPLOAD_CONCURRENCY = 4  # Parallel uploads per browser
+SWIFT_UPLOAD_SET_CORS = True  # Allow this site's origin on the container
+SWIFT_SEGMENT_SIZE = 100 * 1024 * 1024  # Segment size of large uploads
+SWIFT_SEGMENT_URL_EXPIRES = 900  # Seconds a segment PUT URL is valid
+SWIFT_ARCHIVE_PREFETCH = 8  # Objects downloaded ahead for ZIP/TAR archives
+SWIFT_ARCHIVE_PREFETCH_MAX_SIZE = 4 * 1024 * 1024  # Larger ones are streamed
+# Keep the password in the server-side session to renew expiring tokens.
+# Off by default: sessions live in the 'sessions' cache, and with the
+# FileBasedCache below every password would be written to disk in plaintext. Only enable
+# it with a memory-only cache (e.g. Memcached or Redis without persistence)
+# that is not shared with untrusted services; otherwise users log in again
+# when their token expires.
+SWIFT_TOKEN_REFRESH = False
+SWIFT_TOKEN_REFRESH_MARGIN = 300  # Seconds before expiry to renew a token
+SWIFT_SEARCH_INDEX_DIR = BASE_DIR / 'index'  # Local container search indexes
+SWIFT_SEARCH_UPDATE_BUDGET = 0.5  # Seconds of indexing per search request; a job does the rest
+SWIFT_SEARCH_MAX_RESULTS = 1000
+SWIFT_USAGE_MAX_ROWS = 500  # Pseudofolders shown on the usage page
+SWIFT_METRICS_ALLOWED_IPS = None  # Client IPs allowed to scrape /metrics/
+# Seconds HEAD results are shared across requests; listings always HEAD anew
+SWIFT_METADATA_CACHE_TIMEOUT = 10
+SWIFT_STREAM_THRESHOLD = 1000  # Larger object pages are streamed
+SWIFT_STREAM_PAGE_SIZE = 1000  # Listing entries fetched per Swift request
+SWIFT_STREAM_MAX_ROWS = 1000000
+SWIFT_STREAM_PAGE_SIZES = (10000, 100000)  # Streamed sizes offered
+SWIFT_TEMP_URL_DIGEST = 'sha256'  # sha1, sha256 or sha512, if allowed
+SWIFT_JOBS_DB = BASE_DIR / 'jobs.sqlite3'  # State of background jobs
+SWIFT_JOBS_WORKERS = 2  # Jobs run at the same time per worker process
+SWIFT_JOBS_HEARTBEAT = 10  # Seconds between checks for jobs of dead workers
+SWIFT_JOBS_STALE_AFTER = 30  # Seconds without a heartbeat before a restart
 
 # Application definition
 
@@ -58,7 +112,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'swiftapp.middleware.SwiftMetricsMiddleware',
+    'swiftapp.middleware.SwiftMetadataMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'swiftapp.middleware.SwiftAuthMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -66,7 +123,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+SESSION_CACHE_ALIAS = 'sessions'  # Not culled along with cached listings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 
 ROOT_URLCONF = 'swiftproject.urls'
@@ -111,6 +169,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Shared by all workers on this host; use memcached or redis when running
+# on more than one host.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            # Listing pages, metadata, locks and generation counters; a
+            # culled generation counter lets older listings come back
+            'MAX_ENTRIES': 20000,
+        },
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -14,18 +14,34 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from swiftapp.views import (
     containerview, objectview, download, delete_object, login, 
     tempurl, upload, create_pseudofolder, create_container, 
-    delete_container, public_objectview, toggle_public, edit_acl
+    delete_container, public_objectview, toggle_public, edit_acl,
+    large_upload, large_upload_segments, large_upload_complete,
+    download_archive, upload_archive, search, usage, swift_metrics,
+    api_containers, api_objects, temp_urls, delete_folder, job_list, job,
+    job_status, job_cancel, job_resume, copy_object, upload_origin
 )
 
+if getattr(settings, 'SWIFT_ASYNC_VIEWS', False):
+    from swiftapp.async_views import (  # noqa: F811
+        containerview, objectview, download, tempurl, public_objectview
+    )
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/', login, name="login"),
+    path('metrics/', swift_metrics, name="swift_metrics"),
     path('', containerview, name="containerview"),
+    path('api/containers/', api_containers, name="api_containers"),
+    path('api/objects/<str:container>/<path:prefix>/',
+         api_objects, name="api_objects"),
+    path('api/objects/<str:container>/',
+         api_objects, name="api_objects"),
     path('public/<str:account>/<str:container>/<path:prefix>/', 
          public_objectview, name="public_objectview"),
     path('public/<str:account>/<str:container>/',
@@ -38,6 +54,20 @@ urlpatterns = [
          upload, name="upload"),
     path('upload/<str:container>/',
          upload, name="upload"),
+    path('upload_origin/<str:container>/',
+         upload_origin, name="upload_origin"),
+    path('upload_archive/<str:container>/<path:prefix>/',
+         upload_archive, name="upload_archive"),
+    path('upload_archive/<str:container>/',
+         upload_archive, name="upload_archive"),
+    path('large_upload/<str:container>/<path:prefix>/',
+         large_upload, name="large_upload"),
+    path('large_upload/<str:container>/',
+         large_upload, name="large_upload"),
+    path('large_upload_segments/<str:container>/',
+         large_upload_segments, name="large_upload_segments"),
+    path('large_upload_complete/<str:container>/',
+         large_upload_complete, name="large_upload_complete"),
     path('create_pseudofolder/<str:container>/<path:prefix>/',
          create_pseudofolder, name="create_pseudofolder"),
     path('create_pseudofolder/<str:container>/',
@@ -48,12 +78,35 @@ urlpatterns = [
          delete_container, name="delete_container"),
     path('download/<str:container>/<path:objectname>/',
          download, name="download"),
+    path('archive/<str:container>/<path:prefix>/',
+         download_archive, name="download_archive"),
+    path('archive/<str:container>/',
+         download_archive, name="download_archive"),
+    path('temp_urls/<str:container>/<path:prefix>/',
+         temp_urls, name="temp_urls"),
+    path('temp_urls/<str:container>/',
+         temp_urls, name="temp_urls"),
+    path('delete_folder/<str:container>/<path:prefix>/',
+         delete_folder, name="delete_folder"),
+    path('copy/<str:container>/<path:objectname>/',
+         copy_object, name="copy_object"),
     path('delete/<str:container>/<path:objectname>/',
          delete_object, name="delete_object"),
+    path('search/<str:container>/',
+         search, name="search"),
+    path('usage/<str:container>/<path:prefix>/',
+         usage, name="usage"),
+    path('usage/<str:container>/',
+         usage, name="usage"),
     path('objects/<str:container>/<path:prefix>/',
          objectview, name="objectview"),
     path('objects/<str:container>/',
          objectview, name="objectview"),
+    path('jobs/', job_list, name="job_list"),
+    path('jobs/<str:job_id>/', job, name="job"),
+    path('jobs/<str:job_id>/status/', job_status, name="job_status"),
+    path('jobs/<str:job_id>/cancel/', job_cancel, name="job_cancel"),
+    path('jobs/<str:job_id>/resume/', job_resume, name="job_resume"),
     path('acls/<str:container>/',
          edit_acl, name="edit_acl"),
 ]